@@ -1,12 +1,40 @@
 import os
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import Optional
+from zipfile import ZIP_STORED
 from zipfile import ZipFile
+from zipfile import ZipInfo
 
 from documents.models import Document
 
+# formats that are compressed already and barely shrink any further
+COMPRESSED_MIME_TYPES = {
+    "application/pdf",
+    "application/zip",
+    "image/jpeg",
+    "image/png",
+    "image/webp",
+    "image/gif",
+}
+
+# size of the pieces files are read and streamed in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# a file to add to the archive: path on disk, name in the archive, mime type
+ArchiveEntry = tuple[str, str, str]
+
 
 class BulkArchiveStrategy:
-    def __init__(self, zipf: ZipFile, follow_formatting: bool = False):
+    def __init__(
+        self,
+        zipf: ZipFile,
+        follow_formatting: bool = False,
+        store_compressed: bool = False,
+    ):
         self.zipf = zipf
+        self.store_compressed = store_compressed
+        self.names = set(zipf.namelist())
         if follow_formatting:
             self.make_unique_filename = self._formatted_filepath
         else:
@@ -27,9 +55,10 @@ class BulkArchiveStrategy:
         counter = 0
         while True:
             filename = folder + doc.get_public_filename(archive, counter)
-            if filename in self.zipf.namelist():
+            if filename in self.names:
                 counter += 1
             else:
+                self.names.add(filename)
                 return filename
 
     def _formatted_filepath(
@@ -51,35 +80,119 @@ class BulkArchiveStrategy:
 
         return in_archive_path
 
-    def add_document(self, doc: Document):
+    def compress_type(self, mime_type: str) -> Optional[int]:
+        """
+        Returns the compression of an entry, storing already compressed
+        formats if requested and the archive's compression otherwise
+        """
+        if self.store_compressed and mime_type in COMPRESSED_MIME_TYPES:
+            return ZIP_STORED
+        return None
+
+    def entries(self, doc: Document) -> Iterator[ArchiveEntry]:
         raise NotImplementedError  # pragma: no cover
 
+    def add_document(self, doc: Document):
+        for source, arcname, mime_type in self.entries(doc):
+            self.zipf.write(
+                source,
+                arcname,
+                compress_type=self.compress_type(mime_type),
+            )
+
 
 class OriginalsOnlyStrategy(BulkArchiveStrategy):
-    def add_document(self, doc: Document):
-        self.zipf.write(doc.source_path, self.make_unique_filename(doc))
+    def entries(self, doc: Document) -> Iterator[ArchiveEntry]:
+        yield doc.source_path, self.make_unique_filename(doc), doc.mime_type
 
 
 class ArchiveOnlyStrategy(BulkArchiveStrategy):
-    def add_document(self, doc: Document):
+    def entries(self, doc: Document) -> Iterator[ArchiveEntry]:
         if doc.has_archive_version:
-            self.zipf.write(
+            yield (
                 doc.archive_path,
                 self.make_unique_filename(doc, archive=True),
+                "application/pdf",
             )
         else:
-            self.zipf.write(doc.source_path, self.make_unique_filename(doc))
+            yield doc.source_path, self.make_unique_filename(doc), doc.mime_type
 
 
 class OriginalAndArchiveStrategy(BulkArchiveStrategy):
-    def add_document(self, doc: Document):
+    def entries(self, doc: Document) -> Iterator[ArchiveEntry]:
         if doc.has_archive_version:
-            self.zipf.write(
+            yield (
                 doc.archive_path,
                 self.make_unique_filename(doc, archive=True, folder="archive/"),
+                "application/pdf",
             )
 
-        self.zipf.write(
+        yield (
             doc.source_path,
             self.make_unique_filename(doc, folder="originals/"),
+            doc.mime_type,
         )
+
+
+def zip_strategy(content: str) -> type[BulkArchiveStrategy]:
+    """
+    Returns the strategy adding the archived versions, the originals or both
+    """
+    if content == "both":
+        return OriginalAndArchiveStrategy
+    elif content == "originals":
+        return OriginalsOnlyStrategy
+    return ArchiveOnlyStrategy
+
+
+class _StreamBuffer:
+    """
+    A write-only, unseekable file collecting the bytes zipfile writes until
+    they are taken out and sent
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(
+    documents: Iterable[Document],
+    strategy_class: type[BulkArchiveStrategy],
+    compression: int = ZIP_STORED,
+    follow_formatting: bool = False,
+    store_compressed: bool = False,
+) -> Iterator[bytes]:
+    """
+    Yields a zip archive of documents while it is written, without a
+    temporary file. Files are read in chunks and every compressed chunk is
+    sent right away, so memory does not grow with the size of the files.
+    """
+    buffer = _StreamBuffer()
+    with ZipFile(buffer, "w", compression) as zipf:
+        strategy = strategy_class(zipf, follow_formatting, store_compressed)
+        for doc in documents:
+            for source, arcname, mime_type in strategy.entries(doc):
+                info = ZipInfo.from_file(source, arcname)
+                info.compress_type = strategy.compress_type(mime_type)
+                if info.compress_type is None:
+                    info.compress_type = compression
+                with open(source, "rb") as f, zipf.open(info, "w") as entry:
+                    while chunk := f.read(STREAM_CHUNK_SIZE):
+                        entry.write(chunk)
+                        if data := buffer.take():
+                            yield data
+                if data := buffer.take():
+                    yield data
+    yield buffer.take()
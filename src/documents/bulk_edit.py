@@ -1,4 +1,3 @@
-import hashlib
 import itertools
 import logging
 import os
@@ -7,10 +6,12 @@ from typing import Optional
 from celery import chord
 from django.conf import settings
 from django.db.models import Q
+from django.utils import timezone
 
 from documents.data_models import ConsumableDocument
 from documents.data_models import DocumentMetadataOverrides
 from documents.data_models import DocumentSource
+from documents.file_handling import fill_document_sizes
 from documents.models import Correspondent, Dossier
 from documents.models import Document
 from documents.models import DocumentType
@@ -21,6 +22,9 @@ from documents.permissions import set_permissions_for_object
 from documents.tasks import bulk_update_documents, update_document_field
 from documents.tasks import consume_file
 from documents.tasks import update_document_archive_file
+from documents.tree import reassign_document_aggregates
+from documents.utils import compute_checksum
+from documents.utils import compute_quick_checksum
 
 logger = logging.getLogger("paperless.bulk_edit")
 
@@ -31,7 +35,7 @@ def set_correspondent(doc_ids, correspondent):
 
     qs = Document.objects.filter(Q(id__in=doc_ids) & ~Q(correspondent=correspondent))
     affected_docs = [doc.id for doc in qs]
-    qs.update(correspondent=correspondent)
+    qs.update(correspondent=correspondent, modified=timezone.now())
 
     bulk_update_documents.delay(document_ids=affected_docs)
 
@@ -46,7 +50,7 @@ def set_storage_path(doc_ids, storage_path):
         Q(id__in=doc_ids) & ~Q(storage_path=storage_path),
     )
     affected_docs = [doc.id for doc in qs]
-    qs.update(storage_path=storage_path)
+    qs.update(storage_path=storage_path, modified=timezone.now())
 
     bulk_update_documents.delay(
         document_ids=affected_docs,
@@ -62,7 +66,8 @@ def set_folder(doc_ids, folder):
         Q(id__in=doc_ids) & ~Q(folder=folder),
     )
     affected_docs = [doc.id for doc in qs]
-    qs.update(folder=folder)
+    reassign_document_aggregates(Folder, qs, folder)
+    qs.update(folder=folder, modified=timezone.now())
 
     bulk_update_documents.delay(
         document_ids=affected_docs,
@@ -78,7 +83,8 @@ def set_dossier(doc_ids, dossier):
         Q(id__in=doc_ids) & ~Q(dossier=dossier),
     )
     affected_docs = [doc.id for doc in qs]
-    qs.update(dossier=dossier)
+    reassign_document_aggregates(Dossier, qs, dossier)
+    qs.update(dossier=dossier, modified=timezone.now())
 
     bulk_update_documents.delay(
         document_ids=affected_docs,
@@ -94,7 +100,8 @@ def set_warehouse(doc_ids, warehouse):
         Q(id__in=doc_ids) & ~Q(warehouse=warehouse),
     )
     affected_docs = [doc.id for doc in qs]
-    qs.update(warehouse=warehouse)
+    reassign_document_aggregates(Warehouse, qs, warehouse)
+    qs.update(warehouse=warehouse, modified=timezone.now())
 
     bulk_update_documents.delay(
         document_ids=affected_docs,
@@ -109,7 +116,7 @@ def set_document_type(doc_ids, document_type):
 
     qs = Document.objects.filter(Q(id__in=doc_ids) & ~Q(document_type=document_type))
     affected_docs = [doc.id for doc in qs]
-    qs.update(document_type=document_type)
+    qs.update(document_type=document_type, modified=timezone.now())
 
     bulk_update_documents.delay(document_ids=affected_docs)
 
@@ -125,6 +132,7 @@ def add_tag(doc_ids, tag):
     DocumentTagRelationship.objects.bulk_create(
         [DocumentTagRelationship(document_id=doc, tag_id=tag) for doc in affected_docs],
     )
+    Document.objects.filter(id__in=affected_docs).update(modified=timezone.now())
 
     bulk_update_documents.delay(document_ids=affected_docs)
 
@@ -140,6 +148,7 @@ def remove_tag(doc_ids, tag):
     DocumentTagRelationship.objects.filter(
         Q(document_id__in=affected_docs) & Q(tag_id=tag),
     ).delete()
+    Document.objects.filter(id__in=affected_docs).update(modified=timezone.now())
 
     bulk_update_documents.delay(document_ids=affected_docs)
 
@@ -164,6 +173,7 @@ def modify_tags(doc_ids, add_tags, remove_tags):
         ],
         ignore_conflicts=True,
     )
+    qs.update(modified=timezone.now())
 
     bulk_update_documents.delay(document_ids=affected_docs)
 
@@ -185,9 +195,7 @@ def delete(doc_ids):
     docs.delete()
     from documents import index
 
-    with index.open_index_writer() as writer:
-        for id in doc_ids:
-            index.remove_document_by_id(writer, id)
+    index.queue_index_update(doc_ids)
 
     return "OK"
 
@@ -215,8 +223,9 @@ def set_permissions(doc_ids, set_permissions, owner=None, merge=False):
     if merge:
         # If merging, only set owner for documents that don't have an owner
         qs.filter(owner__isnull=True).update(owner=owner)
+        qs.update(modified=timezone.now())
     else:
-        qs.update(owner=owner)
+        qs.update(owner=owner, modified=timezone.now())
 
     for doc in qs:
         set_permissions_for_object(permissions=set_permissions, object=doc, merge=merge)
@@ -248,7 +257,9 @@ def rotate(doc_ids: list[int], degrees: int):
                 for page in pdf.pages:
                     page.rotate(degrees, relative=True)
                 pdf.save()
-                doc.checksum = hashlib.md5(doc.source_path.read_bytes()).hexdigest()
+                doc.checksum = compute_checksum(doc.source_path)
+                doc.quick_checksum = compute_quick_checksum(doc.source_path)
+                fill_document_sizes(doc, force=True)
                 doc.save()
                 rotate_tasks.append(
                     update_document_archive_file.s(
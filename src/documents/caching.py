@@ -1,4 +1,5 @@
 import logging
+import uuid
 from binascii import hexlify
 from dataclasses import dataclass
 from typing import TYPE_CHECKING
@@ -23,6 +24,12 @@ class MetadataCacheData:
     archive_metadata: Optional[list]
 
 
+@dataclass(frozen=True)
+class BreadcrumbCacheData:
+    tree_version: str
+    breadcrumbs: list
+
+
 @dataclass(frozen=True)
 class SuggestionCacheData:
     classifier_version: int
@@ -207,3 +214,74 @@ def clear_document_caches(document_id: int) -> None:
             get_thumbnail_modified_key(document_id),
         ],
     )
+
+
+def get_tree_version_key(model_name: str) -> str:
+    """
+    Returns the key of the version of a tree, which changes whenever nodes
+    of the tree are moved, renamed or deleted
+    """
+    return f"tree_{model_name}_version"
+
+
+def get_breadcrumb_cache_key(model_name: str, node_id: int) -> str:
+    """
+    Returns the basic key for the breadcrumbs of a tree node
+    """
+    return f"tree_{model_name}_{node_id}_breadcrumbs"
+
+
+def get_breadcrumb_cache(model_name: str, node_id: int) -> Optional[list]:
+    """
+    Returns the cached breadcrumbs of the given node, as long as they were
+    cached with the current version of its tree
+    """
+    version_key = get_tree_version_key(model_name)
+    node_key = get_breadcrumb_cache_key(model_name, node_id)
+    cache_hits = cache.get_many([version_key, node_key])
+    if node_key in cache_hits:
+        data: BreadcrumbCacheData = cache_hits[node_key]
+        if cache_hits.get(version_key) == data.tree_version:
+            return data.breadcrumbs
+        cache.delete(node_key)
+    return None
+
+
+def get_tree_version(model_name: str) -> Optional[str]:
+    """
+    Returns the current version of a tree, starting a new one if there is
+    none. Read it before loading the breadcrumbs to cache, so a change
+    committed in the meantime makes them stale instead of current.
+    """
+    version_key = get_tree_version_key(model_name)
+    # a missing version was never set or evicted, start a new one so older
+    # entries cannot match it
+    cache.add(version_key, uuid.uuid4().hex, None)
+    return cache.get(version_key)
+
+
+def set_breadcrumb_cache(
+    model_name: str,
+    node_id: int,
+    tree_version: Optional[str],
+    breadcrumbs: list,
+    *,
+    timeout: int = CACHE_50_MINUTES,
+) -> None:
+    """
+    Caches the breadcrumbs of the given node for the given version of its
+    tree, as returned by get_tree_version before they were loaded
+    """
+    if tree_version is not None:
+        cache.set(
+            get_breadcrumb_cache_key(model_name, node_id),
+            BreadcrumbCacheData(tree_version, breadcrumbs),
+            timeout,
+        )
+
+
+def invalidate_breadcrumb_cache(model_name: str) -> None:
+    """
+    Invalidates the cached breadcrumbs of all nodes of a tree
+    """
+    cache.set(get_tree_version_key(model_name), uuid.uuid4().hex, None)
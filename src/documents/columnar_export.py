@@ -0,0 +1,201 @@
+import csv
+import datetime
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+from typing import Optional
+
+from django.db.models import QuerySet
+
+from documents.dossier_fields import VALUE_FIELDS
+from documents.dossier_fields import value_from_text
+from documents.excel_export import ProgressCallback
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+# documents are read from a server side cursor in chunks of this size, which
+# is also the size of the row groups of parquet files
+COLUMNAR_CHUNK_SIZE = 5000
+
+# the columns every row starts with and the document fields they are read from
+DOCUMENT_COLUMNS = [
+    ("id", "pk"),
+    ("title", "title"),
+    ("correspondent", "correspondent__name"),
+    ("document_type", "document_type__name"),
+    ("created", "created"),
+    ("added", "added"),
+    ("mime_type", "mime_type"),
+    ("archive_serial_number", "archive_serial_number"),
+    ("original_size", "original_size"),
+]
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def typed_fields(documents: QuerySet) -> list[tuple[int, str, str]]:
+    """
+    Returns the id, name and data type of every custom field set on any of
+    the documents, ordered by name
+    """
+    return list(
+        CustomField.objects.filter(
+            fields__document__in=documents.values("id"),
+        )
+        .distinct()
+        .order_by("name", "pk")
+        .values_list("pk", "name", "data_type"),
+    )
+
+
+def iter_typed_chunks(
+    documents: QuerySet,
+    fields: list[tuple[int, str, str]],
+    chunk_size: int = COLUMNAR_CHUNK_SIZE,
+) -> Iterator[list[tuple]]:
+    """
+    Yields the rows of documents in chunks, with the value of every custom
+    field from the column of its data type in a column of its own.
+
+    The documents are read from a server side cursor and the field values of
+    every chunk are loaded with one query, so memory is bounded by the chunk
+    size no matter how many documents are exported.
+    """
+    columns = {field_id: i for i, (field_id, _, _) in enumerate(fields)}
+    data_types = {field_id: data_type for field_id, _, data_type in fields}
+    value_fields = sorted(set(VALUE_FIELDS.values()))
+
+    rows = documents.order_by("pk").values_list(
+        *[lookup for _, lookup in DOCUMENT_COLUMNS],
+    )
+    chunk = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _typed_chunk(chunk, columns, data_types, value_fields)
+            chunk = []
+    if chunk:
+        yield _typed_chunk(chunk, columns, data_types, value_fields)
+
+
+def _typed_chunk(chunk, columns, data_types, value_fields) -> list[tuple]:
+    values = {}
+    for document_id, field_id, *field_values in CustomFieldInstance.objects.filter(
+        document_id__in=[row[0] for row in chunk],
+    ).values_list("document_id", "field_id", *value_fields):
+        stored = dict(zip(value_fields, field_values))
+        data_type = data_types[field_id]
+        value = stored[VALUE_FIELDS[data_type]]
+        if value is None and stored["value_text"]:
+            value = value_from_text(data_type, stored["value_text"])
+        values.setdefault(document_id, {})[field_id] = value
+
+    typed = []
+    for row in chunk:
+        row_fields = [None] * len(columns)
+        for field_id, value in values.get(row[0], {}).items():
+            row_fields[columns[field_id]] = value
+        typed.append((*row, *row_fields))
+    return typed
+
+
+def _csv_value(value) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, list):
+        return ",".join(str(v) for v in value)
+    return value
+
+
+def write_typed_csv(
+    documents: QuerySet,
+    path: Path,
+    progress: Optional[ProgressCallback] = None,
+) -> None:
+    """
+    Writes documents to a CSV file with one column per custom field, dates in
+    ISO 8601 and numbers unformatted
+    """
+    fields = typed_fields(documents)
+    total = documents.count() if progress is not None else 0
+    written = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            [name for name, _ in DOCUMENT_COLUMNS] + [name for _, name, _ in fields],
+        )
+        for chunk in iter_typed_chunks(documents, fields):
+            writer.writerows([_csv_value(v) for v in row] for row in chunk)
+            written += len(chunk)
+            if progress is not None:
+                progress(written, total)
+
+
+def _parquet_schema(fields: list[tuple[int, str, str]]):
+    timestamp = pa.timestamp("us", tz="UTC")
+    document_types = {
+        "id": pa.int64(),
+        "created": timestamp,
+        "added": timestamp,
+        "archive_serial_number": pa.int64(),
+        "original_size": pa.int64(),
+    }
+    field_types = {
+        CustomField.FieldDataType.DATE: pa.date32(),
+        CustomField.FieldDataType.BOOL: pa.bool_(),
+        CustomField.FieldDataType.INT: pa.int64(),
+        CustomField.FieldDataType.FLOAT: pa.float64(),
+        CustomField.FieldDataType.DOCUMENTLINK: pa.list_(pa.int64()),
+    }
+    return pa.schema(
+        [(name, document_types.get(name, pa.string())) for name, _ in DOCUMENT_COLUMNS]
+        + [
+            (name, field_types.get(data_type, pa.string()))
+            for _, name, data_type in fields
+        ],
+    )
+
+
+def write_parquet(
+    documents: QuerySet,
+    path: Path,
+    progress: Optional[ProgressCallback] = None,
+) -> None:
+    """
+    Writes documents to a parquet file with one typed column per custom
+    field, one row group per chunk of documents. Requires pyarrow.
+    """
+    if not parquet_available():
+        raise RuntimeError("Parquet exports require pyarrow to be installed")
+
+    fields = typed_fields(documents)
+    schema = _parquet_schema(fields)
+    total = documents.count() if progress is not None else 0
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_typed_chunks(documents, fields):
+            writer.write_table(
+                pa.Table.from_arrays(
+                    [
+                        pa.array(column, type=schema.field(i).type)
+                        for i, column in enumerate(zip(*chunk))
+                    ],
+                    schema=schema,
+                ),
+            )
+            written += len(chunk)
+            if progress is not None:
+                progress(written, total)
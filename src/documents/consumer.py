@@ -2,6 +2,7 @@ import datetime
 import hashlib
 import os
 import tempfile
+import time
 import uuid
 from enum import Enum
 from pathlib import Path
@@ -21,6 +22,10 @@ from rest_framework.reverse import reverse
 
 from documents.classifier import load_classifier
 from documents.data_models import DocumentMetadataOverrides
+from documents.dossier_fields import dependent_dossier_ids
+from documents.dossier_fields import refresh_dossier_fields
+from documents.dossier_fields import refresh_dossier_fields_by_id
+from documents.dossier_fields import refresh_instance_dossier_fields
 from documents.file_handling import create_source_path_directory
 from documents.file_handling import generate_unique_filename
 from documents.loggers import LoggingMixin
@@ -48,8 +53,14 @@ from documents.plugins.base import AlwaysRunPluginMixin
 from documents.plugins.base import ConsumeTaskPlugin
 from documents.plugins.base import NoCleanupPluginMixin
 from documents.plugins.base import NoSetupPluginMixin
+from documents.plugins.helpers import get_status_update_groups
 from documents.signals import document_consumption_finished
 from documents.signals import document_consumption_started
+from documents.tree import PATH_SEPARATOR
+from documents.tree import build_path
+from documents.tree import path_ids
+from documents.utils import compute_checksum
+from documents.utils import compute_quick_checksum
 from documents.utils import copy_basic_file_stats
 from documents.utils import copy_file_with_basic_stats
 from documents.utils import run_subprocess
@@ -270,6 +281,19 @@ class Consumer(LoggingMixin):
         message: Optional[ConsumerStatusShortMessage] = None,
         document_id=None,
     ):  # pragma: no cover
+        # Plain progress updates from the parser arrive far more often than
+        # anybody can follow them. Send at most one per interval, any dropped
+        # value is superseded by the next update which gets through.
+        if status == ConsumerFilePhase.WORKING and message is None:
+            if current_progress == self._last_progress or (
+                self._last_progress_time is not None
+                and time.monotonic() - self._last_progress_time
+                < settings.CONSUMER_PROGRESS_INTERVAL
+            ):
+                return
+        self._last_progress = current_progress
+        self._last_progress_time = time.monotonic()
+
         payload = {
             "filename": os.path.basename(self.filename) if self.filename else None,
             "task_id": self.task_id,
@@ -280,10 +304,11 @@ class Consumer(LoggingMixin):
             "document_id": document_id,
             "owner_id": self.override_owner_id if self.override_owner_id else None,
         }
-        async_to_sync(self.channel_layer.group_send)(
-            "status_updates",
-            {"type": "status_update", "data": payload},
-        )
+        for group in get_status_update_groups(payload["owner_id"]):
+            async_to_sync(self.channel_layer.group_send)(
+                group,
+                {"type": "status_update", "data": payload},
+            )
 
     def _fail(
         self,
@@ -312,6 +337,10 @@ class Consumer(LoggingMixin):
         self.task_id = None
         self.override_owner_id = None
         self.override_custom_field_ids = None
+        self._last_progress = None
+        self._last_progress_time = None
+        self.checksum = None
+        self.quick_checksum = None
 
         self.channel_layer = get_channel_layer()
 
@@ -327,12 +356,42 @@ class Consumer(LoggingMixin):
 
     def pre_check_duplicate(self):
         """
-        Using the MD5 of the file, check this exact file doesn't already exist
+        Using the MD5 of the file, check this exact file doesn't already exist.
+        The whole file is only hashed if a document with the same size, start
+        and end exists, otherwise it can't be a duplicate. Documents without
+        a quick checksum are only candidates if they are encrypted, have the
+        same size or no known size at all, until document_quick_checksums and
+        document_sizes have filled them.
         """
-        with open(self.original_path, "rb") as f:
-            checksum = hashlib.md5(f.read()).hexdigest()
-        existing_doc = Document.objects.filter(
-            Q(checksum=checksum) | Q(archive_checksum=checksum),
+        self.quick_checksum = compute_quick_checksum(self.original_path)
+        self.checksum = None
+        size = os.path.getsize(self.original_path)
+        candidates = Document.objects.filter(
+            Q(quick_checksum=self.quick_checksum)
+            | Q(archive_quick_checksum=self.quick_checksum)
+            # the quick checksum of an encrypted file is not the one of the
+            # original, so encrypted documents can't be filtered by it
+            | Q(storage_type=Document.STORAGE_TYPE_GPG, quick_checksum__isnull=True)
+            | Q(quick_checksum__isnull=True, original_size=size)
+            | Q(quick_checksum__isnull=True, original_size__isnull=True)
+            | Q(
+                archive_checksum__isnull=False,
+                archive_quick_checksum__isnull=True,
+                archive_size=size,
+            )
+            | Q(
+                archive_checksum__isnull=False,
+                archive_quick_checksum__isnull=True,
+                archive_size__isnull=True,
+            ),
+        )
+        if not candidates.exists():
+            return
+
+        # kept for _store, unless a pre-consume script changes the working copy
+        self.checksum = compute_checksum(self.original_path)
+        existing_doc = candidates.filter(
+            Q(checksum=self.checksum) | Q(archive_checksum=self.checksum),
         )
         if existing_doc.exists():
             if settings.CONSUMER_DELETE_DUPLICATES:
@@ -515,88 +574,137 @@ class Consumer(LoggingMixin):
                     for f in fields:
                         f.value_text = map_fields.get(f.field.name,None)
                     CustomFieldInstance.objects.bulk_update(fields, ['value_text'])
+                    refresh_instance_dossier_fields([f.pk for f in fields])
         except Exception as e:
             self.log.error("error ocr field",e)
 
     def fill_custom_field(self,document:Document, data_ocr_fields, dossier_file:Dossier):
+        """
+        Fills the custom fields of the new document from the OCR fields and
+        passes the values on to the referencing fields of the ancestor
+        dossiers. All instances involved are loaded with a single query and
+        written back in bulk, to keep the consume transaction short.
+        """
+        if data_ocr_fields is None or not isinstance(data_ocr_fields[0], list):
+            return
+        if len(data_ocr_fields[0]) < 1:
+            return
+
         dict_data = {}
-        if data_ocr_fields is not None and isinstance(data_ocr_fields[0], list) == True:
-            if len(data_ocr_fields[0])>=1:
-                for r in data_ocr_fields[0][0].get("fields"):
-
-                    dict_data[r.get("name")] = r.get("values")[0].get("value") if r.get("values") else None
-                custom_fields = CustomFieldInstance.objects.filter(dossier=document.dossier)
-                document_dossier_form = self.get_config_dossier_form()
-                custom_fields_form = CustomFieldInstance.objects.filter(dossier_form=document_dossier_form)
-                # map custom_fields to dict for search
-                dict_custom_fields = {}
-                for f in custom_fields:
-                    dict_custom_fields[f.field] = f
-                if(custom_fields_form):
-                    for r in custom_fields_form:
-                        r: CustomFieldInstance
-
-                        if dict_custom_fields.get(r.field) is not None:
-                            dict_custom_fields[r.field].value_text=dict_data.get(r.match_value)
-                        # self.log.info('gia tri field',r.field)
-                        # r.value_text = dict_data.get(r.match_value)
-                        # self.log.debug("gia tri value map",r.match_value)
-                        # create dossier file
-                        CustomFieldInstance.objects.update_or_create(field=r.field,
-                                                                     document=document,
-                                                                     defaults={"value_text":dict_data.get(r.match_value),"dossier":dossier_file})
-
-                #     for r in custom_fields:
-                #         r: CustomFieldInstance
-
-                #         r.value_text = dict_data.get(r.match_value)
-                #         # self.log.debug("gia tri value map",r.match_value)
-                #         # create dossier file
-                #         # CustomFieldInstance.objects.create(field=r.field,
-                #         #                                    value_text=dict_data.get(r.match_value),
-                #         #                                    dossier = dossier_file,
-                #         #                                    document=document)
-
-                CustomFieldInstance.objects.bulk_update(custom_fields, ['value_text'])
-                # assign new value to dossier by dossier_form----------------
-
-                # get custom field be assign
-                query_custom_fields_dossier_document_form = CustomFieldInstance.objects.filter(dossier_form=document_dossier_form, reference__isnull=True)
-                dict_custom_fields_dossier_document_form = {obj.field.id: obj for obj in query_custom_fields_dossier_document_form}
-                query_custom_fields_dossier_document = CustomFieldInstance.objects.filter(dossier=document.dossier,reference__isnull=True)
-                dict_custom_fields_dossier_document = {obj.field.id: obj for obj in query_custom_fields_dossier_document}
-                dict_custom_fields_document_reference = {}
-                for field, obj in dict_custom_fields_dossier_document_form.items():
-                    if dict_custom_fields_dossier_document.get(field) is not None:
-
-                        dict_custom_fields_document_reference[obj.id]=dict_custom_fields_dossier_document.get(field)
-
-                # get dossier_form by document_form
-                lst_id_dossier = dossier_file.path.split("/")
-                lst_id_dossier = [int(num) for num in lst_id_dossier]
-                lst_dossiers = Dossier.objects.filter(id__in=lst_id_dossier,type="DOSSIER")
-                # dossier_forms = custom_fields = CustomFieldInstance.objects.filter(dossier_form=document_dossier_form)
-                for d in lst_dossiers:
-                    query_custom_fields_dossier_form = CustomFieldInstance.objects.filter(dossier_form=d.dossier_form,reference__isnull=False)
-                    dict_custom_fields_dossier_form = {obj.field.id: obj for obj in query_custom_fields_dossier_form}
-                    query_custom_fields_dossier = CustomFieldInstance.objects.filter(dossier=d,reference__isnull=True)
-                    dict_custom_fields_dossier = {obj.field.id: obj for obj in query_custom_fields_dossier}
-                    dict_custom_fields_dossier_reference = {}
-                    for field, obj in dict_custom_fields_dossier_form.items():
-                        if dict_custom_fields_dossier.get(field) is not None:
-                            dict_custom_fields_dossier_reference[obj.reference.id]=dict_custom_fields_dossier.get(field)
-                        elif dict_custom_fields_dossier.get(field) is None:
-                            CustomFieldInstance.objects.create(field=obj.field,
-                                                           value_text='',
-                                                           dossier = d,
-                                                        )
-                    for field, obj in dict_custom_fields_dossier_reference.items():
-                        if dict_custom_fields_document_reference.get(field) is not None:
-                            obj:CustomFieldInstance
-                            obj.value_text=dict_custom_fields_document_reference.get(field).value_text
-                    CustomFieldInstance.objects.bulk_update(dict_custom_fields_dossier_reference.values(), ['value_text'])
+        for r in data_ocr_fields[0][0].get("fields"):
+            dict_data[r.get("name")] = r.get("values")[0].get("value") if r.get("values") else None
+
+        document_dossier_form = self.get_config_dossier_form()
+        # the last part of the path is the new dossier itself
+        ancestor_ids = path_ids(dossier_file.path)[:-1]
+        ancestors = list(
+            Dossier.objects.filter(id__in=ancestor_ids, type="DOSSIER").only(
+                "id",
+                "dossier_form_id",
+            ),
+        )
 
+        dossier_ids = {d.id for d in ancestors}
+        if document.dossier_id is not None:
+            dossier_ids.add(document.dossier_id)
+        form_ids = {d.dossier_form_id for d in ancestors if d.dossier_form_id}
+        if document_dossier_form is not None:
+            form_ids.add(document_dossier_form.id)
+
+        instances = list(
+            CustomFieldInstance.objects.filter(
+                Q(dossier_id__in=dossier_ids)
+                | Q(dossier_form_id__in=form_ids)
+                | Q(document=document),
+            ).order_by("created", "pk"),
+        )
 
+        def by_field(instances_):
+            return {i.field_id: i for i in instances_}
+
+        dossier_instances = [i for i in instances if i.dossier_id is not None and i.dossier_id == document.dossier_id]
+        form_instances = (
+            [i for i in instances if i.dossier_form_id == document_dossier_form.id]
+            if document_dossier_form is not None
+            else []
+        )
+        document_instances = by_field(i for i in instances if i.document_id == document.pk)
+        dict_custom_fields = by_field(dossier_instances)
+
+        to_update = {}
+        to_create = []
+        document_updates = []
+
+        # values of the document and of its dossier, from the OCR fields
+        document_values = {}
+        for r in form_instances:
+            value = dict_data.get(r.match_value)
+            if r.field_id in dict_custom_fields:
+                dict_custom_fields[r.field_id].value_text = value
+                to_update[dict_custom_fields[r.field_id].pk] = dict_custom_fields[r.field_id]
+            document_values[r.field_id] = value
+        for field_id, value in document_values.items():
+            instance = document_instances.get(field_id)
+            if instance is None:
+                to_create.append(
+                    CustomFieldInstance(
+                        field_id=field_id,
+                        document=document,
+                        value_text=value,
+                        dossier=dossier_file,
+                    ),
+                )
+            else:
+                instance.value_text = value
+                instance.dossier = dossier_file
+                document_updates.append(instance)
+
+        # dossier fields referenced from the form fields of the ancestors
+        dict_custom_fields_dossier_document_form = by_field(i for i in form_instances if i.reference_id is None)
+        dict_custom_fields_dossier_document = by_field(i for i in dossier_instances if i.reference_id is None)
+        dict_custom_fields_document_reference = {}
+        for field, obj in dict_custom_fields_dossier_document_form.items():
+            if dict_custom_fields_dossier_document.get(field) is not None:
+                dict_custom_fields_document_reference[obj.id] = dict_custom_fields_dossier_document.get(field)
+
+        # assign the values to the ancestor dossiers, by their dossier forms
+        for d in ancestors:
+            dict_custom_fields_dossier_form = by_field(
+                i for i in instances
+                if d.dossier_form_id is not None and i.dossier_form_id == d.dossier_form_id and i.reference_id is not None
+            )
+            dict_custom_fields_dossier = by_field(
+                i for i in instances if i.dossier_id == d.id and i.reference_id is None
+            )
+            for field, obj in dict_custom_fields_dossier_form.items():
+                dossier_instance = dict_custom_fields_dossier.get(field)
+                if dossier_instance is None:
+                    to_create.append(CustomFieldInstance(field_id=field, value_text='', dossier=d))
+                elif dict_custom_fields_document_reference.get(obj.reference_id) is not None:
+                    dossier_instance.value_text = dict_custom_fields_document_reference[obj.reference_id].value_text
+                    to_update[dossier_instance.pk] = dossier_instance
+
+        CustomFieldInstance.objects.bulk_create(to_create)
+        CustomFieldInstance.objects.bulk_update(document_updates, ['value_text', 'dossier'])
+        CustomFieldInstance.objects.bulk_update(to_update.values(), ['value_text'])
+
+        # bulk writes send no signals, refresh the inherited values below the
+        # topmost dossier that changed, all of them lie on the path of the file
+        changed = (
+            {i.dossier_id for i in to_create}
+            | dependent_dossier_ids(
+                [i.pk for i in document_updates] + list(to_update),
+            )
+            | {dossier_file.id}
+        )
+        file_path = path_ids(dossier_file.path)
+        on_path = [i for i, pk in enumerate(file_path) if pk in changed]
+        if on_path and changed <= set(file_path):
+            refresh_dossier_fields(
+                [PATH_SEPARATOR.join(str(pk) for pk in file_path[: on_path[0] + 1])],
+            )
+        else:
+            refresh_dossier_fields_by_id(changed)
 
     def get_config_dossier_form(self):
         if self.override_dossier_id is None:
@@ -700,6 +808,12 @@ class Consumer(LoggingMixin):
 
         self.run_pre_consume_script()
 
+        if settings.PRE_CONSUME_SCRIPT:
+            # the script may have changed the working copy, which is what gets
+            # stored, so the checksums of the original no longer apply
+            self.checksum = None
+            self.quick_checksum = compute_quick_checksum(self.working_copy)
+
         def progress_callback(current_progress, max_progress):  # pragma: no cover
             # recalculate progress to be within 20 and 80
             p = int((current_progress / max_progress) * 50 + 20)
@@ -816,10 +930,7 @@ class Consumer(LoggingMixin):
                 # self.log.info('gia tri documentt', document.folder)
                 new_file = Folder.objects.create(name=document.title, parent_folder = document.folder,type = Folder.FILE, owner = document.owner, created = document.created, updated = document.modified)
                 new_file.checksum=hashlib.md5(f'{new_file.id}.{new_file.name}'.encode()).hexdigest()
-                if document.folder :
-                    new_file.path = f"{document.folder.path}/{new_file.id}"
-                else:
-                    new_file.path = f"{new_file.id}"
+                new_file.path = build_path(new_file, document.folder)
                 new_file.save()
                 document.folder=new_file
 
@@ -834,10 +945,7 @@ class Consumer(LoggingMixin):
                                                                 parent_dossier=document.dossier,
                                                                 type="FILE",
                                                                 dossier_form=dossier_form)
-                if document.dossier :
-                    new_dossier_document.path = f"{document.dossier.path}/{new_file.id}"
-                else:
-                    new_dossier_document.path = f"{new_file.id}"
+                new_dossier_document.path = build_path(new_dossier_document, document.dossier)
                 new_dossier_document.save()
 
 
@@ -877,10 +985,11 @@ class Consumer(LoggingMixin):
                             document.archive_path,
                         )
 
-                        with open(archive_path, "rb") as f:
-                            document.archive_checksum = hashlib.md5(
-                                f.read(),
-                            ).hexdigest()
+                        document.archive_checksum = compute_checksum(archive_path)
+                        document.archive_quick_checksum = compute_quick_checksum(
+                            archive_path,
+                        )
+                        document.archive_size = os.path.getsize(archive_path)
 
                 # Don't save with the lock active. Saving will cause the file
                 # renaming logic to acquire the lock as well.
@@ -1004,7 +1113,9 @@ class Consumer(LoggingMixin):
             title=title[:127],
             content=text,
             mime_type=mime_type,
-            checksum=hashlib.md5(self.working_copy.read_bytes()).hexdigest(),
+            checksum=self.checksum or compute_checksum(self.working_copy),
+            quick_checksum=self.quick_checksum,
+            original_size=os.path.getsize(self.working_copy),
             created=create_date,
             modified=create_date,
             storage_type=storage_type,
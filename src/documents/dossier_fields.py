@@ -0,0 +1,302 @@
+import datetime
+import logging
+from collections import defaultdict
+from collections.abc import Iterable
+from typing import Any
+from typing import Optional
+
+from django.db.models import Q
+
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+from documents.models import Dossier
+from documents.models import DossierFieldValue
+from documents.tree import path_ids
+from documents.tree import subtree
+
+logger = logging.getLogger("paperless.dossier_fields")
+
+# reference chains are followed at most this deep, guarding against cycles
+MAX_REFERENCE_DEPTH = 10
+
+VALUE_FIELDS = {
+    "string": "value_text",
+    "url": "value_url",
+    "date": "value_date",
+    "boolean": "value_bool",
+    "integer": "value_int",
+    "float": "value_float",
+    "monetary": "value_monetary",
+    "documentlink": "value_document_ids",
+}
+
+# formats dates read from text values are tried in, after ISO 8601
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y"]
+
+
+def _has_value(value) -> bool:
+    return value is not None and value != ""
+
+
+def _as_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _parse_date(text: str) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def value_from_text(data_type: str, text: str) -> Any:
+    """
+    Converts a value stored as text, as the consumer does for fields read
+    with OCR, to the type of the field, or None if it does not convert
+    """
+    text = text.strip()
+    try:
+        if data_type == CustomField.FieldDataType.INT:
+            # OCR reads numbers with thousands separators, as in 1.000.000
+            return int(text.replace(".", "").replace(",", ""))
+        elif data_type == CustomField.FieldDataType.FLOAT:
+            return float(text.replace(",", "."))
+        elif data_type == CustomField.FieldDataType.BOOL:
+            return text.lower() in ("true", "1", "yes")
+        elif data_type == CustomField.FieldDataType.DATE:
+            return _parse_date(text)
+        elif data_type == CustomField.FieldDataType.DOCUMENTLINK:
+            return None
+    except ValueError:
+        return None
+    return text
+
+
+def _load_instances(**filters) -> dict[int, tuple]:
+    """
+    Returns the id, field, dossier, text value and reference of the matching
+    field instances, keyed by id
+    """
+    instances = {}
+    for values in (
+        CustomFieldInstance.objects.filter(**filters)
+        .order_by("created", "pk")
+        .values(
+            "pk",
+            "field_id",
+            "field__data_type",
+            "dossier_id",
+            "reference_id",
+            *VALUE_FIELDS.values(),
+        )
+    ):
+        column = VALUE_FIELDS.get(values["field__data_type"], "value_text")
+        instances[values["pk"]] = (
+            values["field_id"],
+            values["dossier_id"],
+            _as_text(values[column]),
+            values["reference_id"],
+        )
+    return instances
+
+
+def _reference_resolver(instances: dict[int, tuple]):
+    """
+    Loads the reference chains of instances without a value, one level per
+    query, and returns a function resolving a reference to its value and the
+    id of the instance holding it
+    """
+    links = dict(instances)
+    pending = {
+        reference
+        for _, _, value, reference in instances.values()
+        if not _has_value(value) and reference is not None
+    } - links.keys()
+    for _ in range(MAX_REFERENCE_DEPTH):
+        if not pending:
+            break
+        loaded = _load_instances(pk__in=pending)
+        links.update(loaded)
+        pending = {
+            reference
+            for _, _, value, reference in loaded.values()
+            if not _has_value(value) and reference is not None
+        } - links.keys()
+
+    def resolve(reference):
+        seen = set()
+        while reference is not None and reference not in seen:
+            seen.add(reference)
+            if reference not in links:
+                break
+            _, _, value, reference_next = links[reference]
+            if _has_value(value):
+                return value, reference
+            reference = reference_next
+        return None, None
+
+    return resolve
+
+
+def refresh_dossier_fields(roots: Optional[Iterable] = None) -> int:
+    """
+    Recomputes the effective field values of the dossiers in the subtrees
+    below roots, all dossiers if roots is None, and returns the number of
+    values written or removed.
+
+    A dossier has the values of its own field instances, or of the instances
+    they reference when they have none, and inherits all other values from
+    its parent dossier. Only rows whose value changed are written.
+    """
+    nodes = Dossier.objects.all()
+    if roots is not None:
+        nodes = subtree(nodes, list(roots))
+    nodes = sorted(
+        nodes.values_list("pk", "path", "parent_dossier_id"),
+        key=lambda node: len(path_ids(node[1])),
+    )
+    if not nodes:
+        return 0
+    node_ids = {pk for pk, _, _ in nodes}
+
+    # the values of the parents above the subtrees are already up to date
+    effective = defaultdict(dict)
+    outside = {parent for _, _, parent in nodes if parent not in node_ids}
+    for dossier_id, field_id, value, source_id in DossierFieldValue.objects.filter(
+        dossier_id__in=outside,
+    ).values_list("dossier_id", "field_id", "value_text", "source_id"):
+        effective[dossier_id][field_id] = (value, source_id, True)
+
+    instances = _load_instances(dossier_id__in=node_ids)
+    own = defaultdict(dict)
+    for pk, (field_id, dossier_id, value, reference) in instances.items():
+        # later instances of the same field win, as in the serializers
+        own[dossier_id][field_id] = (pk, value, reference)
+    resolve = _reference_resolver(instances)
+
+    for pk, _, parent in nodes:
+        values = {
+            field_id: (value, source_id, True)
+            for field_id, (value, source_id, _) in effective.get(parent, {}).items()
+        }
+        for field_id, (instance_id, value, reference) in own[pk].items():
+            if not _has_value(value) and reference is not None:
+                resolved, source_id = resolve(reference)
+                if _has_value(resolved):
+                    values[field_id] = (resolved, source_id, False)
+                    continue
+            if _has_value(value) or field_id not in values:
+                values[field_id] = (value, instance_id, False)
+        effective[pk] = values
+
+    existing = {
+        (row.dossier_id, row.field_id): row
+        for row in DossierFieldValue.objects.filter(dossier_id__in=node_ids)
+    }
+    to_create = []
+    to_update = []
+    for pk in node_ids:
+        for field_id, (value, source_id, inherited) in effective[pk].items():
+            row = existing.pop((pk, field_id), None)
+            if row is None:
+                to_create.append(
+                    DossierFieldValue(
+                        dossier_id=pk,
+                        field_id=field_id,
+                        value_text=value,
+                        source_id=source_id,
+                        inherited=inherited,
+                    ),
+                )
+            elif (row.value_text, row.source_id, row.inherited) != (
+                value,
+                source_id,
+                inherited,
+            ):
+                row.value_text = value
+                row.source_id = source_id
+                row.inherited = inherited
+                to_update.append(row)
+
+    DossierFieldValue.objects.bulk_create(to_create, batch_size=1000)
+    DossierFieldValue.objects.bulk_update(
+        to_update,
+        ["value_text", "source_id", "inherited"],
+        batch_size=1000,
+    )
+    DossierFieldValue.objects.filter(
+        pk__in=[row.pk for row in existing.values()]
+    ).delete()
+
+    changed = len(to_create) + len(to_update) + len(existing)
+    logger.debug(f"Refreshed {len(node_ids)} dossiers, {changed} field values changed")
+    return changed
+
+
+def refresh_dossier_fields_by_id(dossier_ids: Iterable[Optional[int]]) -> int:
+    """
+    Recomputes the effective field values below the dossiers with the given
+    ids, ignoring None and dossiers without a path
+    """
+    paths = set(
+        Dossier.objects.filter(
+            pk__in=[pk for pk in dossier_ids if pk is not None],
+            path__isnull=False,
+        ).values_list("path", flat=True),
+    )
+    if not paths:
+        return 0
+    return refresh_dossier_fields(paths)
+
+
+def dependent_dossier_ids(instance_ids: Iterable[int]) -> set[int]:
+    """
+    Returns the ids of the dossiers whose effective values depend on the
+    field instances with the given ids, those of their own dossiers and of
+    the dossiers with instances referencing them, directly or through up to
+    MAX_REFERENCE_DEPTH other instances
+    """
+    instance_ids = set(instance_ids)
+    if not instance_ids:
+        return set()
+    dossier_ids = set(
+        CustomFieldInstance.objects.filter(
+            pk__in=instance_ids,
+            dossier__isnull=False,
+        ).values_list("dossier_id", flat=True),
+    )
+    seen = set(instance_ids)
+    pending = instance_ids
+    for _ in range(MAX_REFERENCE_DEPTH):
+        if not pending:
+            break
+        referrers = CustomFieldInstance.objects.filter(
+            reference_id__in=pending,
+        ).values_list("pk", "dossier_id")
+        pending = set()
+        for pk, dossier_id in referrers:
+            if dossier_id is not None:
+                dossier_ids.add(dossier_id)
+            if pk not in seen:
+                seen.add(pk)
+                pending.add(pk)
+    return dossier_ids
+
+
+def refresh_instance_dossier_fields(instance_ids: Iterable[int]) -> int:
+    """
+    Recomputes the effective field values that depend on the field instances
+    with the given ids. Bulk writes send no signals, so they call this
+    instead.
+    """
+    return refresh_dossier_fields_by_id(dependent_dossier_ids(instance_ids))
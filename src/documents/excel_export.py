@@ -0,0 +1,156 @@
+import os
+import tempfile
+from collections.abc import Callable
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from openpyxl import Workbook
+
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+
+EXCEL_CONTENT_TYPE = (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+)
+
+# columns every exported row starts with, before the custom fields
+DOCUMENT_COLUMNS = ["Tên file", "Nội dung", "Ngày tạo"]
+
+# documents are read in chunks of this size, together with their fields
+EXPORT_CHUNK_SIZE = 1000
+
+# size of the pieces the finished file is streamed in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# called with the number of rows written so far and the total
+ProgressCallback = Callable[[int, int], None]
+
+
+def export_fields(documents: QuerySet) -> list[tuple[int, str]]:
+    """
+    Returns the id and name of every custom field set on any of the
+    documents, ordered by name, in a single query
+    """
+    return list(
+        CustomField.objects.filter(
+            fields__document__in=documents.values("id"),
+        )
+        .distinct()
+        .order_by("name", "pk")
+        .values_list("pk", "name"),
+    )
+
+
+def iter_export_rows(documents: QuerySet) -> Iterator[list]:
+    """
+    Yields the header and then one row per document, with the values of the
+    custom fields pivoted into one column per field.
+
+    Documents are read in chunks and the field values of every chunk are
+    loaded with one query, so the number of queries grows with the number
+    of chunks only and no more than one chunk is held in memory.
+    """
+    fields = export_fields(documents)
+    columns = {field_id: i for i, (field_id, _) in enumerate(fields)}
+    yield DOCUMENT_COLUMNS + [name for _, name in fields]
+
+    chunk = []
+    rows = documents.order_by("pk").values_list("pk", "title", "content", "created")
+    for document in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        chunk.append(document)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield from _chunk_rows(chunk, columns)
+            chunk = []
+    yield from _chunk_rows(chunk, columns)
+
+
+def _chunk_rows(chunk: list[tuple], columns: dict[int, int]) -> Iterator[list]:
+    if not chunk:
+        return
+    values = {}
+    for document_id, field_id, value in (
+        CustomFieldInstance.objects.filter(
+            document_id__in=[pk for pk, _, _, _ in chunk],
+        )
+        .order_by("created", "pk")
+        .values_list("document_id", "field_id", "value_text")
+    ):
+        # later instances of the same field win
+        values.setdefault(document_id, {})[field_id] = value
+    for pk, title, content, created in chunk:
+        fields = [None] * len(columns)
+        for field_id, value in values.get(pk, {}).items():
+            fields[columns[field_id]] = value
+        yield [title, content, created.strftime("%d-%m-%Y"), *fields]
+
+
+def _report_rows(
+    rows: Iterator[list],
+    total: int,
+    progress: Optional[ProgressCallback],
+) -> Iterator[list]:
+    """
+    Passes rows through, reporting progress after every chunk of documents
+    """
+    yield next(rows)
+    written = 0
+    for row in rows:
+        yield row
+        written += 1
+        if progress is not None and written % EXPORT_CHUNK_SIZE == 0:
+            progress(written, total)
+    if progress is not None:
+        progress(written, total)
+
+
+def write_excel(
+    documents: QuerySet,
+    path: Path,
+    progress: Optional[ProgressCallback] = None,
+) -> None:
+    """
+    Writes the export of documents to an XLSX file at path. The write-only
+    workbook flushes rows to disk as they are appended.
+    """
+    total = documents.count() if progress is not None else 0
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in _report_rows(iter_export_rows(documents), total, progress):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def _stream_file(path: Path) -> Iterator[bytes]:
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(STREAM_CHUNK_SIZE):
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def excel_response(documents: QuerySet, filename: str) -> StreamingHttpResponse:
+    """
+    Exports documents to a temporary XLSX file in the scratch directory and
+    streams it back, removing the file once it was sent
+    """
+    settings.SCRATCH_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".xlsx", dir=settings.SCRATCH_DIR)
+    os.close(fd)
+    try:
+        write_excel(documents, Path(path))
+    except Exception:
+        os.unlink(path)
+        raise
+
+    response = StreamingHttpResponse(
+        _stream_file(Path(path)),
+        content_type=EXCEL_CONTENT_TYPE,
+    )
+    response["Content-Length"] = os.path.getsize(path)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,151 @@
+import logging
+import uuid
+import zipfile
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+from celery import states
+from django.conf import settings
+from django.db.models import Q
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from documents.bulk_download import zip_strategy
+from documents.columnar_export import write_parquet
+from documents.columnar_export import write_typed_csv
+from documents.excel_export import EXCEL_CONTENT_TYPE
+from documents.excel_export import EXPORT_CHUNK_SIZE
+from documents.excel_export import ProgressCallback
+from documents.excel_export import write_excel
+from documents.models import Document
+from documents.models import ExportJob
+from documents.models import Folder
+from documents.tree import subtree_filter
+
+logger = logging.getLogger("paperless.export_jobs")
+
+EXPORT_DIR_NAME = "exports"
+
+ARTIFACT_TYPES = {
+    ExportJob.EXPORT_EXCEL: (".xlsx", EXCEL_CONTENT_TYPE),
+    ExportJob.EXPORT_CSV: (".csv", "text/csv"),
+    ExportJob.EXPORT_PARQUET: (".parquet", "application/vnd.apache.parquet"),
+    ExportJob.EXPORT_ZIP: (".zip", "application/zip"),
+}
+
+
+def export_dir() -> Path:
+    return settings.SCRATCH_DIR / EXPORT_DIR_NAME
+
+
+def content_type(job: ExportJob) -> str:
+    return ARTIFACT_TYPES[job.export_type][1]
+
+
+def job_documents(job: ExportJob) -> QuerySet:
+    """
+    Returns the documents of the job, given either by id or by the folders
+    they are in, optionally including the subtrees below those folders
+    """
+    parameters = job.parameters
+    if "folders" in parameters:
+        if not parameters.get("subtree"):
+            return Document.objects.filter(folder__in=parameters["folders"])
+        in_subtree = subtree_filter("folder", Folder, parameters["folders"])
+        if in_subtree is None:
+            return Document.objects.none()
+        return Document.objects.filter(in_subtree)
+    return Document.objects.filter(id__in=parameters.get("documents", []))
+
+
+def write_zip(
+    documents: QuerySet,
+    path: Path,
+    content: str = "archive",
+    compression: int = zipfile.ZIP_STORED,
+    follow_formatting: bool = False,
+    store_compressed: bool = False,
+    progress: Optional[ProgressCallback] = None,
+) -> None:
+    """
+    Writes the files of documents to a zip archive at path, either the
+    archived versions, the originals or both, reporting progress after every
+    chunk of documents
+    """
+    strategy_class = zip_strategy(content)
+    total = documents.count() if progress is not None else 0
+    written = 0
+    with zipfile.ZipFile(path, "w", compression) as zipf:
+        strategy = strategy_class(zipf, follow_formatting, store_compressed)
+        for doc in documents.order_by("pk").iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            strategy.add_document(doc)
+            written += 1
+            if progress is not None and written % EXPORT_CHUNK_SIZE == 0:
+                progress(written, total)
+    if progress is not None:
+        progress(written, total)
+
+
+def build_artifact(
+    job: ExportJob,
+    progress: Optional[ProgressCallback] = None,
+) -> Path:
+    """
+    Builds the export of the job into the export directory and returns the
+    path of the artifact
+    """
+    suffix, _ = ARTIFACT_TYPES[job.export_type]
+    export_dir().mkdir(parents=True, exist_ok=True)
+    path = export_dir() / f"{job.pk}-{uuid.uuid4().hex}{suffix}"
+    documents = job_documents(job)
+    try:
+        if job.export_type == ExportJob.EXPORT_ZIP:
+            write_zip(
+                documents,
+                path,
+                content=job.parameters.get("content", "archive"),
+                compression=job.parameters.get("compression", zipfile.ZIP_STORED),
+                follow_formatting=job.parameters.get("follow_formatting", False),
+                store_compressed=job.parameters.get("store_compressed", False),
+                progress=progress,
+            )
+        elif job.export_type == ExportJob.EXPORT_CSV:
+            write_typed_csv(documents, path, progress)
+        elif job.export_type == ExportJob.EXPORT_PARQUET:
+            write_parquet(documents, path, progress)
+        else:
+            write_excel(documents, path, progress)
+    except Exception:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def remove_artifact(job: ExportJob) -> None:
+    if job.artifact:
+        Path(job.artifact).unlink(missing_ok=True)
+
+
+def remove_expired_jobs() -> int:
+    """
+    Removes the jobs whose artifacts expired, together with their files, and
+    returns how many were removed. Jobs that did not succeed are removed once
+    they are older than the expiry as well, so jobs whose task died do not
+    stay pending forever.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(hours=settings.EXPORT_JOB_EXPIRY_HOURS)
+    expired = ExportJob.objects.filter(
+        Q(expires__lte=now) | (~Q(status=states.SUCCESS) & Q(created__lte=cutoff)),
+    )
+    count = 0
+    for job in expired.iterator():
+        remove_artifact(job)
+        # a task that died leaves its partially written file behind
+        for path in export_dir().glob(f"{job.pk}-*"):
+            path.unlink(missing_ok=True)
+        count += 1
+    expired.delete()
+    logger.debug(f"Removed {count} expired export jobs")
+    return count
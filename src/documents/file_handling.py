@@ -1,7 +1,10 @@
 import logging
 import os
 from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import PurePath
+from typing import Optional
 
 import pathvalidate
 from django.conf import settings
@@ -22,7 +25,66 @@ def create_source_path_directory(source_path):
     os.makedirs(os.path.dirname(source_path), exist_ok=True)
 
 
+def fill_document_sizes(doc: Document, force: bool = False) -> bool:
+    """
+    Sets the original and archive size of doc from its files, if they are not
+    known yet or force is set. Returns True if a size was changed.
+    """
+    changed = False
+    # the size of an encrypted original is not the size of the original
+    if (
+        (force or doc.original_size is None)
+        and doc.storage_type == Document.STORAGE_TYPE_UNENCRYPTED
+        and os.path.isfile(doc.source_path)
+    ):
+        size = os.path.getsize(doc.source_path)
+        changed = changed or size != doc.original_size
+        doc.original_size = size
+    if (
+        (force or doc.archive_size is None)
+        and doc.has_archive_version
+        and os.path.isfile(doc.archive_path)
+    ):
+        size = os.path.getsize(doc.archive_path)
+        changed = changed or size != doc.archive_size
+        doc.archive_size = size
+    return changed
+
+
+# directories to prune at the end of a deferred_directory_cleanup block
+_deferred_directories: ContextVar[Optional[set]] = ContextVar(
+    "deferred_directories",
+    default=None,
+)
+
+
+@contextmanager
+def deferred_directory_cleanup():
+    """
+    Collects the directories delete_empty_directories is called with inside
+    the block and prunes each of them once when the block ends, deepest
+    first, instead of walking up the tree for every deleted document.
+    """
+    directories = set()
+    token = _deferred_directories.set(directories)
+    try:
+        yield
+    finally:
+        _deferred_directories.reset(token)
+        for directory, root in sorted(
+            directories,
+            key=lambda item: len(item[0]),
+            reverse=True,
+        ):
+            delete_empty_directories(directory, root)
+
+
 def delete_empty_directories(directory, root):
+    deferred = _deferred_directories.get()
+    if deferred is not None:
+        deferred.add((os.path.normpath(directory), os.path.normpath(root)))
+        return
+
     if not os.path.isdir(directory):
         return
 
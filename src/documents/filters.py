@@ -1,5 +1,3 @@
-from functools import reduce
-from operator import or_
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import CharField
 from django.db.models import Count
@@ -24,6 +22,8 @@ from documents.models import StoragePath
 from documents.models import Tag
 from documents.models import Warehouse
 from documents.models import Folder
+from documents.tree import subtree
+from documents.tree import subtree_filter
 
 CHAR_KWARGS = ["istartswith", "iendswith", "icontains", "iexact"]
 ID_KWARGS = ["in", "exact"]
@@ -115,24 +115,15 @@ class WarehouseFilter(Filter):
             return qs
 
         if self.in_list:
-            new_list = []
-            warehouse_paths = Warehouse.objects.filter(id__in=object_ids).values_list("path", flat=True)
-            if warehouse_paths:
-                path_conditions = reduce(or_, (Q(path__startswith=item) for item in warehouse_paths))
-                list_warehouses = Warehouse.objects.filter(path_conditions).values_list("id")
-                new_list = [x[0] for x in list_warehouses]
-            qs = qs.filter(**{f"{self.field_name}__id__in": new_list}).distinct()
+            in_subtree = subtree_filter(self.field_name, Warehouse, object_ids)
+            qs = qs.filter(in_subtree) if in_subtree is not None else qs.none()
+        elif self.exclude:
+            in_subtree = subtree_filter(self.field_name, Warehouse, object_ids)
+            if in_subtree is not None:
+                qs = qs.exclude(in_subtree)
         else:
             for obj_id in object_ids:
-                if self.exclude:
-                    new_list = []
-                    warehouse_paths = Warehouse.objects.filter(id__in=object_ids).values_list("path", flat=True)
-                    if warehouse_paths:
-                        path_conditions = reduce(or_, (Q(path__startswith=item) for item in warehouse_paths))
-                        list_warehouses = Warehouse.objects.filter(path_conditions).values_list("id")
-                        new_list = [x[0] for x in list_warehouses]
-                    qs = qs.exclude(**{f"{self.field_name}__id__in": new_list})
-                elif self.isnull:
+                if self.isnull:
                     qs = qs.filter(**{f"{self.field_name}__isnull": self.isnull})
                 else:
                     qs = qs.filter(**{f"{self.field_name}__id": obj_id})
@@ -156,10 +147,8 @@ class FolderFilter(Filter):
             return qs
 
         if self.in_list:
-            folder_paths = Folder.objects.filter(id__in=object_ids).values_list("path")
-            list_folders = Folder.objects.filter(path__startswith = folder_paths).values_list("id")
-            new_list = [x[0] for x in list_folders]
-            qs = qs.filter(**{f"{self.field_name}__id__in": new_list}).distinct()
+            in_subtree = subtree_filter(self.field_name, Folder, object_ids)
+            qs = qs.filter(in_subtree) if in_subtree is not None else qs.none()
         else:
             for obj_id in object_ids:
                 if self.exclude:
@@ -186,10 +175,8 @@ class DossierFilter(Filter):
             return qs
 
         if self.in_list:
-            warehouse_paths = Dossier.objects.filter(id__in=object_ids).values_list("path")
-            list_warehouses = Dossier.objects.filter(path__startswith = warehouse_paths).values_list("id")
-            new_list = [x[0] for x in list_warehouses]
-            qs = qs.filter(**{f"{self.field_name}__id__in": new_list}).distinct()
+            in_subtree = subtree_filter(self.field_name, Dossier, object_ids)
+            qs = qs.filter(in_subtree) if in_subtree is not None else qs.none()
         else:
             for obj_id in object_ids:
                 if self.exclude:
@@ -436,10 +423,33 @@ class CustomParentDossierIDFilter(NumberFilter):
         if value is None:
             return qs
         d = qs.filter(id = value).first()
-        qs = qs.filter(path__startswith=str(d.path))
-        return qs.exclude(id = d.id)
+        if d is None:
+            return qs.none()
+        return subtree(qs, d, include_roots=False)
+
+class EffectiveFieldFilter(Filter):
+    """
+    Filters dossiers by the effective value of a custom field, own or
+    inherited, given as <field id>:<text contained in the value>
+    """
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        field_id, _, text = value.partition(":")
+        try:
+            field_id = int(field_id)
+        except ValueError:
+            return qs
+        return qs.filter(
+            effective_fields__field_id=field_id,
+            effective_fields__value_text__icontains=text,
+        )
+
 
 class DossierFilterSet(FilterSet):
+    effective_field = EffectiveFieldFilter()
+
     # parent_dossier__id = CustomParentDossierIDFilter(field_name="parent_dossier__id")
 
     class Meta:
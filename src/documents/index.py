@@ -1,22 +1,33 @@
+import json
 import logging
 import math
 import os
 from collections import Counter
+from collections.abc import Iterator
 from contextlib import contextmanager
 from datetime import datetime
+from datetime import timedelta
 from datetime import timezone
 from shutil import rmtree
 from typing import Optional
 
 from dateutil.parser import isoparse
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
 from django.utils import timezone as django_timezone
+from filelock import FileLock
+from guardian.models import GroupObjectPermission
+from guardian.models import UserObjectPermission
 from guardian.shortcuts import get_users_with_perms
 from whoosh import classify
 from whoosh import highlight
 from whoosh import query
 from whoosh.fields import BOOLEAN
 from whoosh.fields import DATETIME
+from whoosh.fields import ID
 from whoosh.fields import KEYWORD
 from whoosh.fields import NUMERIC
 from whoosh.fields import TEXT
@@ -35,18 +46,46 @@ from whoosh.scoring import TF_IDF
 from whoosh.searching import ResultsPage
 from whoosh.searching import Searcher
 from whoosh.util.times import timespan
+from whoosh.writing import MERGE_SMALL
 from whoosh.writing import AsyncWriter
 
-from documents.models import CustomFieldInstance
+from documents.dossier_fields import value_from_text
+from documents.models import CustomField
 from documents.models import Document
-from documents.models import Note
+from documents.models import IndexQueueItem
 from documents.models import User
+from documents.tree import path_ids
 
 logger = logging.getLogger("paperless.index")
 
+# documents are loaded for a full reindex in chunks of this size
+REINDEX_CHUNK_SIZE = 1000
+
+# where the time of the last reindex or catch up is kept, inside the index
+# directory so that it goes away with the index
+INDEX_WATERMARK_NAME = "watermark.json"
+
+# every custom field is also indexed in a column of its own, named after the
+# id of the field with a prefix depending on its data type, so that documents
+# can be filtered by the typed value of a field
+CUSTOM_FIELD_COLUMNS = {
+    CustomField.FieldDataType.STRING: "cf_text",
+    CustomField.FieldDataType.URL: "cf_text",
+    CustomField.FieldDataType.MONETARY: "cf_text",
+    CustomField.FieldDataType.DOCUMENTLINK: "cf_ids",
+    CustomField.FieldDataType.INT: "cf_int",
+    CustomField.FieldDataType.FLOAT: "cf_float",
+    CustomField.FieldDataType.DATE: "cf_date",
+    CustomField.FieldDataType.BOOL: "cf_bool",
+}
+
+# query parameters filtering by the column of a custom field, as in
+# custom_field_<id>__<filter>
+CUSTOM_FIELD_PARAM_PREFIX = "custom_field_"
+
 
 def get_schema():
-    return Schema(
+    schema = Schema(
         id=NUMERIC(stored=True, unique=True),
         title=TEXT(sortable=True),
         content=TEXT(),
@@ -66,6 +105,14 @@ def get_schema():
         folder=TEXT(sortable=True),
         folder_id=NUMERIC(),
         has_folder=BOOLEAN(),
+        dossier=TEXT(sortable=True),
+        dossier_id=NUMERIC(),
+        has_dossier=BOOLEAN(),
+        # the ids from the root of each tree down to the node of the document,
+        # so that a subtree is a single term
+        warehouse_ancestor_id=KEYWORD(commas=True),
+        folder_ancestor_id=KEYWORD(commas=True),
+        dossier_ancestor_id=KEYWORD(commas=True),
         created=DATETIME(sortable=True),
         modified=DATETIME(sortable=True),
         added=DATETIME(sortable=True),
@@ -84,6 +131,98 @@ def get_schema():
         original_filename=TEXT(sortable=True),
         is_shared=BOOLEAN(),
     )
+    schema.add("cf_text_*", ID(), glob=True)
+    schema.add("cf_ids_*", KEYWORD(commas=True), glob=True)
+    schema.add("cf_int_*", NUMERIC(numtype=int, bits=64, signed=True), glob=True)
+    schema.add("cf_float_*", NUMERIC(numtype=float, bits=64), glob=True)
+    schema.add("cf_date_*", DATETIME(), glob=True)
+    schema.add("cf_bool_*", BOOLEAN(), glob=True)
+    return schema
+
+
+def custom_field_column(field_id: int, data_type: str) -> str:
+    return f"{CUSTOM_FIELD_COLUMNS[data_type]}_{field_id}"
+
+
+def custom_field_columns(instances) -> dict:
+    """
+    Returns the typed column of every custom field instance with a value.
+    Values stored as text, as for fields read with OCR, are converted to the
+    type of the field first.
+    """
+    columns = {}
+    for instance in instances:
+        data_type = instance.field.data_type
+        value = instance.value
+        if value is None and instance.value_text:
+            value = value_from_text(data_type, instance.value_text)
+        if value is None or value == []:
+            continue
+        column = custom_field_column(instance.field_id, data_type)
+        if data_type == CustomField.FieldDataType.DATE:
+            value = datetime(value.year, value.month, value.day)
+        elif data_type == CustomField.FieldDataType.DOCUMENTLINK:
+            value = ",".join(str(doc_id) for doc_id in value)
+        elif CUSTOM_FIELD_COLUMNS[data_type] == "cf_text":
+            value = str(value).strip().lower()
+        columns[column] = value
+    return columns
+
+
+def custom_field_criteria(
+    field_id: int,
+    data_type: str,
+    query_filter: str,
+    value: str,
+) -> Optional[query.Query]:
+    """
+    Returns the criteria for filtering the column of a custom field, or None
+    if the filter is not supported for the data type of the field. Raises
+    ValueError if value does not convert to the type of the field.
+    """
+    column = custom_field_column(field_id, data_type)
+    if query_filter == "in":
+        return query.Or(
+            [
+                custom_field_criteria(field_id, data_type, "exact", v)
+                for v in value.split(",")
+            ],
+        )
+
+    kind = CUSTOM_FIELD_COLUMNS[data_type]
+    if kind in ("cf_text", "cf_ids", "cf_bool"):
+        if query_filter != "exact":
+            return None
+        if kind == "cf_bool":
+            return query.Term(column, value.lower() in {"true", "1"})
+        return query.Term(column, value.strip().lower())
+
+    if kind == "cf_date":
+        range_class = query.DateRange
+
+        def parse(text):
+            date = isoparse(text)
+            return datetime(date.year, date.month, date.day)
+
+    else:
+        range_class = query.NumericRange
+        parse = int if kind == "cf_int" else float
+
+    if query_filter == "exact":
+        start = end = parse(value)
+        return range_class(column, start, end)
+    elif query_filter == "range":
+        start, end = value.split(",")
+        return range_class(column, parse(start), parse(end))
+    elif query_filter == "gt":
+        return range_class(column, parse(value), None, startexcl=True)
+    elif query_filter == "gte":
+        return range_class(column, parse(value), None)
+    elif query_filter == "lt":
+        return range_class(column, None, parse(value), endexcl=True)
+    elif query_filter == "lte":
+        return range_class(column, None, parse(value))
+    return None
 
 
 def open_index(recreate=False) -> FileIndex:
@@ -124,13 +263,86 @@ def open_index_searcher() -> Searcher:
         searcher.close()
 
 
-def update_document(writer: AsyncWriter, doc: Document):
-    tags = ",".join([t.name for t in doc.tags.all()])
-    tags_ids = ",".join([str(t.id) for t in doc.tags.all()])
-    notes = ",".join([str(c.note) for c in Note.objects.filter(document=doc)])
-    custom_fields = ",".join(
-        [str(c) for c in CustomFieldInstance.objects.filter(document=doc)],
-    )
+def index_documents():
+    """
+    Returns the documents with everything their index fields are built from
+    selected or prefetched, apart from viewer permissions
+    """
+    return Document.objects.select_related(
+        "correspondent",
+        "document_type",
+        "storage_path",
+        "warehouse",
+        "folder",
+        "dossier",
+        "owner",
+    ).prefetch_related("tags", "notes", "custom_fields__field")
+
+
+def iter_index_chunks(
+    documents: Optional[QuerySet] = None,
+    chunk_size: int = REINDEX_CHUNK_SIZE,
+) -> Iterator[list]:
+    """
+    Yields the documents, all of them by default, in chunks ordered by
+    primary key, prefetched with index_documents
+    """
+    if documents is None:
+        documents = index_documents()
+    documents = documents.order_by("pk")
+    chunk = list(documents[:chunk_size])
+    while chunk:
+        yield chunk
+        chunk = list(documents.filter(pk__gt=chunk[-1].pk)[:chunk_size])
+
+
+def get_viewer_ids(document_ids) -> dict[int, list[int]]:
+    """
+    Returns the ids of the users allowed to view each of the documents, by
+    themselves or through one of their groups, with two queries for all of
+    them instead of one per document
+    """
+    object_pks = [str(doc_id) for doc_id in document_ids]
+    permission = {
+        "content_type": ContentType.objects.get_for_model(Document),
+        "permission__codename": "view_document",
+        "object_pk__in": object_pks,
+    }
+    viewers: dict[int, set[int]] = {}
+    for object_pk, user_id in UserObjectPermission.objects.filter(
+        **permission,
+    ).values_list("object_pk", "user_id"):
+        viewers.setdefault(int(object_pk), set()).add(user_id)
+    for object_pk, user_id in GroupObjectPermission.objects.filter(
+        **permission,
+        group__user__isnull=False,
+    ).values_list("object_pk", "group__user__id"):
+        viewers.setdefault(int(object_pk), set()).add(user_id)
+    return {doc_id: sorted(user_ids) for doc_id, user_ids in viewers.items()}
+
+
+def ancestor_ids(node) -> Optional[str]:
+    """
+    Returns the ids from the root of the tree down to node, joined for a
+    keyword field
+    """
+    if node is None:
+        return None
+    return ",".join(str(node_id) for node_id in path_ids(node.path) or [node.pk])
+
+
+def index_fields(doc: Document, viewer_ids: Optional[list[int]] = None) -> dict:
+    """
+    Returns the fields doc is indexed with. Tags, notes and custom fields are
+    read from the prefetched relations if doc was loaded with
+    index_documents. Without viewer_ids, the viewers are queried for doc.
+    """
+    doc_tags = list(doc.tags.all())
+    tags = ",".join([t.name for t in doc_tags])
+    tags_ids = ",".join([str(t.id) for t in doc_tags])
+    notes = ",".join([str(c.note) for c in doc.notes.all()])
+    doc_custom_fields = list(doc.custom_fields.all())
+    custom_fields = ",".join([str(c) for c in doc_custom_fields])
     asn = doc.archive_serial_number
     if asn is not None and (
         asn < Document.ARCHIVE_SERIAL_NUMBER_MIN
@@ -143,12 +355,16 @@ def update_document(writer: AsyncWriter, doc: Document):
             f"{Document.ARCHIVE_SERIAL_NUMBER_MAX:,}.",
         )
         asn = 0
-    users_with_perms = get_users_with_perms(
-        doc,
-        only_with_perms_in=["view_document"],
-    )
-    viewer_ids = ",".join([str(u.id) for u in users_with_perms])
-    writer.update_document(
+    if viewer_ids is None:
+        viewer_ids = [
+            u.id
+            for u in get_users_with_perms(
+                doc,
+                only_with_perms_in=["view_document"],
+            )
+        ]
+    viewer_ids = ",".join([str(user_id) for user_id in viewer_ids])
+    return dict(
         id=doc.pk,
         title=doc.title,
         content=doc.content,
@@ -167,6 +383,12 @@ def update_document(writer: AsyncWriter, doc: Document):
         folder=doc.folder.name if doc.folder else None,
         folder_id=doc.folder.id if doc.folder else None,
         has_folder=doc.folder is not None,
+        dossier=doc.dossier.name if doc.dossier else None,
+        dossier_id=doc.dossier.id if doc.dossier else None,
+        has_dossier=doc.dossier is not None,
+        warehouse_ancestor_id=ancestor_ids(doc.warehouse),
+        folder_ancestor_id=ancestor_ids(doc.folder),
+        dossier_ancestor_id=ancestor_ids(doc.dossier),
         created=doc.created,
         added=doc.added,
         asn=asn,
@@ -177,7 +399,7 @@ def update_document(writer: AsyncWriter, doc: Document):
         notes=notes,
         num_notes=len(notes),
         custom_fields=custom_fields,
-        custom_field_count=len(doc.custom_fields.all()),
+        custom_field_count=len(doc_custom_fields),
         owner=doc.owner.username if doc.owner else None,
         owner_id=doc.owner.id if doc.owner else None,
         has_owner=doc.owner is not None,
@@ -185,9 +407,18 @@ def update_document(writer: AsyncWriter, doc: Document):
         checksum=doc.checksum,
         original_filename=doc.original_filename,
         is_shared=len(viewer_ids) > 0,
+        **custom_field_columns(doc_custom_fields),
     )
 
 
+def update_document(
+    writer: AsyncWriter,
+    doc: Document,
+    viewer_ids: Optional[list[int]] = None,
+):
+    writer.update_document(**index_fields(doc, viewer_ids))
+
+
 def remove_document(writer: AsyncWriter, doc: Document):
     remove_document_by_id(writer, doc.pk)
 
@@ -206,11 +437,178 @@ def remove_document_from_index(document: Document):
         remove_document(writer, document)
 
 
+INDEX_QUEUE_SCHEDULED_KEY = "index_queue_scheduled"
+
+
+def queue_index_update(document_ids):
+    """
+    Queues the given documents for (re)indexing instead of opening a writer
+    per document. Documents which no longer exist when the queue is drained
+    are removed from the index.
+    """
+    IndexQueueItem.objects.bulk_create(
+        [IndexQueueItem(document_id=doc_id) for doc_id in set(document_ids)],
+    )
+    if settings.INDEX_QUEUE_SYNCHRONOUS:
+        flush_index_queue()
+    else:
+        transaction.on_commit(_schedule_index_queue_flush)
+
+
+def _schedule_index_queue_flush():
+    from documents.tasks import index_flush_queue
+
+    # only one flush is scheduled per delay window, all updates queued in the
+    # meantime end up in the same batch
+    if cache.add(
+        INDEX_QUEUE_SCHEDULED_KEY,
+        True,
+        timeout=settings.INDEX_QUEUE_DELAY + 60,
+    ):
+        index_flush_queue.apply_async(countdown=settings.INDEX_QUEUE_DELAY)
+
+
+def flush_index_queue(batch_size: Optional[int] = None) -> int:
+    """
+    Drains the index update queue. Every batch is written with a single
+    writer and commit. Documents which fail to index are logged and dropped
+    from the queue. Returns the number of documents written or removed.
+    """
+    batch_size = batch_size or settings.INDEX_QUEUE_BATCH_SIZE
+    processed = 0
+
+    with FileLock(settings.INDEX_QUEUE_LOCK):
+        while True:
+            pending = list(
+                IndexQueueItem.objects.values_list("pk", "document_id")[:batch_size],
+            )
+            if not pending:
+                break
+            doc_ids = {doc_id for _, doc_id in pending}
+            documents = index_documents().filter(pk__in=doc_ids)
+            viewer_ids = get_viewer_ids(doc_ids)
+
+            failed = 0
+            writer = AsyncWriter(open_index())
+            try:
+                for document in documents:
+                    doc_ids.discard(document.pk)
+                    try:
+                        update_document(
+                            writer,
+                            document,
+                            viewer_ids.get(document.pk, []),
+                        )
+                    except Exception:
+                        # a single document which cannot be indexed must not
+                        # keep the rest of the queue from being written, its
+                        # queue entry is dropped along with the others
+                        logger.exception(
+                            f"Error while indexing document {document.pk}, "
+                            f"skipping it",
+                        )
+                        failed += 1
+                for doc_id in doc_ids:
+                    remove_document_by_id(writer, doc_id)
+            except Exception:
+                writer.cancel()
+                raise
+            writer.commit(mergetype=MERGE_SMALL)
+
+            IndexQueueItem.objects.filter(pk__in=[pk for pk, _ in pending]).delete()
+            processed += len({doc_id for _, doc_id in pending}) - failed
+
+    return processed
+
+
+def get_watermark() -> Optional[datetime]:
+    """
+    Returns the time the index was last rebuilt or caught up at, if known
+    """
+    path = settings.INDEX_DIR / INDEX_WATERMARK_NAME
+    try:
+        return datetime.fromisoformat(json.loads(path.read_text())["watermark"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def set_watermark(watermark: datetime):
+    path = settings.INDEX_DIR / INDEX_WATERMARK_NAME
+    path.write_text(json.dumps({"watermark": watermark.isoformat()}))
+
+
+def _update_documents(writer: AsyncWriter, documents: QuerySet) -> int:
+    updated = 0
+    for chunk in iter_index_chunks(documents):
+        viewer_ids = get_viewer_ids([doc.pk for doc in chunk])
+        for document in chunk:
+            update_document(writer, document, viewer_ids.get(document.pk, []))
+        updated += len(chunk)
+    return updated
+
+
+def catch_up_index() -> tuple[int, int]:
+    """
+    Brings the index up to date without rebuilding it. Documents modified
+    since the watermark of the last reindex or catch up are indexed again,
+    all of them if there is none. The ids in the index are then compared with
+    those in the database. Documents missing from the index are indexed and
+    documents which no longer exist are removed. Returns the number of
+    documents updated and removed.
+    """
+    started = django_timezone.now()
+    watermark = get_watermark()
+    documents = index_documents()
+    if watermark is not None:
+        overlap = timedelta(seconds=settings.INDEX_CATCHUP_OVERLAP)
+        documents = documents.filter(modified__gte=watermark - overlap)
+
+    updated = 0
+    removed = 0
+    with FileLock(settings.INDEX_QUEUE_LOCK):
+        ix = open_index()
+        writer = AsyncWriter(ix)
+        try:
+            updated = _update_documents(writer, documents)
+        except Exception:
+            writer.cancel()
+            raise
+        writer.commit(mergetype=MERGE_SMALL)
+
+        # equal counts can still hide a missing and a stale document
+        with ix.searcher() as searcher:
+            indexed = {fields["id"] for fields in searcher.all_stored_fields()}
+        db_ids = set(Document.objects.values_list("pk", flat=True))
+        missing = db_ids - indexed
+        stale = indexed - db_ids
+        if missing or stale:
+            writer = AsyncWriter(ix)
+            try:
+                updated += _update_documents(
+                    writer,
+                    index_documents().filter(pk__in=missing),
+                )
+                for doc_id in stale:
+                    remove_document_by_id(writer, doc_id)
+            except Exception:
+                writer.cancel()
+                raise
+            writer.commit(mergetype=MERGE_SMALL)
+            removed = len(stale)
+
+    set_watermark(started)
+    return updated, removed
+
+
 class DelayedQuery:
     param_map = {
         "correspondent": ("correspondent", ["id", "id__in", "id__none", "isnull"]),
-        "warehouse": ("warehouse", ["id", "id__in", "id__none", "isnull"]),
-        "folder": ("folder", ["id", "id__in", "id__none", "isnull"]),
+        "warehouse": (
+            "warehouse",
+            ["id", "id__in", "id__none", "id__subtree", "isnull"],
+        ),
+        "folder": ("folder", ["id", "id__in", "id__none", "id__subtree", "isnull"]),
+        "dossier": ("dossier", ["id", "id__in", "id__none", "id__subtree", "isnull"]),
         "document_type": ("type", ["id", "id__in", "id__none", "isnull"]),
         "storage_path": ("path", ["id", "id__in", "id__none", "isnull"]),
         "owner": ("owner", ["id", "id__in", "id__none", "isnull"]),
@@ -228,6 +626,7 @@ class DelayedQuery:
 
     def _get_query_filter(self):
         criterias = []
+        custom_field_params = []
         for key, value in self.query_params.items():
             # is_tagged is a special case
             if key == "is_tagged":
@@ -240,6 +639,9 @@ class DelayedQuery:
 
             # All other query params consist of a parameter and a query filter
             param, query_filter = key.split("__", 1)
+            if param.startswith(CUSTOM_FIELD_PARAM_PREFIX):
+                custom_field_params.append((key, param, query_filter, value))
+                continue
             try:
                 field, supported_query_filters = self.param_map[param]
             except KeyError:
@@ -275,6 +677,15 @@ class DelayedQuery:
                 criterias.append(
                     query.Term(f"has_{field}", self.evalBoolean(value) is False),
                 )
+            elif query_filter == "id__subtree":
+                criterias.append(
+                    query.Or(
+                        [
+                            query.Term(f"{field}_ancestor_id", object_id)
+                            for object_id in value.split(",")
+                        ],
+                    ),
+                )
             elif query_filter == "id__all":
                 for object_id in value.split(","):
                     criterias.append(query.Term(f"{field}_id", object_id))
@@ -295,6 +706,8 @@ class DelayedQuery:
                     query.Prefix(field, value),
                 )
 
+        criterias += self._get_custom_field_criterias(custom_field_params)
+
         user_criterias = get_permissions_criterias(
             user=self.user,
         )
@@ -305,6 +718,43 @@ class DelayedQuery:
         else:
             return query.Or(user_criterias) if len(user_criterias) > 0 else None
 
+    def _get_custom_field_criterias(self, params) -> list:
+        field_ids = {}
+        for key, param, _, _ in params:
+            try:
+                field_ids[key] = int(param[len(CUSTOM_FIELD_PARAM_PREFIX) :])
+            except ValueError:
+                logger.error(f"Unable to build a query filter for parameter {key}")
+        data_types = dict(
+            CustomField.objects.filter(pk__in=field_ids.values()).values_list(
+                "pk",
+                "data_type",
+            ),
+        )
+
+        criterias = []
+        for key, param, query_filter, value in params:
+            if field_ids.get(key) not in data_types:
+                logger.error(f"Unable to build a query filter for parameter {key}")
+                continue
+            try:
+                criteria = custom_field_criteria(
+                    field_ids[key],
+                    data_types[field_ids[key]],
+                    query_filter,
+                    value,
+                )
+            except ValueError:
+                logger.error(f"Invalid value {value} for parameter {key}")
+                continue
+            if criteria is None:
+                logger.info(
+                    f"Query filter {query_filter} not supported for parameter {param}",
+                )
+                continue
+            criterias.append(criteria)
+        return criterias
+
     def evalBoolean(self, val):
         return val.lower() in {"true", "1"}
 
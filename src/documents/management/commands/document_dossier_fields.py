@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from documents.dossier_fields import refresh_dossier_fields
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the effective custom field values stored for every "
+        "dossier, own, referenced and inherited."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = refresh_dossier_fields()
+        self.stdout.write(f"Corrected {changed} dossier field values")
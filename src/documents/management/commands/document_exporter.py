@@ -1,9 +1,10 @@
-import hashlib
 import json
 import os
 import shutil
 import tempfile
 import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
@@ -19,7 +20,9 @@ from django.contrib.contenttypes.models import ContentType
 from django.core import serializers
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
+from django.db.models import QuerySet
 from django.utils import timezone
 from filelock import FileLock
 from guardian.models import GroupObjectPermission
@@ -44,6 +47,7 @@ from documents.models import WorkflowTrigger
 from documents.settings import EXPORTER_ARCHIVE_NAME
 from documents.settings import EXPORTER_FILE_NAME
 from documents.settings import EXPORTER_THUMBNAIL_NAME
+from documents.utils import compute_checksum
 from documents.utils import copy_file_with_basic_stats
 from paperless import version
 from paperless.db import GnuPG
@@ -51,6 +55,67 @@ from paperless.models import ApplicationConfiguration
 from paperless_mail.models import MailAccount
 from paperless_mail.models import MailRule
 
+# records are read from the database and written to the manifest in chunks of
+# this size, so the export never holds more than one chunk of any model
+MANIFEST_CHUNK_SIZE = 1000
+
+
+def iter_chunks(queryset: QuerySet) -> Iterator[list]:
+    """
+    Yields the objects of queryset in chunks ordered by primary key, with
+    their many to many relations prefetched for serialization
+    """
+    many_to_many = [
+        field.name
+        for field in queryset.model._meta.many_to_many
+        if field.remote_field.through._meta.auto_created
+    ]
+    queryset = queryset.order_by("pk").prefetch_related(*many_to_many)
+    chunk = list(queryset[:MANIFEST_CHUNK_SIZE])
+    while chunk:
+        yield chunk
+        chunk = list(queryset.filter(pk__gt=chunk[-1].pk)[:MANIFEST_CHUNK_SIZE])
+
+
+class StreamingManifestWriter:
+    """
+    Writes manifest records to a JSON array one at a time instead of building
+    the manifest in memory. The records go to a temporary file next to the
+    manifest, which only replaces it once complete.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.temp_path = path.with_name(f"{path.name}.tmp")
+        self.file = None
+        self.empty = True
+
+    def __enter__(self) -> "StreamingManifestWriter":
+        self.file = self.temp_path.open("w", encoding="utf-8")
+        self.file.write("[")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.file.write("\n]\n")
+        self.file.close()
+        if exc_type is None:
+            self.temp_path.replace(self.path)
+        else:
+            self.temp_path.unlink(missing_ok=True)
+
+    def write(self, record: dict) -> None:
+        self.file.write("\n" if self.empty else ",\n")
+        self.file.write(
+            json.dumps(record, indent=2, ensure_ascii=False, cls=DjangoJSONEncoder),
+        )
+        self.empty = False
+
+    def write_queryset(self, queryset: QuerySet) -> None:
+        for chunk in iter_chunks(queryset):
+            for record in serializers.serialize("python", chunk):
+                self.write(record)
+
 
 class Command(BaseCommand):
     help = (
@@ -147,6 +212,14 @@ class Command(BaseCommand):
             help="Sets the export zip file name",
         )
 
+        parser.add_argument(
+            "-t",
+            "--threads",
+            default=4,
+            type=int,
+            help="Number of threads copying files to the export directory",
+        )
+
         parser.add_argument(
             "--no-progress-bar",
             default=False,
@@ -159,13 +232,14 @@ class Command(BaseCommand):
         self.target: Path = None
         self.split_manifest = False
         self.files_in_export_dir: set[Path] = set()
-        self.exported_files: list[Path] = []
+        self.exported_files: set[str] = set()
         self.compare_checksums = False
         self.use_filename_format = False
         self.use_folder_prefix = False
         self.delete = False
         self.no_archive = False
         self.no_thumbnail = False
+        self.threads = 4
 
     def handle(self, *args, **options):
         self.target = Path(options["target"]).resolve()
@@ -177,6 +251,10 @@ class Command(BaseCommand):
         self.no_archive: bool = options["no_archive"]
         self.no_thumbnail: bool = options["no_thumbnail"]
         self.zip_export: bool = options["zip"]
+        self.threads: int = options["threads"]
+
+        if self.threads < 1:
+            raise CommandError("There must be at least 1 thread")
 
         # If zipping, save the original target for later and
         # get a temporary directory for the target instead
@@ -228,237 +306,24 @@ class Command(BaseCommand):
             if x.is_file():
                 self.files_in_export_dir.add(x.resolve())
 
-        # 2. Create manifest, containing all correspondents, types, tags, storage paths
-        # note, documents and ui_settings
-        with transaction.atomic():
-            manifest = json.loads(
-                serializers.serialize("json", Correspondent.objects.all()),
-            )
-
-            manifest += json.loads(serializers.serialize("json", Tag.objects.all()))
-
-            manifest += json.loads(
-                serializers.serialize("json", DocumentType.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", StoragePath.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", MailAccount.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", MailRule.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", SavedView.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", SavedViewFilterRule.objects.all()),
-            )
-
-            manifest += json.loads(serializers.serialize("json", Group.objects.all()))
-
-            manifest += json.loads(
-                serializers.serialize(
-                    "json",
-                    User.objects.exclude(username__in=["consumer", "AnonymousUser"]),
-                ),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", UiSettings.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", ContentType.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", Permission.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", UserObjectPermission.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", GroupObjectPermission.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", WorkflowTrigger.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", WorkflowAction.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", Workflow.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", CustomField.objects.all()),
-            )
-
-            manifest += json.loads(
-                serializers.serialize("json", ApplicationConfiguration.objects.all()),
-            )
-
-            if settings.AUDIT_LOG_ENABLED:
-                manifest += json.loads(
-                    serializers.serialize("json", LogEntry.objects.all()),
-                )
+        # 2. Write the manifest model by model, containing all correspondents,
+        # types, tags, storage paths, notes, documents and ui_settings
+        manifest_path = (self.target / Path("manifest.json")).resolve()
+        with transaction.atomic(), StreamingManifestWriter(manifest_path) as manifest:
+            for queryset in self.manifest_querysets():
+                manifest.write_queryset(queryset)
 
-            # These are treated specially and included in the per-document manifest
-            # if that setting is enabled.  Otherwise, they are just exported to the bulk
+            # 3. Export the files of each document. Notes and custom field
+            # instances are included in the per-document manifest if that
+            # setting is enabled. Otherwise, they are just exported to the bulk
             # manifest
-            documents = Document.objects.order_by("id")
-            document_map: dict[int, Document] = {d.pk: d for d in documents}
-            document_manifest = json.loads(serializers.serialize("json", documents))
-
-            notes = json.loads(
-                serializers.serialize("json", Note.objects.all()),
-            )
-
-            custom_field_instances = json.loads(
-                serializers.serialize("json", CustomFieldInstance.objects.all()),
-            )
+            self.export_documents(manifest, progress_bar_disable)
             if not self.split_manifest:
-                manifest += document_manifest
-                manifest += notes
-                manifest += custom_field_instances
-
-        # 3. Export files from each document
-        for index, document_dict in tqdm.tqdm(
-            enumerate(document_manifest),
-            total=len(document_manifest),
-            disable=progress_bar_disable,
-        ):
-            # 3.1. store files unencrypted
-            document_dict["fields"]["storage_type"] = Document.STORAGE_TYPE_UNENCRYPTED
-
-            document = document_map[document_dict["pk"]]
+                manifest.write_queryset(Note.objects.all())
+                manifest.write_queryset(CustomFieldInstance.objects.all())
 
-            # 3.2. generate a unique filename
-            filename_counter = 0
-            while True:
-                if self.use_filename_format:
-                    base_name = generate_filename(
-                        document,
-                        counter=filename_counter,
-                        append_gpg=False,
-                    )
-                else:
-                    base_name = document.get_public_filename(counter=filename_counter)
-
-                if base_name not in self.exported_files:
-                    self.exported_files.append(base_name)
-                    break
-                else:
-                    filename_counter += 1
-
-            # 3.3. write filenames into manifest
-            original_name = base_name
-            if self.use_folder_prefix:
-                original_name = os.path.join("originals", original_name)
-            original_target = (self.target / Path(original_name)).resolve()
-            document_dict[EXPORTER_FILE_NAME] = original_name
-
-            if not self.no_thumbnail:
-                thumbnail_name = base_name + "-thumbnail.webp"
-                if self.use_folder_prefix:
-                    thumbnail_name = os.path.join("thumbnails", thumbnail_name)
-                thumbnail_target = (self.target / Path(thumbnail_name)).resolve()
-                document_dict[EXPORTER_THUMBNAIL_NAME] = thumbnail_name
-            else:
-                thumbnail_target = None
-
-            if not self.no_archive and document.has_archive_version:
-                archive_name = base_name + "-archive.pdf"
-                if self.use_folder_prefix:
-                    archive_name = os.path.join("archive", archive_name)
-                archive_target = (self.target / Path(archive_name)).resolve()
-                document_dict[EXPORTER_ARCHIVE_NAME] = archive_name
-            else:
-                archive_target = None
-
-            # 3.4. write files to target folder
-            if document.storage_type == Document.STORAGE_TYPE_GPG:
-                t = int(time.mktime(document.created.timetuple()))
-
-                original_target.parent.mkdir(parents=True, exist_ok=True)
-                with document.source_file as out_file:
-                    original_target.write_bytes(GnuPG.decrypted(out_file))
-                    os.utime(original_target, times=(t, t))
-
-                if thumbnail_target:
-                    thumbnail_target.parent.mkdir(parents=True, exist_ok=True)
-                    with document.thumbnail_file as out_file:
-                        thumbnail_target.write_bytes(GnuPG.decrypted(out_file))
-                        os.utime(thumbnail_target, times=(t, t))
-
-                if archive_target:
-                    archive_target.parent.mkdir(parents=True, exist_ok=True)
-                    with document.archive_path as out_file:
-                        archive_target.write_bytes(GnuPG.decrypted(out_file))
-                        os.utime(archive_target, times=(t, t))
-            else:
-                self.check_and_copy(
-                    document.source_path,
-                    document.checksum,
-                    original_target,
-                )
-
-                if thumbnail_target:
-                    self.check_and_copy(document.thumbnail_path, None, thumbnail_target)
-
-                if archive_target:
-                    self.check_and_copy(
-                        document.archive_path,
-                        document.archive_checksum,
-                        archive_target,
-                    )
-
-            if self.split_manifest:
-                manifest_name = base_name + "-manifest.json"
-                if self.use_folder_prefix:
-                    manifest_name = os.path.join("json", manifest_name)
-                manifest_name = (self.target / Path(manifest_name)).resolve()
-                manifest_name.parent.mkdir(parents=True, exist_ok=True)
-                content = [document_manifest[index]]
-                content += list(
-                    filter(
-                        lambda d: d["fields"]["document"] == document_dict["pk"],
-                        notes,
-                    ),
-                )
-                content += list(
-                    filter(
-                        lambda d: d["fields"]["document"] == document_dict["pk"],
-                        custom_field_instances,
-                    ),
-                )
-                manifest_name.write_text(
-                    json.dumps(content, indent=2, ensure_ascii=False),
-                    encoding="utf-8",
-                )
-                if manifest_name in self.files_in_export_dir:
-                    self.files_in_export_dir.remove(manifest_name)
-
-        # 4.1 write manifest to target folder
-        manifest_path = (self.target / Path("manifest.json")).resolve()
-        manifest_path.write_text(
-            json.dumps(manifest, indent=2, ensure_ascii=False),
-            encoding="utf-8",
-        )
-        if manifest_path in self.files_in_export_dir:
-            self.files_in_export_dir.remove(manifest_path)
+        # 4.1 the manifest was written to the target folder
+        self.files_in_export_dir.discard(manifest_path)
 
         # 4.2 write version information to target folder
         version_path = (self.target / Path("version.json")).resolve()
@@ -491,22 +356,233 @@ class Command(BaseCommand):
                     else:
                         item.unlink()
 
-    def check_and_copy(self, source, source_checksum, target: Path):
-        if target in self.files_in_export_dir:
-            self.files_in_export_dir.remove(target)
+    def manifest_querysets(self) -> list[QuerySet]:
+        querysets = [
+            Correspondent.objects.all(),
+            Tag.objects.all(),
+            DocumentType.objects.all(),
+            StoragePath.objects.all(),
+            MailAccount.objects.all(),
+            MailRule.objects.all(),
+            SavedView.objects.all(),
+            SavedViewFilterRule.objects.all(),
+            Group.objects.all(),
+            User.objects.exclude(username__in=["consumer", "AnonymousUser"]),
+            UiSettings.objects.all(),
+            ContentType.objects.all(),
+            Permission.objects.all(),
+            UserObjectPermission.objects.all(),
+            GroupObjectPermission.objects.all(),
+            WorkflowTrigger.objects.all(),
+            WorkflowAction.objects.all(),
+            Workflow.objects.all(),
+            CustomField.objects.all(),
+            ApplicationConfiguration.objects.all(),
+        ]
+        if settings.AUDIT_LOG_ENABLED:
+            querysets.append(LogEntry.objects.all())
+        return querysets
+
+    def export_documents(
+        self,
+        manifest: StreamingManifestWriter,
+        progress_bar_disable=False,
+    ):
+        """
+        Writes the documents to the manifest one chunk at a time, copying the
+        files of every chunk with a pool of threads
+        """
+        documents = Document.objects.select_related(
+            "correspondent",
+            "document_type",
+            "storage_path",
+            "owner",
+        )
+        with ThreadPoolExecutor(max_workers=self.threads) as pool, tqdm.tqdm(
+            total=Document.objects.count(),
+            disable=progress_bar_disable,
+        ) as progress:
+            for chunk in iter_chunks(documents):
+                records = serializers.serialize("python", chunk)
+                if self.split_manifest:
+                    related = self.related_records(chunk)
+                copies = []
+                for document, document_dict in zip(chunk, records):
+                    base_name, document_copies = self.export_document(
+                        pool,
+                        document,
+                        document_dict,
+                    )
+                    copies += document_copies
+                    if self.split_manifest:
+                        self.write_document_manifest(
+                            base_name,
+                            document_dict,
+                            related.get(document.pk, []),
+                        )
+                    else:
+                        manifest.write(document_dict)
+                for copy in copies:
+                    copy.result()
+                progress.update(len(chunk))
+
+    def export_document(self, pool: ThreadPoolExecutor, document, document_dict):
+        """
+        Exports the files of a document and returns its base name and the
+        copies submitted to the pool, which may still be running
+        """
+        # 3.1. store files unencrypted
+        document_dict["fields"]["storage_type"] = Document.STORAGE_TYPE_UNENCRYPTED
+
+        # 3.2. generate a unique filename
+        filename_counter = 0
+        while True:
+            if self.use_filename_format:
+                base_name = generate_filename(
+                    document,
+                    counter=filename_counter,
+                    append_gpg=False,
+                )
+            else:
+                base_name = document.get_public_filename(counter=filename_counter)
 
+            if base_name not in self.exported_files:
+                self.exported_files.add(base_name)
+                break
+            else:
+                filename_counter += 1
+
+        # 3.3. write filenames into manifest
+        original_name = base_name
+        if self.use_folder_prefix:
+            original_name = os.path.join("originals", original_name)
+        original_target = (self.target / Path(original_name)).resolve()
+        document_dict[EXPORTER_FILE_NAME] = original_name
+
+        if not self.no_thumbnail:
+            thumbnail_name = base_name + "-thumbnail.webp"
+            if self.use_folder_prefix:
+                thumbnail_name = os.path.join("thumbnails", thumbnail_name)
+            thumbnail_target = (self.target / Path(thumbnail_name)).resolve()
+            document_dict[EXPORTER_THUMBNAIL_NAME] = thumbnail_name
+        else:
+            thumbnail_target = None
+
+        if not self.no_archive and document.has_archive_version:
+            archive_name = base_name + "-archive.pdf"
+            if self.use_folder_prefix:
+                archive_name = os.path.join("archive", archive_name)
+            archive_target = (self.target / Path(archive_name)).resolve()
+            document_dict[EXPORTER_ARCHIVE_NAME] = archive_name
+        else:
+            archive_target = None
+
+        # 3.4. write files to target folder
+        copies = []
+        if document.storage_type == Document.STORAGE_TYPE_GPG:
+            t = int(time.mktime(document.created.timetuple()))
+
+            original_target.parent.mkdir(parents=True, exist_ok=True)
+            with document.source_file as out_file:
+                original_target.write_bytes(GnuPG.decrypted(out_file))
+                os.utime(original_target, times=(t, t))
+
+            if thumbnail_target:
+                thumbnail_target.parent.mkdir(parents=True, exist_ok=True)
+                with document.thumbnail_file as out_file:
+                    thumbnail_target.write_bytes(GnuPG.decrypted(out_file))
+                    os.utime(thumbnail_target, times=(t, t))
+
+            if archive_target:
+                archive_target.parent.mkdir(parents=True, exist_ok=True)
+                with document.archive_path as out_file:
+                    archive_target.write_bytes(GnuPG.decrypted(out_file))
+                    os.utime(archive_target, times=(t, t))
+        else:
+            copies.append(
+                self.submit_copy(
+                    pool,
+                    document.source_path,
+                    document.checksum,
+                    original_target,
+                ),
+            )
+
+            if thumbnail_target:
+                copies.append(
+                    self.submit_copy(
+                        pool,
+                        document.thumbnail_path,
+                        None,
+                        thumbnail_target,
+                    ),
+                )
+
+            if archive_target:
+                copies.append(
+                    self.submit_copy(
+                        pool,
+                        document.archive_path,
+                        document.archive_checksum,
+                        archive_target,
+                    ),
+                )
+        return base_name, copies
+
+    def related_records(self, documents: list[Document]) -> dict[int, list[dict]]:
+        """
+        Returns the serialized notes and custom field instances of a chunk of
+        documents by document
+        """
+        records = {}
+        ids = [document.pk for document in documents]
+        for model in [Note, CustomFieldInstance]:
+            for record in serializers.serialize(
+                "python",
+                model.objects.filter(document__in=ids).order_by("pk"),
+            ):
+                records.setdefault(record["fields"]["document"], []).append(record)
+        return records
+
+    def write_document_manifest(
+        self,
+        base_name: str,
+        document_dict: dict,
+        related: list[dict],
+    ):
+        manifest_name = base_name + "-manifest.json"
+        if self.use_folder_prefix:
+            manifest_name = os.path.join("json", manifest_name)
+        manifest_name = (self.target / Path(manifest_name)).resolve()
+        manifest_name.parent.mkdir(parents=True, exist_ok=True)
+        manifest_name.write_text(
+            json.dumps(
+                [document_dict, *related],
+                indent=2,
+                ensure_ascii=False,
+                cls=DjangoJSONEncoder,
+            ),
+            encoding="utf-8",
+        )
+        self.files_in_export_dir.discard(manifest_name)
+
+    def submit_copy(self, pool: ThreadPoolExecutor, source, source_checksum, target):
+        # the snapshot of the export folder is only ever changed by this thread
+        self.files_in_export_dir.discard(target)
+        return pool.submit(self.check_and_copy, source, source_checksum, target)
+
+    def check_and_copy(self, source, source_checksum, target: Path):
         perform_copy = False
 
         if target.exists():
             source_stat = os.stat(source)
             target_stat = target.stat()
-            if self.compare_checksums and source_checksum:
-                target_checksum = hashlib.md5(target.read_bytes()).hexdigest()
-                perform_copy = target_checksum != source_checksum
-            elif (
-                source_stat.st_mtime != target_stat.st_mtime
-                or source_stat.st_size != target_stat.st_size
-            ):
+            if source_stat.st_size != target_stat.st_size:
+                # files of different sizes differ, no need to hash them
+                perform_copy = True
+            elif self.compare_checksums and source_checksum:
+                perform_copy = compute_checksum(target) != source_checksum
+            elif source_stat.st_mtime != target_stat.st_mtime:
                 perform_copy = True
         else:
             # Copy if it does not exist
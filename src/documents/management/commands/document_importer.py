@@ -1,26 +1,32 @@
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
 
 import tqdm
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
 from django.core.exceptions import FieldDoesNotExist
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
+from django.core.management.color import no_style
 from django.core.serializers.base import DeserializationError
 from django.db import IntegrityError
+from django.db import connection
 from django.db import transaction
 from django.db.models.signals import m2m_changed
 from django.db.models.signals import post_save
 from filelock import FileLock
 
 from documents.file_handling import create_source_path_directory
+from documents.file_handling import fill_document_sizes
 from documents.models import Correspondent
 from documents.models import CustomField
 from documents.models import CustomFieldInstance
@@ -33,12 +39,25 @@ from documents.settings import EXPORTER_ARCHIVE_NAME
 from documents.settings import EXPORTER_FILE_NAME
 from documents.settings import EXPORTER_THUMBNAIL_NAME
 from documents.signals.handlers import update_filename_and_move_files
+from documents.utils import compute_quick_checksum
 from documents.utils import copy_file_with_basic_stats
 from paperless import version
 
 if settings.AUDIT_LOG_ENABLED:
     from auditlog.registry import auditlog
 
+# rows are inserted and the files of documents imported in batches of this size
+IMPORT_BATCH_SIZE = 1000
+
+# the fields of documents set while their files are imported
+IMPORTED_FILE_FIELDS = [
+    "storage_type",
+    "quick_checksum",
+    "archive_quick_checksum",
+    "original_size",
+    "archive_size",
+]
+
 
 @contextmanager
 def disable_signal(sig, receiver, sender):
@@ -49,6 +68,52 @@ def disable_signal(sig, receiver, sender):
         sig.connect(receiver=receiver, sender=sender)
 
 
+@contextmanager
+def keep_timestamps(models):
+    """
+    Keeps the exported values of auto_now and auto_now_add fields, which
+    bulk_create would otherwise replace with the current time
+    """
+    fields = [
+        (field, field.auto_now, field.auto_now_add)
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    try:
+        for field, _, _ in fields:
+            field.auto_now = field.auto_now_add = False
+        yield
+    finally:
+        for field, auto_now, auto_now_add in fields:
+            field.auto_now = auto_now
+            field.auto_now_add = auto_now_add
+
+
+def sort_dependencies(models: list) -> list:
+    """
+    Orders models so that every model comes after the models its foreign keys
+    refer to. Models in a cycle keep their order, their foreign keys are
+    checked once all rows are loaded.
+    """
+    remaining = list(models)
+    ordered = []
+    while remaining:
+        for model in remaining:
+            dependencies = {
+                field.related_model
+                for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model
+            }
+            if not dependencies.intersection(remaining):
+                break
+        else:
+            model = remaining[0]
+        remaining.remove(model)
+        ordered.append(model)
+    return ordered
+
+
 class Command(BaseCommand):
     help = (
         "Using a manifest.json file, load the data from there, and import the "
@@ -63,12 +128,30 @@ class Command(BaseCommand):
             action="store_true",
             help="If set, the progress bar will not be shown",
         )
+        parser.add_argument(
+            "-t",
+            "--threads",
+            default=4,
+            type=int,
+            help="Number of threads copying files into paperless",
+        )
+        parser.add_argument(
+            "--link",
+            default=False,
+            action="store_true",
+            help=(
+                "Hard link files from the source directory instead of copying "
+                "them, if it is on the same file system as the media directory"
+            ),
+        )
 
     def __init__(self, *args, **kwargs):
         BaseCommand.__init__(self, *args, **kwargs)
         self.source = None
         self.manifest = None
         self.version = None
+        self.threads = 4
+        self.link = False
 
     def pre_check(self) -> None:
         """
@@ -113,10 +196,13 @@ class Command(BaseCommand):
         logging.getLogger().handlers[0].level = logging.ERROR
 
         self.source = Path(options["source"]).resolve()
+        self.threads = options["threads"]
+        self.link = options["link"]
 
-        self.pre_check()
+        if self.threads < 1:
+            raise CommandError("There must be at least 1 thread")
 
-        manifest_paths = []
+        self.pre_check()
 
         main_manifest_path = self.source / "manifest.json"
 
@@ -124,12 +210,10 @@ class Command(BaseCommand):
 
         with main_manifest_path.open() as infile:
             self.manifest = json.load(infile)
-        manifest_paths.append(main_manifest_path)
 
         for file in Path(self.source).glob("**/*-manifest.json"):
             with file.open() as infile:
                 self.manifest += json.load(infile)
-            manifest_paths.append(file)
 
         version_path = self.source / "version.json"
         if version_path.exists():
@@ -175,8 +259,7 @@ class Command(BaseCommand):
                     # delete these since pk can change, re-created from import
                     ContentType.objects.all().delete()
                     Permission.objects.all().delete()
-                    for manifest_path in manifest_paths:
-                        call_command("loaddata", manifest_path)
+                    self._load_manifest()
             except (FieldDoesNotExist, DeserializationError, IntegrityError) as e:
                 self.stdout.write(self.style.ERROR("Database import failed"))
                 if (
@@ -260,6 +343,90 @@ class Command(BaseCommand):
                         f"Failed to read from archive file {doc_archive_path}",
                     ) from e
 
+    def _load_manifest(self):
+        """
+        Inserts the records of the manifest in bulk, model by model in
+        dependency order, instead of saving them one at a time as loaddata
+        does. Like loaddata, records replace existing rows with the same
+        primary key.
+        """
+        records: dict[str, list[dict]] = {}
+        for record in self.manifest:
+            records.setdefault(record["model"], []).append(record)
+        try:
+            models = {label: apps.get_model(label) for label in records}
+        except (LookupError, ValueError) as e:
+            raise DeserializationError(f"Invalid model identifier: {e}") from e
+
+        ordered = sort_dependencies(list(models.values()))
+        labels = {model: label for label, model in models.items()}
+        with connection.constraint_checks_disabled(), keep_timestamps(ordered):
+            for model in ordered:
+                self._bulk_load(model, records[labels[model]])
+        # the rows of the auto created many to many tables were inserted with
+        # checks disabled as well
+        table_names = [model._meta.db_table for model in ordered]
+        for model in ordered:
+            table_names += [
+                field.remote_field.through._meta.db_table
+                for field in model._meta.many_to_many
+                if field.remote_field.through._meta.auto_created
+            ]
+        connection.check_constraints(table_names=table_names)
+
+        # rows were inserted with their primary keys, which doesn't advance
+        # the sequences of the tables
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), ordered):
+                cursor.execute(sql)
+
+    @staticmethod
+    def _bulk_load(model, records: list[dict]):
+        objects = []
+        m2m_data = []
+        for deserialized in serializers.deserialize("python", records):
+            objects.append(deserialized.object)
+            m2m_data.append(deserialized.m2m_data)
+
+        update_fields = [
+            field.name
+            for field in model._meta.concrete_fields
+            if not field.primary_key
+        ]
+        model._base_manager.bulk_create(
+            objects,
+            batch_size=IMPORT_BATCH_SIZE,
+            ignore_conflicts=not update_fields,
+            update_conflicts=bool(update_fields),
+            update_fields=update_fields or None,
+            unique_fields=(
+                [model._meta.pk.name]
+                if update_fields
+                and connection.features.supports_update_conflicts_with_target
+                else None
+            ),
+        )
+
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            if not through._meta.auto_created:
+                continue
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+            for i in range(0, len(objects), IMPORT_BATCH_SIZE):
+                batch = range(i, min(i + IMPORT_BATCH_SIZE, len(objects)))
+                # the relations of the records replace those of existing rows
+                through.objects.filter(
+                    **{f"{source}__in": [objects[j].pk for j in batch]},
+                ).delete()
+                through.objects.bulk_create(
+                    [
+                        through(**{f"{source}_id": objects[j].pk, f"{target}_id": pk})
+                        for j in batch
+                        for pk in m2m_data[j].get(field.name, [])
+                    ],
+                )
+
     def _import_files_from_manifest(self, progress_bar_disable):
         settings.ORIGINALS_DIR.mkdir(parents=True, exist_ok=True)
         settings.THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
@@ -271,57 +438,100 @@ class Command(BaseCommand):
             filter(lambda r: r["model"] == "documents.document", self.manifest),
         )
 
-        for record in tqdm.tqdm(manifest_documents, disable=progress_bar_disable):
-            document = Document.objects.get(pk=record["pk"])
+        with FileLock(settings.MEDIA_LOCK), ThreadPoolExecutor(
+            max_workers=self.threads,
+        ) as pool, tqdm.tqdm(
+            total=len(manifest_documents),
+            disable=progress_bar_disable,
+        ) as progress:
+            for i in range(0, len(manifest_documents), IMPORT_BATCH_SIZE):
+                batch = manifest_documents[i : i + IMPORT_BATCH_SIZE]
+                documents = Document.objects.in_bulk(
+                    [record["pk"] for record in batch],
+                )
+                imports = [
+                    pool.submit(
+                        self._import_document_files,
+                        documents[record["pk"]],
+                        record,
+                    )
+                    for record in batch
+                ]
+                for document_import in imports:
+                    document_import.result()
+                    progress.update()
+                Document.objects.bulk_update(
+                    documents.values(),
+                    IMPORTED_FILE_FIELDS,
+                )
 
-            doc_file = record[EXPORTER_FILE_NAME]
-            document_path = os.path.join(self.source, doc_file)
+    def _import_document_files(self, document: Document, record: dict):
+        """
+        Copies the files of a document into paperless and fills in what is
+        known from them, without saving the document
+        """
+        doc_file = record[EXPORTER_FILE_NAME]
+        document_path = os.path.join(self.source, doc_file)
 
-            if EXPORTER_THUMBNAIL_NAME in record:
-                thumb_file = record[EXPORTER_THUMBNAIL_NAME]
-                thumbnail_path = Path(os.path.join(self.source, thumb_file)).resolve()
-            else:
-                thumbnail_path = None
+        if EXPORTER_THUMBNAIL_NAME in record:
+            thumb_file = record[EXPORTER_THUMBNAIL_NAME]
+            thumbnail_path = Path(os.path.join(self.source, thumb_file)).resolve()
+        else:
+            thumbnail_path = None
 
-            if EXPORTER_ARCHIVE_NAME in record:
-                archive_file = record[EXPORTER_ARCHIVE_NAME]
-                archive_path = os.path.join(self.source, archive_file)
+        if EXPORTER_ARCHIVE_NAME in record:
+            archive_file = record[EXPORTER_ARCHIVE_NAME]
+            archive_path = os.path.join(self.source, archive_file)
+        else:
+            archive_path = None
+
+        document.storage_type = Document.STORAGE_TYPE_UNENCRYPTED
+
+        if os.path.isfile(document.source_path):
+            raise FileExistsError(document.source_path)
+
+        create_source_path_directory(document.source_path)
+
+        self._copy_file(document_path, document.source_path)
+
+        if thumbnail_path:
+            if thumbnail_path.suffix in {".png", ".PNG"}:
+                run_convert(
+                    density=300,
+                    scale="500x5000>",
+                    alpha="remove",
+                    strip=True,
+                    trim=False,
+                    auto_orient=True,
+                    input_file=f"{thumbnail_path}[0]",
+                    output_file=str(document.thumbnail_path),
+                )
             else:
-                archive_path = None
-
-            document.storage_type = Document.STORAGE_TYPE_UNENCRYPTED
-
-            with FileLock(settings.MEDIA_LOCK):
-                if os.path.isfile(document.source_path):
-                    raise FileExistsError(document.source_path)
-
-                create_source_path_directory(document.source_path)
-
-                copy_file_with_basic_stats(document_path, document.source_path)
-
-                if thumbnail_path:
-                    if thumbnail_path.suffix in {".png", ".PNG"}:
-                        run_convert(
-                            density=300,
-                            scale="500x5000>",
-                            alpha="remove",
-                            strip=True,
-                            trim=False,
-                            auto_orient=True,
-                            input_file=f"{thumbnail_path}[0]",
-                            output_file=str(document.thumbnail_path),
-                        )
-                    else:
-                        copy_file_with_basic_stats(
-                            thumbnail_path,
-                            document.thumbnail_path,
-                        )
-
-                if archive_path:
-                    create_source_path_directory(document.archive_path)
-                    # TODO: this assumes that the export is valid and
-                    #  archive_filename is present on all documents with
-                    #  archived files
-                    copy_file_with_basic_stats(archive_path, document.archive_path)
-
-            document.save()
+                self._copy_file(thumbnail_path, document.thumbnail_path)
+
+        if archive_path:
+            create_source_path_directory(document.archive_path)
+            # TODO: this assumes that the export is valid and
+            #  archive_filename is present on all documents with
+            #  archived files
+            self._copy_file(archive_path, document.archive_path)
+
+        # older exports don't contain the duplicate check fingerprints
+        # and file sizes
+        if document.quick_checksum is None:
+            document.quick_checksum = compute_quick_checksum(document.source_path)
+        if archive_path and document.archive_quick_checksum is None:
+            document.archive_quick_checksum = compute_quick_checksum(
+                document.archive_path,
+            )
+        fill_document_sizes(document)
+
+    def _copy_file(self, source, target):
+        if self.link:
+            try:
+                os.link(source, target)
+                return
+            except OSError:
+                # on another file system, or one without hard links
+                pass
+        copy_file_with_basic_stats(source, target)
@@ -1,22 +1,31 @@
 from django.core.management import BaseCommand
 from django.db import transaction
 
+from documents.management.commands.mixins import MultiProcessMixin
 from documents.management.commands.mixins import ProgressBarMixin
+from documents.tasks import index_catch_up
 from documents.tasks import index_optimize
 from documents.tasks import index_reindex
 
 
-class Command(ProgressBarMixin, BaseCommand):
+class Command(MultiProcessMixin, ProgressBarMixin, BaseCommand):
     help = "Manages the document index."
 
     def add_arguments(self, parser):
-        parser.add_argument("command", choices=["reindex", "optimize"])
+        parser.add_argument("command", choices=["reindex", "optimize", "catchup"])
         self.add_argument_progress_bar_mixin(parser)
+        self.add_argument_processes_mixin(parser)
 
     def handle(self, *args, **options):
         self.handle_progress_bar_mixin(**options)
+        self.handle_processes_mixin(**options)
         with transaction.atomic():
             if options["command"] == "reindex":
-                index_reindex(progress_bar_disable=self.no_progress_bar)
+                index_reindex(
+                    progress_bar_disable=self.no_progress_bar,
+                    processes=self.process_count,
+                )
             elif options["command"] == "optimize":
                 index_optimize()
+            elif options["command"] == "catchup":
+                index_catch_up()
@@ -0,0 +1,92 @@
+import tqdm
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from documents.management.commands.mixins import ProgressBarMixin
+from documents.models import Document
+from documents.utils import compute_quick_checksum
+
+
+class Command(ProgressBarMixin, BaseCommand):
+    help = (
+        "Stores the quick checksums of originals and archived files of "
+        "documents that do not have them yet, which the duplicate check uses "
+        "to find candidates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            default=False,
+            action="store_true",
+            help="Compute the quick checksums of all documents again",
+        )
+        self.add_argument_progress_bar_mixin(parser)
+
+    def handle(self, *args, **options):
+        self.handle_progress_bar_mixin(**options)
+        force = options["all"]
+
+        # the quick checksum of an encrypted file is not the one of the
+        # original, encrypted documents are skipped
+        documents = Document.objects.filter(
+            storage_type=Document.STORAGE_TYPE_UNENCRYPTED,
+        )
+        if not force:
+            documents = documents.filter(
+                Q(quick_checksum__isnull=True)
+                | Q(
+                    archive_quick_checksum__isnull=True,
+                    archive_filename__isnull=False,
+                ),
+            )
+        documents = documents.only(
+            "filename",
+            "archive_filename",
+            "storage_type",
+            "mime_type",
+            "quick_checksum",
+            "archive_quick_checksum",
+        ).order_by("pk")
+
+        updated = []
+        changed = 0
+        for document in tqdm.tqdm(
+            documents.iterator(chunk_size=500),
+            total=documents.count(),
+            disable=self.no_progress_bar,
+        ):
+            if self.fill_quick_checksums(document, force=force):
+                updated.append(document)
+            if len(updated) >= 500:
+                Document.objects.bulk_update(
+                    updated,
+                    ["quick_checksum", "archive_quick_checksum"],
+                )
+                changed += len(updated)
+                updated = []
+        Document.objects.bulk_update(
+            updated,
+            ["quick_checksum", "archive_quick_checksum"],
+        )
+        changed += len(updated)
+
+        self.stdout.write(f"Updated the quick checksums of {changed} documents")
+
+    def fill_quick_checksums(self, document: Document, force: bool) -> bool:
+        changed = False
+        if (
+            force or document.quick_checksum is None
+        ) and document.source_path.is_file():
+            quick_checksum = compute_quick_checksum(document.source_path)
+            changed = changed or quick_checksum != document.quick_checksum
+            document.quick_checksum = quick_checksum
+        if (
+            (force or document.archive_quick_checksum is None)
+            and document.has_archive_version
+            and document.archive_path.is_file()
+        ):
+            quick_checksum = compute_quick_checksum(document.archive_path)
+            changed = changed or quick_checksum != document.archive_quick_checksum
+            document.archive_quick_checksum = quick_checksum
+        return changed
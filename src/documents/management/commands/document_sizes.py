@@ -0,0 +1,75 @@
+import tqdm
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from documents.file_handling import fill_document_sizes
+from documents.management.commands.mixins import ProgressBarMixin
+from documents.models import Document
+from documents.tree import DOCUMENT_FIELDS
+from documents.tree import rebuild_aggregates
+
+
+class Command(ProgressBarMixin, BaseCommand):
+    help = (
+        "Stores the sizes of originals and archived files of documents that "
+        "do not have them yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            default=False,
+            action="store_true",
+            help="Read the sizes of all documents again, not only missing ones",
+        )
+        self.add_argument_progress_bar_mixin(parser)
+
+    def handle(self, *args, **options):
+        self.handle_progress_bar_mixin(**options)
+        force = options["all"]
+
+        documents = Document.objects.all()
+        if not force:
+            documents = documents.filter(
+                Q(
+                    original_size__isnull=True,
+                    storage_type=Document.STORAGE_TYPE_UNENCRYPTED,
+                )
+                | Q(archive_size__isnull=True, archive_filename__isnull=False),
+            )
+        documents = documents.only(
+            "filename",
+            "archive_filename",
+            "storage_type",
+            "mime_type",
+            "original_size",
+            "archive_size",
+        ).order_by("pk")
+
+        updated = []
+        changed = 0
+        for document in tqdm.tqdm(
+            documents.iterator(chunk_size=500),
+            total=documents.count(),
+            disable=self.no_progress_bar,
+        ):
+            if fill_document_sizes(document, force=force):
+                updated.append(document)
+            if len(updated) >= 500:
+                Document.objects.bulk_update(
+                    updated,
+                    ["original_size", "archive_size"],
+                )
+                changed += len(updated)
+                updated = []
+        Document.objects.bulk_update(updated, ["original_size", "archive_size"])
+        changed += len(updated)
+
+        # bulk updates bypass the signals maintaining the tree totals
+        if changed:
+            for model in DOCUMENT_FIELDS:
+                with transaction.atomic():
+                    rebuild_aggregates(model)
+
+        self.stdout.write(f"Updated the sizes of {changed} documents")
@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from documents.tree import DOCUMENT_FIELDS
+from documents.tree import rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the document counts, sizes and child counts stored on "
+        "folders, dossiers and warehouses."
+    )
+
+    def handle(self, *args, **options):
+        for model in DOCUMENT_FIELDS:
+            with transaction.atomic():
+                changed = rebuild_aggregates(model)
+            self.stdout.write(
+                f"Corrected {changed} {model._meta.verbose_name_plural}",
+            )
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.11 on 2026-10-19 04:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1105_merge_20240806_0218'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexQueueItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_id', models.PositiveIntegerField(db_index=True, help_text='Not a foreign key, so that removals can be queued as well', verbose_name='document id')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+            ],
+            options={
+                'verbose_name': 'index queue item',
+                'verbose_name_plural': 'index queue items',
+                'ordering': ('pk',),
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-19 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1106_indexqueueitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='archive_quick_checksum',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Size and checksum of the start and end of the archived document, used to find duplicate candidates.', max_length=64, null=True, verbose_name='archive quick checksum'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='quick_checksum',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Size and checksum of the start and end of the original document, used to find duplicate candidates.', max_length=64, null=True, verbose_name='quick checksum'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:18
+
+from collections import defaultdict
+from collections import deque
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+from django.db.models.functions import Substr
+
+TREES = [
+    ("warehouse", "parent_warehouse"),
+    ("folder", "parent_folder"),
+    ("dossier", "parent_dossier"),
+]
+
+
+def rebuild_tree_paths(apps, schema_editor):
+    # rebuilt from the parent links, which also repairs paths that were
+    # stored with a wrong id
+    for model_name, parent_field in TREES:
+        Model = apps.get_model("documents", model_name)
+        roots = []
+        children = defaultdict(list)
+        for pk, parent_id in Model.objects.values_list(
+            "pk",
+            f"{parent_field}_id",
+        ).iterator():
+            if parent_id is None:
+                roots.append(pk)
+            else:
+                children[parent_id].append(pk)
+
+        queue = deque((pk, f"{pk}/") for pk in roots)
+        updated = []
+        while queue:
+            pk, path = queue.popleft()
+            updated.append(Model(pk=pk, path=path))
+            queue.extend((child, f"{path}{child}/") for child in children[pk])
+            if len(updated) >= 1000:
+                Model.objects.bulk_update(updated, ["path"])
+                updated = []
+        Model.objects.bulk_update(updated, ["path"])
+
+
+def strip_tree_paths(apps, schema_editor):
+    for model_name, _ in TREES:
+        Model = apps.get_model("documents", model_name)
+        Model.objects.filter(path__endswith="/").update(
+            path=Substr("path", 1, Length("path") - 1),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1107_document_quick_checksum'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dossier',
+            name='path',
+            field=models.CharField(blank=True, max_length=512, null=True, verbose_name='path'),
+        ),
+        migrations.AlterField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(blank=True, max_length=512, null=True, verbose_name='path'),
+        ),
+        migrations.AlterField(
+            model_name='warehouse',
+            name='path',
+            field=models.CharField(blank=True, max_length=512, null=True, verbose_name='path'),
+        ),
+        migrations.RunPython(rebuild_tree_paths, strip_tree_paths),
+        migrations.AddIndex(
+            model_name='dossier',
+            index=models.Index(fields=['path'], name='dossier_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['path'], name='folder_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='warehouse',
+            index=models.Index(fields=['path'], name='warehouse_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
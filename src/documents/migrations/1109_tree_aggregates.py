@@ -0,0 +1,114 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:34
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+TREES = [
+    ("warehouse", "parent_warehouse", "warehouse"),
+    ("folder", "parent_folder", "folder"),
+    ("dossier", "parent_dossier", "dossier"),
+]
+
+
+def fill_tree_aggregates(apps, schema_editor):
+    # only counts are filled, the sizes follow once document_sizes has read
+    # the files
+    Document = apps.get_model("documents", "Document")
+
+    for model_name, parent_field, document_field in TREES:
+        Model = apps.get_model("documents", model_name)
+
+        paths = {}
+        totals = defaultdict(lambda: [0, 0])
+        for pk, path, parent_id in Model.objects.values_list(
+            "pk",
+            "path",
+            f"{parent_field}_id",
+        ).iterator():
+            paths[pk] = path
+            if parent_id is not None:
+                totals[parent_id][1] += 1
+
+        groups = (
+            Document.objects.filter(**{f"{document_field}__isnull": False})
+            .values(f"{document_field}_id")
+            .annotate(count=Count("id"))
+        )
+        for group in groups:
+            node_id = group[f"{document_field}_id"]
+            path = paths.get(node_id) or f"{node_id}/"
+            for ancestor in [int(part) for part in path.split("/") if part]:
+                if ancestor in paths:
+                    totals[ancestor][0] += group["count"]
+
+        Model.objects.bulk_update(
+            [
+                Model(
+                    pk=pk,
+                    subtree_document_count=count,
+                    child_count=children,
+                )
+                for pk, (count, children) in totals.items()
+                if pk in paths
+            ],
+            ["subtree_document_count", "child_count"],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1108_tree_path_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dossier',
+            name='child_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of direct children of this node.', verbose_name='child count'),
+        ),
+        migrations.AddField(
+            model_name='dossier',
+            name='subtree_document_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of documents in this node and all of its descendants.', verbose_name='subtree document count'),
+        ),
+        migrations.AddField(
+            model_name='dossier',
+            name='subtree_size',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Total size in bytes of the originals in this node and all of its descendants.', verbose_name='subtree size'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='child_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of direct children of this node.', verbose_name='child count'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='subtree_document_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of documents in this node and all of its descendants.', verbose_name='subtree document count'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='subtree_size',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Total size in bytes of the originals in this node and all of its descendants.', verbose_name='subtree size'),
+        ),
+        migrations.AddField(
+            model_name='warehouse',
+            name='child_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of direct children of this node.', verbose_name='child count'),
+        ),
+        migrations.AddField(
+            model_name='warehouse',
+            name='subtree_document_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of documents in this node and all of its descendants.', verbose_name='subtree document count'),
+        ),
+        migrations.AddField(
+            model_name='warehouse',
+            name='subtree_size',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Total size in bytes of the originals in this node and all of its descendants.', verbose_name='subtree size'),
+        ),
+        migrations.RunPython(fill_tree_aggregates, migrations.RunPython.noop),
+    ]
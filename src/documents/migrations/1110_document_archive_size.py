@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1109_tree_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='archive_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, help_text='The size of the archived document in bytes.', null=True, verbose_name='archive size'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='original_size',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, help_text='The size of the original document in bytes.', null=True, verbose_name='original size'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-19 05:54
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1110_document_archive_size'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dossier',
+            index=models.Index(models.F('parent_dossier'), models.F('type'), django.db.models.functions.text.Lower('name'), models.F('id'), name='dossier_browse_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(models.F('parent_folder'), models.F('type'), django.db.models.functions.text.Lower('name'), models.F('id'), name='folder_browse_idx'),
+        ),
+    ]
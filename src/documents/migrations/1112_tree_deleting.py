@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1111_tree_browse_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dossier',
+            name='deleting',
+            field=models.BooleanField(default=False, editable=False, help_text='Set while this node and its subtree are being deleted.', verbose_name='deleting'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='deleting',
+            field=models.BooleanField(default=False, editable=False, help_text='Set while this node and its subtree are being deleted.', verbose_name='deleting'),
+        ),
+        migrations.AddField(
+            model_name='warehouse',
+            name='deleting',
+            field=models.BooleanField(default=False, editable=False, help_text='Set while this node and its subtree are being deleted.', verbose_name='deleting'),
+        ),
+    ]
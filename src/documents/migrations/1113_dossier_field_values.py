@@ -0,0 +1,147 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# the column holding the value of each data type, as of this migration
+VALUE_FIELDS = {
+    "string": "value_text",
+    "url": "value_url",
+    "date": "value_date",
+    "boolean": "value_bool",
+    "integer": "value_int",
+    "float": "value_float",
+    "monetary": "value_monetary",
+    "documentlink": "value_document_ids",
+}
+
+MAX_REFERENCE_DEPTH = 10
+
+
+def _has_value(value):
+    return value is not None and value != ""
+
+
+def _as_text(value):
+    if value is None:
+        return None
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def fill_dossier_field_values(apps, schema_editor):
+    """
+    Computes the effective field values of all dossiers: the values of their
+    own field instances, or of the instances those reference, and the values
+    of their parents for all other fields
+    """
+    Dossier = apps.get_model("documents", "Dossier")
+    CustomFieldInstance = apps.get_model("documents", "CustomFieldInstance")
+    DossierFieldValue = apps.get_model("documents", "DossierFieldValue")
+
+    instances = {}
+    for values in (
+        CustomFieldInstance.objects.order_by("created", "pk")
+        .values(
+            "pk",
+            "field_id",
+            "field__data_type",
+            "dossier_id",
+            "reference_id",
+            *set(VALUE_FIELDS.values()),
+        )
+        .iterator()
+    ):
+        column = VALUE_FIELDS.get(values["field__data_type"], "value_text")
+        instances[values["pk"]] = (
+            values["field_id"],
+            values["dossier_id"],
+            _as_text(values[column]),
+            values["reference_id"],
+        )
+
+    def resolve(reference):
+        seen = set()
+        for _ in range(MAX_REFERENCE_DEPTH):
+            if reference is None or reference in seen or reference not in instances:
+                break
+            seen.add(reference)
+            _, _, value, reference_next = instances[reference]
+            if _has_value(value):
+                return value, reference
+            reference = reference_next
+        return None, None
+
+    own = {}
+    for pk, (field_id, dossier_id, value, reference) in instances.items():
+        if dossier_id is not None:
+            # later instances of the same field win
+            own.setdefault(dossier_id, {})[field_id] = (pk, value, reference)
+
+    nodes = sorted(
+        Dossier.objects.values_list("pk", "path", "parent_dossier_id"),
+        key=lambda node: len([part for part in (node[1] or "").split("/") if part]),
+    )
+    effective = {}
+    rows = []
+    for pk, _, parent in nodes:
+        values = {
+            field_id: (value, source_id, True)
+            for field_id, (value, source_id, _) in effective.get(parent, {}).items()
+        }
+        for field_id, (instance_id, value, reference) in own.get(pk, {}).items():
+            if not _has_value(value) and reference is not None:
+                resolved, source_id = resolve(reference)
+                if _has_value(resolved):
+                    values[field_id] = (resolved, source_id, False)
+                    continue
+            if _has_value(value) or field_id not in values:
+                values[field_id] = (value, instance_id, False)
+        effective[pk] = values
+        rows.extend(
+            DossierFieldValue(
+                dossier_id=pk,
+                field_id=field_id,
+                value_text=value,
+                source_id=source_id,
+                inherited=inherited,
+            )
+            for field_id, (value, source_id, inherited) in values.items()
+        )
+
+    DossierFieldValue.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1112_tree_deleting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DossierFieldValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value_text', models.TextField(editable=False, null=True, verbose_name='value')),
+                ('inherited', models.BooleanField(default=False, editable=False, help_text='Whether the value was inherited from an ancestor dossier.', verbose_name='inherited')),
+                ('dossier', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='effective_fields', to='documents.dossier')),
+                ('field', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.customfield')),
+                ('source', models.ForeignKey(editable=False, help_text='The field instance the value was taken from.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='documents.customfieldinstance')),
+            ],
+            options={
+                'verbose_name': 'dossier field value',
+                'verbose_name_plural': 'dossier field values',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dossierfieldvalue',
+            constraint=models.UniqueConstraint(fields=('dossier', 'field'), name='documents_dossierfieldvalue_unique_dossier_field'),
+        ),
+        migrations.RunPython(
+            fill_dossier_field_values,
+            migrations.RunPython.noop,
+        ),
+    ]
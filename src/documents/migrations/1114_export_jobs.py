@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '1113_dossier_field_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('export_type', models.CharField(choices=[('excel', 'Excel'), ('csv', 'CSV'), ('zip', 'ZIP archive')], max_length=16, verbose_name='export type')),
+                ('parameters', models.JSONField(default=dict, help_text='The documents or folders to export and the export options.', verbose_name='parameters')),
+                ('filename', models.CharField(help_text='Name the artifact is downloaded with.', max_length=255, verbose_name='filename')),
+                ('artifact', models.CharField(default=None, editable=False, help_text='Path of the finished export in the scratch directory.', max_length=1024, null=True, verbose_name='artifact')),
+                ('task_id', models.CharField(default=None, editable=False, help_text='Celery ID for the Task building the export', max_length=255, null=True, verbose_name='Task ID')),
+                ('status', models.CharField(choices=[('FAILURE', 'FAILURE'), ('PENDING', 'PENDING'), ('RECEIVED', 'RECEIVED'), ('RETRY', 'RETRY'), ('REVOKED', 'REVOKED'), ('STARTED', 'STARTED'), ('SUCCESS', 'SUCCESS')], default='PENDING', max_length=30, verbose_name='Task State')),
+                ('result', models.TextField(default=None, null=True, verbose_name='Result Data')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('finished', models.DateTimeField(default=None, null=True, verbose_name='finished')),
+                ('expires', models.DateTimeField(db_index=True, default=None, help_text='The artifact is removed after this time.', null=True, verbose_name='expires')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='owner')),
+            ],
+            options={
+                'verbose_name': 'export job',
+                'verbose_name_plural': 'export jobs',
+                'ordering': ('-created',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '1114_export_jobs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportjob',
+            name='export_type',
+            field=models.CharField(choices=[('excel', 'Excel'), ('csv', 'CSV'), ('parquet', 'Parquet'), ('zip', 'ZIP archive')], max_length=16, verbose_name='export type'),
+        ),
+    ]
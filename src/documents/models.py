@@ -17,6 +17,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MaxValueValidator
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from multiselectfield import MultiSelectField
@@ -212,19 +213,80 @@ class Warehouse(MatchingModel):
                                       choices=TYPE_WAREHOUSE,
                                       default=WAREHOUSE,)
     parent_warehouse = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True )
-    path = models.TextField(_("path"), null=True, blank=True)
+    path = models.CharField(_("path"), max_length=512, null=True, blank=True)
+    subtree_document_count = models.PositiveIntegerField(
+        _("subtree document count"),
+        default=0,
+        editable=False,
+        help_text=_("Number of documents in this node and all of its descendants."),
+    )
+    subtree_size = models.PositiveBigIntegerField(
+        _("subtree size"),
+        default=0,
+        editable=False,
+        help_text=_(
+            "Total size in bytes of the originals in this node and all of its "
+            "descendants.",
+        ),
+    )
+    child_count = models.PositiveIntegerField(
+        _("child count"),
+        default=0,
+        editable=False,
+        help_text=_("Number of direct children of this node."),
+    )
+    deleting = models.BooleanField(
+        _("deleting"),
+        default=False,
+        editable=False,
+        help_text=_("Set while this node and its subtree are being deleted."),
+    )
     
     class Meta(MatchingModel.Meta): 
         verbose_name = _("warehouse")
         verbose_name_plural = _("warehouses")
         constraints = []
+        indexes = [
+            models.Index(
+                fields=["path"],
+                name="warehouse_path_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ]
     
     def __str__(self):
         return self.name
     
 class Folder(MatchingModel):
     parent_folder = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True )
-    path = models.TextField(_("path"), null=True, blank=True)
+    path = models.CharField(_("path"), max_length=512, null=True, blank=True)
+    subtree_document_count = models.PositiveIntegerField(
+        _("subtree document count"),
+        default=0,
+        editable=False,
+        help_text=_("Number of documents in this node and all of its descendants."),
+    )
+    subtree_size = models.PositiveBigIntegerField(
+        _("subtree size"),
+        default=0,
+        editable=False,
+        help_text=_(
+            "Total size in bytes of the originals in this node and all of its "
+            "descendants.",
+        ),
+    )
+    child_count = models.PositiveIntegerField(
+        _("child count"),
+        default=0,
+        editable=False,
+        help_text=_("Number of direct children of this node."),
+    )
+    deleting = models.BooleanField(
+        _("deleting"),
+        default=False,
+        editable=False,
+        help_text=_("Set while this node and its subtree are being deleted."),
+    )
     checksum = models.CharField(
         _("checksum"),
         max_length=32,
@@ -254,6 +316,21 @@ class Folder(MatchingModel):
         verbose_name = _("folder")
         verbose_name_plural = _("folders")
         constraints = []
+        indexes = [
+            models.Index(
+                fields=["path"],
+                name="folder_path_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+            # children of a folder by type and name, for browsing
+            models.Index(
+                "parent_folder",
+                "type",
+                Lower("name"),
+                "id",
+                name="folder_browse_idx",
+            ),
+        ]
     def __str__(self): 
         return self.name
 
@@ -314,7 +391,34 @@ class Dossier(MatchingModel):
     
     dossier_form = models.ForeignKey(DossierForm, on_delete=models.CASCADE, null=True, blank=True)
 
-    path = models.TextField(_("path"), null=True, blank=True)
+    path = models.CharField(_("path"), max_length=512, null=True, blank=True)
+    subtree_document_count = models.PositiveIntegerField(
+        _("subtree document count"),
+        default=0,
+        editable=False,
+        help_text=_("Number of documents in this node and all of its descendants."),
+    )
+    subtree_size = models.PositiveBigIntegerField(
+        _("subtree size"),
+        default=0,
+        editable=False,
+        help_text=_(
+            "Total size in bytes of the originals in this node and all of its "
+            "descendants.",
+        ),
+    )
+    child_count = models.PositiveIntegerField(
+        _("child count"),
+        default=0,
+        editable=False,
+        help_text=_("Number of direct children of this node."),
+    )
+    deleting = models.BooleanField(
+        _("deleting"),
+        default=False,
+        editable=False,
+        help_text=_("Set while this node and its subtree are being deleted."),
+    )
 
     created = models.DateTimeField(
         _("created"),
@@ -326,6 +430,21 @@ class Dossier(MatchingModel):
     class Meta(MatchingModel.Meta):
         verbose_name = _("dossier")
         verbose_name_plural = _("dossiers")
+        indexes = [
+            models.Index(
+                fields=["path"],
+                name="dossier_path_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+            # children of a dossier by type and name, for browsing
+            models.Index(
+                "parent_dossier",
+                "type",
+                Lower("name"),
+                "id",
+                name="dossier_browse_idx",
+            ),
+        ]
     def __str__(self): 
         return self.name
 
@@ -438,6 +557,48 @@ class Document(ModelWithOwner):
         help_text=_("The checksum of the archived document."),
     )
 
+    quick_checksum = models.CharField(
+        _("quick checksum"),
+        max_length=64,
+        editable=False,
+        blank=True,
+        null=True,
+        db_index=True,
+        help_text=_(
+            "Size and checksum of the start and end of the original document, "
+            "used to find duplicate candidates.",
+        ),
+    )
+
+    archive_quick_checksum = models.CharField(
+        _("archive quick checksum"),
+        max_length=64,
+        editable=False,
+        blank=True,
+        null=True,
+        db_index=True,
+        help_text=_(
+            "Size and checksum of the start and end of the archived document, "
+            "used to find duplicate candidates.",
+        ),
+    )
+
+    original_size = models.PositiveBigIntegerField(
+        _("original size"),
+        editable=False,
+        blank=True,
+        null=True,
+        help_text=_("The size of the original document in bytes."),
+    )
+
+    archive_size = models.PositiveBigIntegerField(
+        _("archive size"),
+        editable=False,
+        blank=True,
+        null=True,
+        help_text=_("The size of the archived document in bytes."),
+    )
+
     created = models.DateTimeField(_("created"), default=timezone.now, db_index=True)
 
     modified = models.DateTimeField(
@@ -884,6 +1045,93 @@ class PaperlessTask(models.Model):
         return f"Task {self.task_id}"
 
 
+class ExportJob(ModelWithOwner):
+    """
+    An export of documents built in the background, whose artifact can be
+    downloaded once the job succeeded, until it expires
+    """
+
+    EXPORT_EXCEL = "excel"
+    EXPORT_CSV = "csv"
+    EXPORT_PARQUET = "parquet"
+    EXPORT_ZIP = "zip"
+    EXPORT_TYPES = (
+        (EXPORT_EXCEL, _("Excel")),
+        (EXPORT_CSV, _("CSV")),
+        (EXPORT_PARQUET, _("Parquet")),
+        (EXPORT_ZIP, _("ZIP archive")),
+    )
+
+    export_type = models.CharField(
+        _("export type"),
+        max_length=16,
+        choices=EXPORT_TYPES,
+    )
+
+    parameters = models.JSONField(
+        _("parameters"),
+        default=dict,
+        help_text=_("The documents or folders to export and the export options."),
+    )
+
+    filename = models.CharField(
+        _("filename"),
+        max_length=255,
+        help_text=_("Name the artifact is downloaded with."),
+    )
+
+    artifact = models.CharField(
+        _("artifact"),
+        max_length=1024,
+        null=True,
+        default=None,
+        editable=False,
+        help_text=_("Path of the finished export in the scratch directory."),
+    )
+
+    task_id = models.CharField(
+        max_length=255,
+        null=True,
+        default=None,
+        editable=False,
+        verbose_name=_("Task ID"),
+        help_text=_("Celery ID for the Task building the export"),
+    )
+
+    status = models.CharField(
+        max_length=30,
+        default=states.PENDING,
+        choices=PaperlessTask.TASK_STATE_CHOICES,
+        verbose_name=_("Task State"),
+    )
+
+    result = models.TextField(
+        null=True,
+        default=None,
+        verbose_name=_("Result Data"),
+    )
+
+    created = models.DateTimeField(_("created"), default=timezone.now)
+
+    finished = models.DateTimeField(_("finished"), null=True, default=None)
+
+    expires = models.DateTimeField(
+        _("expires"),
+        null=True,
+        default=None,
+        db_index=True,
+        help_text=_("The artifact is removed after this time."),
+    )
+
+    class Meta:
+        ordering = ("-created",)
+        verbose_name = _("export job")
+        verbose_name_plural = _("export jobs")
+
+    def __str__(self) -> str:
+        return f"Export {self.filename}"
+
+
 class Note(models.Model):
     note = models.TextField(
         _("content"),
@@ -924,6 +1172,34 @@ class Note(models.Model):
         return self.note
 
 
+class IndexQueueItem(models.Model):
+    """
+    A pending search index update for a single document. Rows are appended
+    by request handlers and drained in batches by a single index writer.
+    """
+
+    document_id = models.PositiveIntegerField(
+        _("document id"),
+        db_index=True,
+        help_text=_(
+            "Not a foreign key, so that removals can be queued as well",
+        ),
+    )
+
+    created = models.DateTimeField(
+        _("created"),
+        default=timezone.now,
+    )
+
+    class Meta:
+        ordering = ("pk",)
+        verbose_name = _("index queue item")
+        verbose_name_plural = _("index queue items")
+
+    def __str__(self):
+        return f"IndexQueueItem {self.document_id}"
+
+
 class ShareLink(models.Model):
     class FileVersion(models.TextChoices):
         ARCHIVE = ("archive", _("Archive"))
@@ -1137,6 +1413,57 @@ class CustomFieldInstance(models.Model):
             return self.value_document_ids
         raise NotImplementedError(self.field.data_type)        
 
+
+class DossierFieldValue(models.Model):
+    """
+    The effective value of a custom field for a dossier, either from its own
+    field instance, a referenced instance or inherited from an ancestor.
+    Maintained by documents.dossier_fields.
+    """
+
+    dossier = models.ForeignKey(
+        Dossier,
+        on_delete=models.CASCADE,
+        related_name="effective_fields",
+        editable=False,
+    )
+
+    field = models.ForeignKey(
+        CustomField,
+        on_delete=models.CASCADE,
+        related_name="+",
+        editable=False,
+    )
+
+    value_text = models.TextField(_("value"), null=True, editable=False)
+
+    source = models.ForeignKey(
+        CustomFieldInstance,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="+",
+        editable=False,
+        help_text=_("The field instance the value was taken from."),
+    )
+
+    inherited = models.BooleanField(
+        _("inherited"),
+        default=False,
+        editable=False,
+        help_text=_("Whether the value was inherited from an ancestor dossier."),
+    )
+
+    class Meta:
+        verbose_name = _("dossier field value")
+        verbose_name_plural = _("dossier field values")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dossier", "field"],
+                name="%(app_label)s_%(class)s_unique_dossier_field",
+            ),
+        ]
+
+
 if settings.AUDIT_LOG_ENABLED:
     auditlog.register(Document, m2m_fields={"tags"})
     auditlog.register(Correspondent)
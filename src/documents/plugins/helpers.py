@@ -10,6 +10,24 @@ if TYPE_CHECKING:
     from channels_redis.pubsub import RedisPubSubChannelLayer
 
 
+STATUS_UPDATES_GROUP = "status_updates"
+STATUS_UPDATES_SUPERUSER_GROUP = "status_updates_superusers"
+
+
+def get_owner_status_group(owner_id: int) -> str:
+    return f"{STATUS_UPDATES_GROUP}_{owner_id}"
+
+
+def get_status_update_groups(owner_id: Optional[int]) -> list[str]:
+    """
+    Unowned updates are broadcast to everyone, owned updates only go to the
+    group of their owner and to the superusers
+    """
+    if owner_id is None:
+        return [STATUS_UPDATES_GROUP]
+    return [get_owner_status_group(owner_id), STATUS_UPDATES_SUPERUSER_GROUP]
+
+
 class ProgressStatusOptions(str, enum.Enum):
     STARTED = "STARTED"
     WORKING = "WORKING"
@@ -81,4 +99,5 @@ class ProgressManager:
             payload["data"].update(extra_args)
 
         # Construct and send the update
-        async_to_sync(self._channel.group_send)("status_updates", payload)
+        for group in get_status_update_groups(payload["data"].get("owner_id")):
+            async_to_sync(self._channel.group_send)(group, payload)
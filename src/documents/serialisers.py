@@ -1,7 +1,6 @@
 import datetime
 import logging
 import math
-import os
 import re
 import zoneinfo
 from decimal import Decimal
@@ -31,12 +30,14 @@ from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 
 from documents import bulk_edit
+from documents.columnar_export import parquet_available
 from documents.data_models import DocumentSource
 from documents.models import Approval, Correspondent, Dossier, DossierForm
 from documents.models import CustomField
 from documents.models import CustomFieldInstance
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import ExportJob
 from documents.models import MatchingModel
 from documents.models import PaperlessTask
 from documents.models import SavedView
@@ -1397,6 +1398,18 @@ class BulkDownloadSerializer(DocumentListSerializer):
         default=False,
     )
 
+    store_compressed = serializers.BooleanField(
+        default=False,
+    )
+
+    stream = serializers.BooleanField(
+        default=False,
+    )
+
+    background = serializers.BooleanField(
+        default=False,
+    )
+
     def validate_compression(self, compression):
         import zipfile
 
@@ -1408,6 +1421,62 @@ class BulkDownloadSerializer(DocumentListSerializer):
         }[compression]
 
 
+class ExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExportJob
+        fields = (
+            "id",
+            "export_type",
+            "filename",
+            "status",
+            "result",
+            "task_id",
+            "created",
+            "finished",
+            "expires",
+            "owner",
+        )
+        read_only_fields = fields
+
+
+class ExportJobCreateSerializer(BulkDownloadSerializer):
+    export_type = serializers.ChoiceField(choices=ExportJob.EXPORT_TYPES)
+
+    documents = serializers.ListField(
+        required=False,
+        write_only=True,
+        child=serializers.IntegerField(),
+    )
+
+    folders = serializers.ListField(
+        required=False,
+        write_only=True,
+        child=serializers.IntegerField(),
+    )
+
+    subtree = serializers.BooleanField(default=True)
+
+    # exports are always built in the background
+    stream = None
+    background = None
+
+    filename = serializers.CharField(required=False, max_length=255)
+
+    def validate_export_type(self, export_type):
+        if export_type == ExportJob.EXPORT_PARQUET and not parquet_available():
+            raise serializers.ValidationError(
+                "Parquet exports require pyarrow to be installed",
+            )
+        return export_type
+
+    def validate(self, attrs):
+        if ("documents" in attrs) == ("folders" in attrs):
+            raise serializers.ValidationError(
+                "Either documents or folders must be given",
+            )
+        return attrs
+
+
 class StoragePathSerializer(MatchingModelSerializer, OwnedObjectSerializer):
     class Meta:
         model = StoragePath
@@ -2097,25 +2166,8 @@ class WarehouseSerializer(MatchingModelSerializer, OwnedObjectSerializer):
         fields = '__all__'
     
     def get_document_count(self, obj):
-        return self.get_total_document_count(obj)
-
-    def get_total_document_count(self, warehouse):
-        if warehouse.type == Warehouse.BOXCASE:
-            return Document.objects.filter(warehouse=warehouse).count()
-        elif warehouse.type == Warehouse.SHELF:
-            child_warehouses = Warehouse.objects.filter(parent_warehouse=warehouse)
-            total_count = 0
-            for child_warehouse in child_warehouses:
-                total_count += self.get_total_document_count(child_warehouse)
-            return total_count
-        elif warehouse.type == Warehouse.WAREHOUSE:
-            child_warehouses = Warehouse.objects.filter(parent_warehouse=warehouse)
-            total_count = 0
-            for child_warehouse in child_warehouses:
-                total_count += self.get_total_document_count(child_warehouse)
-            return total_count
-        else:
-            return 0
+        # annotated by WarehouseViewSet, otherwise the stored subtree total
+        return getattr(obj, "document_count", obj.subtree_document_count)
     
     
 class FolderSerializer(MatchingModelSerializer, OwnedObjectSerializer):
@@ -2126,20 +2178,10 @@ class FolderSerializer(MatchingModelSerializer, OwnedObjectSerializer):
     filesize = serializers.SerializerMethodField()
     
     def get_filesize(self, obj):
-        folder = Folder.objects.get(id=int(obj.id))
-        return self.get_folder_filesize(folder)
-    
-    def get_folder_filesize(self, folder):
-        folders = Folder.objects.filter(path__startswith=folder.path)
-        documents = Document.objects.filter(folder__in=folders)
-        total_size_bytes = sum(os.path.getsize(doc.source_path) for doc in documents)
-        return total_size_bytes
+        return obj.subtree_size
     
     def get_document_count(self, obj):
-        folders = Folder.objects.filter(path__startswith=obj.path)
-        documents = Document.objects.filter(folder__in=folders)
-
-        return documents.count()
+        return obj.subtree_document_count
     
     def get_document_matching(self, obj):
         if obj.type == Folder.FILE:
@@ -2149,7 +2191,7 @@ class FolderSerializer(MatchingModelSerializer, OwnedObjectSerializer):
         return None
     
     def get_child_folder_count(self, obj):
-        return Folder.objects.filter(parent_folder=obj).count()
+        return obj.child_count
     
     def validate(self, data):
         return data
@@ -2164,6 +2206,8 @@ class FolderSerializer(MatchingModelSerializer, OwnedObjectSerializer):
 class ExportDocumentFromFolderSerializer(serializers.Serializer):
     folders = serializers.ListField(child=serializers.IntegerField())
 
+    background = serializers.BooleanField(default=False)
+
     def validate_folders(self, value):
         if not value:
             return Folder.objects.all().values_list('id', flat=True)
@@ -2203,10 +2247,20 @@ class DossierSerializer(MatchingModelSerializer, OwnedObjectSerializer):
         return obj.dossier_form.name
     
     def get_document_count(self, obj):
-        dossiers = Dossier.objects.filter(path__startswith=obj.path)
-        documents = Document.objects.filter(dossier__in=dossiers)
+        return obj.subtree_document_count
+
+    effective_fields = SerializerMethodField(read_only=True)
+
+    def get_effective_fields(self, obj):
+        return [
+            {
+                "field": value.field_id,
+                "value": value.value_text,
+                "inherited": value.inherited,
+            }
+            for value in obj.effective_fields.all()
+        ]
 
-        return documents.count()
     class Meta:
         model = Dossier
         fields = [
@@ -2226,7 +2280,8 @@ class DossierSerializer(MatchingModelSerializer, OwnedObjectSerializer):
             'type',
             'dossier_form_name',
             'document_matching',
-            'custom_fields'
+            'custom_fields',
+            'effective_fields',
         ]
     def create(self, validated_data):
         custom_fields_data = validated_data.pop('custom_fields', [])
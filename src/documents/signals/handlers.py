@@ -20,7 +20,9 @@ from django.contrib.auth.models import Permission
 from django.db import DatabaseError
 from django.db import close_old_connections
 from django.db import models
+from django.db import transaction
 from django.db.models import Q
+from django.db.models import QuerySet
 from django.dispatch import receiver
 from django.utils import timezone
 from filelock import FileLock
@@ -29,16 +31,22 @@ import requests
 
 from documents import matching
 from documents.caching import clear_document_caches
+from documents.caching import invalidate_breadcrumb_cache
 from documents.classifier import DocumentClassifier
 from documents.consumer import parse_doc_title_w_placeholders
 from documents.file_handling import create_source_path_directory
 from documents.file_handling import delete_empty_directories
 from documents.file_handling import generate_unique_filename
+from documents import dossier_fields
+from documents import tree
 from documents.models import Approval, CustomFieldInstance
 from documents.models import Document
+from documents.models import Dossier
+from documents.models import Folder
 from documents.models import MatchingModel
 from documents.models import PaperlessTask
 from documents.models import Tag
+from documents.models import Warehouse
 from documents.models import Workflow
 from documents.models import WorkflowAction
 from documents.models import WorkflowTrigger
@@ -413,6 +421,138 @@ def set_storage_path(
             document.save(update_fields=("storage_path",))
 
 
+@receiver(models.signals.pre_save, sender=Document)
+def remember_document_tree_state(
+    sender,
+    instance: Document,
+    raw=False,
+    update_fields=None,
+    **kwargs,
+):
+    instance._tree_state = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & tree.DOCUMENT_TREE_FIELDS:
+        return
+    instance._tree_state = tree.get_saved_document_state(instance.pk)
+
+
+@receiver(models.signals.post_save, sender=Document)
+def update_document_tree_aggregates(
+    sender,
+    instance: Document,
+    created=False,
+    raw=False,
+    **kwargs,
+):
+    if raw or tree.aggregates_suspended():
+        return
+    old_state = None if created else getattr(instance, "_tree_state", None)
+    if not created and old_state is None:
+        # not saved through save(), nothing is known about the previous state
+        return
+    tree.update_document_aggregates(instance, old_state)
+
+
+@receiver(models.signals.pre_delete, sender=Document)
+def remove_document_tree_aggregates(sender, instance: Document, **kwargs):
+    if tree.aggregates_suspended():
+        return
+    tree.remove_document_aggregates(instance)
+
+
+@receiver(models.signals.pre_save, sender=Folder)
+@receiver(models.signals.pre_save, sender=Dossier)
+@receiver(models.signals.pre_save, sender=Warehouse)
+def remember_tree_node_state(sender, instance, raw=False, **kwargs):
+    instance._tree_node_state = None
+    if raw or instance.pk is None:
+        return
+    parent_field = f"{tree.get_parent_field(sender)}_id"
+    instance._tree_node_state = (
+        sender.objects.values("name", "path", parent_field)
+        .filter(pk=instance.pk)
+        .first()
+    )
+
+
+@receiver(models.signals.post_save, sender=Folder)
+@receiver(models.signals.post_save, sender=Dossier)
+@receiver(models.signals.post_save, sender=Warehouse)
+def invalidate_tree_breadcrumbs(sender, instance, created=False, raw=False, **kwargs):
+    old_state = getattr(instance, "_tree_node_state", None)
+    if raw or created or old_state is None:
+        return
+    parent_field = f"{tree.get_parent_field(sender)}_id"
+    if old_state["name"] != instance.name or old_state[parent_field] != getattr(
+        instance,
+        parent_field,
+    ):
+        # after the commit, otherwise a concurrent request can cache the old
+        # breadcrumbs again before the rename is visible
+        model_name = sender._meta.model_name
+        transaction.on_commit(lambda: invalidate_breadcrumb_cache(model_name))
+
+
+@receiver(models.signals.post_save, sender=Dossier)
+def refresh_moved_dossier_fields(sender, instance, created=False, raw=False, **kwargs):
+    old_state = getattr(instance, "_tree_node_state", None)
+    if raw or (old_state is not None and old_state["path"] == instance.path):
+        return
+    if instance.path:
+        dossier_fields.refresh_dossier_fields([instance])
+
+
+@receiver(models.signals.post_save, sender=CustomFieldInstance)
+def refresh_instance_dossier_fields(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    dossier_fields.refresh_instance_dossier_fields([instance.pk])
+
+
+@receiver(models.signals.pre_delete, sender=CustomFieldInstance)
+def remember_instance_dossier_fields(sender, instance, **kwargs):
+    instance._dependent_dossier_ids = set()
+    origin = kwargs.get("origin")
+    if origin is not None and not (
+        isinstance(origin, CustomFieldInstance)
+        or (isinstance(origin, QuerySet) and origin.model is CustomFieldInstance)
+    ):
+        # deleted along with its dossier or document
+        return
+    # the references to the instance are cleared before post_delete is sent
+    instance._dependent_dossier_ids = dossier_fields.dependent_dossier_ids(
+        [instance.pk],
+    )
+
+
+@receiver(models.signals.post_delete, sender=CustomFieldInstance)
+def refresh_deleted_instance_dossier_fields(sender, instance, **kwargs):
+    dossier_fields.refresh_dossier_fields_by_id(
+        getattr(instance, "_dependent_dossier_ids", ()),
+    )
+
+
+@receiver(models.signals.post_save, sender=Folder)
+@receiver(models.signals.post_save, sender=Dossier)
+@receiver(models.signals.post_save, sender=Warehouse)
+def add_tree_node_aggregates(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not created or tree.aggregates_suspended():
+        return
+    parent_id = getattr(instance, f"{tree.get_parent_field(sender)}_id")
+    tree.update_aggregates(sender, [parent_id], children=1)
+
+
+@receiver(models.signals.post_delete, sender=Folder)
+@receiver(models.signals.post_delete, sender=Dossier)
+@receiver(models.signals.post_delete, sender=Warehouse)
+def remove_tree_node_aggregates(sender, instance, **kwargs):
+    if not tree.aggregates_suspended():
+        tree.remove_node_aggregates(instance)
+    model_name = sender._meta.model_name
+    transaction.on_commit(lambda: invalidate_breadcrumb_cache(model_name))
+
+
 @receiver(models.signals.post_delete, sender=Document)
 def cleanup_document_deletion(sender, instance, using, **kwargs):
     with FileLock(settings.MEDIA_LOCK):
@@ -620,7 +760,7 @@ def set_log_entry(sender, document: Document, logging_group=None, **kwargs):
 def add_to_index(sender, document, **kwargs):
     from documents import index
 
-    index.add_or_update_document(document)
+    index.queue_index_update([document.pk])
 
 
 def run_workflow_added(sender, document: Document, logging_group=None, **kwargs):
@@ -1011,7 +1151,10 @@ def before_task_publish_handler(sender=None, headers=None, body=None, **kwargs):
     https://docs.celeryq.dev/en/stable/internals/protocol.html#version-2
 
     """
-    if "task" not in headers or headers["task"] != "documents.tasks.consume_file":
+    if "task" not in headers or headers["task"] not in (
+        "documents.tasks.consume_file",
+        "documents.tasks.delete_subtree",
+    ):
         # Assumption: this is only ever a v2 message
         return
 
@@ -1019,9 +1162,13 @@ def before_task_publish_handler(sender=None, headers=None, body=None, **kwargs):
         close_old_connections()
 
         task_args = body[0]
-        input_doc, _ = task_args
+        if headers["task"] == "documents.tasks.delete_subtree":
+            model_name, node_ids = task_args[:2]
+            task_file_name = f"{model_name} {', '.join(map(str, node_ids))}"
+        else:
+            input_doc, _ = task_args
 
-        task_file_name = input_doc.original_file.name
+            task_file_name = input_doc.original_file.name
 
         PaperlessTask.objects.create(
             task_id=headers["id"],
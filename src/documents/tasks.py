@@ -1,4 +1,3 @@
-import hashlib
 import logging
 import os
 import shutil
@@ -11,9 +10,12 @@ from datetime import datetime, timedelta
 import tqdm
 from celery import Task
 from celery import shared_task
+from celery import states
 from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 from django.db.models.signals import post_save
+from django.utils import timezone
 from filelock import FileLock
 from whoosh.writing import AsyncWriter
 
@@ -28,12 +30,18 @@ from documents.consumer import ConsumerError
 from documents.consumer import WorkflowTriggerPlugin
 from documents.data_models import ConsumableDocument
 from documents.data_models import DocumentMetadataOverrides
+from documents.dossier_fields import refresh_instance_dossier_fields
 from documents.double_sided import CollatePlugin
+from documents.export_jobs import build_artifact
+from documents.export_jobs import remove_expired_jobs
 from documents.file_handling import create_source_path_directory
+from documents.file_handling import deferred_directory_cleanup
 from documents.file_handling import generate_unique_filename
 from documents.models import Approval, Correspondent, CustomFieldInstance
 from documents.models import Document
+from documents.models import Dossier
 from documents.models import DocumentType
+from documents.models import ExportJob
 from documents.models import StoragePath
 from documents.models import Warehouse
 from documents.models import Folder
@@ -46,6 +54,18 @@ from documents.plugins.base import StopConsumeTaskError
 from documents.plugins.helpers import ProgressStatusOptions
 from documents.sanity_checker import SanityCheckFailedException
 from documents.signals import document_updated
+from documents.tree import DOCUMENT_FIELDS
+from documents.tree import TREE_MODELS
+from documents.tree import is_in_subtree
+from documents.tree import remove_documents_aggregates
+from documents.tree import remove_leaf_aggregates
+from documents.tree import remove_node_aggregates
+from documents.tree import subtree
+from documents.tree import subtree_filter
+from documents.tree import suspended_aggregates
+from documents.tree import unmark_deleting
+from documents.utils import compute_checksum
+from documents.utils import compute_quick_checksum
 from paperless.models import ApplicationConfiguration
 
 if settings.AUDIT_LOG_ENABLED:
@@ -85,14 +105,57 @@ def index_optimize():
     writer.commit(optimize=True)
 
 
-def index_reindex(progress_bar_disable=False):
-    documents = Document.objects.all()
+@shared_task
+def index_flush_queue():
+    # allow the next queued update to schedule another flush, anything queued
+    # while this one runs is picked up by the loop below or by that flush
+    cache.delete(index.INDEX_QUEUE_SCHEDULED_KEY)
+    processed = index.flush_index_queue()
+    logger.debug(f"Flushed {processed} queued index update(s)")
+
+
+@shared_task
+def index_catch_up():
+    updated, removed = index.catch_up_index()
+    logger.debug(f"Caught up the index: {updated} updated, {removed} removed")
 
+
+def index_reindex(progress_bar_disable=False, processes=1):
+    started = timezone.now()
     ix = index.open_index(recreate=True)
 
-    with AsyncWriter(ix) as writer:
-        for document in tqdm.tqdm(documents, disable=progress_bar_disable):
-            index.update_document(writer, document)
+    # the index is new, so documents are added without looking for an older
+    # version of them. With several processes, each one analyses a share of
+    # the documents into a segment of its own.
+    if processes > 1:
+        writer = ix.writer(procs=processes, multisegment=True)
+    else:
+        writer = ix.writer()
+    try:
+        with tqdm.tqdm(
+            total=Document.objects.count(),
+            disable=progress_bar_disable,
+        ) as progress:
+            for chunk in index.iter_index_chunks():
+                viewer_ids = index.get_viewer_ids([doc.pk for doc in chunk])
+                for document in chunk:
+                    writer.add_document(
+                        **index.index_fields(
+                            document,
+                            viewer_ids.get(document.pk, []),
+                        ),
+                    )
+                progress.update(len(chunk))
+    except Exception:
+        writer.cancel()
+        raise
+    writer.commit()
+
+    if processes > 1:
+        # merge the segments of the processes into one
+        ix.optimize()
+
+    index.set_watermark(started)
 
 
 @shared_task
@@ -244,8 +307,6 @@ def sanity_check():
 def bulk_update_documents(document_ids):
     documents = Document.objects.filter(id__in=document_ids)
 
-    ix = index.open_index()
-
     for doc in documents:
         clear_document_caches(doc.pk)
         document_updated.send(
@@ -255,9 +316,200 @@ def bulk_update_documents(document_ids):
         )
         post_save.send(Document, instance=doc, created=False)
 
-    with AsyncWriter(ix) as writer:
-        for doc in documents:
-            index.update_document(writer, doc)
+    index.queue_index_update(document_ids)
+
+
+def _delete_document_batch(model, batch: list[int]) -> None:
+    """
+    Deletes a batch of documents below nodes of model. The aggregates of the
+    other trees are updated once for the batch, the nodes of model are
+    deleted afterwards and removed from their ancestors by delete_subtree.
+    """
+    with transaction.atomic():
+        batch_documents = Document.objects.filter(pk__in=batch)
+        file_ids = []
+        if model is Dossier:
+            # documents of a dossier also own a file node in the folder tree
+            file_ids = list(
+                Folder.objects.filter(
+                    pk__in=batch_documents.values("folder_id"),
+                    type=Folder.FILE,
+                ).values_list("pk", flat=True),
+            )
+        for tree_model in DOCUMENT_FIELDS:
+            if tree_model is not model:
+                remove_documents_aggregates(
+                    tree_model,
+                    batch_documents,
+                    skip_ids=file_ids if tree_model is Folder else (),
+                )
+        remove_leaf_aggregates(Folder, file_ids)
+        with suspended_aggregates():
+            batch_documents.delete()
+            Folder.objects.filter(pk__in=file_ids).delete()
+
+
+@shared_task(bind=True)
+def delete_subtree(
+    self,
+    model_name: str,
+    node_ids: list[int],
+    owner_id: Optional[int] = None,
+    batch_size: int = 500,
+):
+    """
+    Deletes the documents below the given folders, dossiers or warehouses in
+    batches and then the nodes themselves. Every batch is removed from the
+    index with one writer and from the aggregates of the other trees with
+    grouped updates, the roots are removed from their ancestors once at the
+    end and empty directories are pruned once as well. Progress goes to the
+    user who requested the deletion.
+    """
+    model = TREE_MODELS[model_name]
+    roots = list(model.objects.filter(pk__in=node_ids))
+    in_subtree = subtree_filter(DOCUMENT_FIELDS[model], model, node_ids)
+    documents = (
+        Document.objects.filter(in_subtree)
+        if in_subtree is not None
+        else Document.objects.none()
+    )
+    total = documents.count()
+    deleted = 0
+    extra_args = {"owner_id": owner_id}
+
+    with ProgressManager(
+        f"{model._meta.verbose_name_plural} {', '.join(r.name for r in roots)}",
+        self.request.id,
+    ) as status_mgr:
+        try:
+            with deferred_directory_cleanup():
+                status_mgr.send_progress(
+                    ProgressStatusOptions.STARTED,
+                    "Deleting documents",
+                    deleted,
+                    total,
+                    extra_args,
+                )
+                batches = documents.order_by("pk").values_list("pk", flat=True)
+                while batch := list(batches[:batch_size]):
+                    _delete_document_batch(model, batch)
+                    index.queue_index_update(batch)
+
+                    deleted += len(batch)
+                    status_mgr.send_progress(
+                        ProgressStatusOptions.WORKING,
+                        "Deleting documents",
+                        deleted,
+                        total,
+                        extra_args,
+                    )
+
+                with transaction.atomic(), suspended_aggregates():
+                    # the totals of the roots still include everything below
+                    for root in model.objects.filter(pk__in=[r.pk for r in roots]):
+                        if not any(
+                            other.pk != root.pk and is_in_subtree(root, other)
+                            for other in roots
+                        ):
+                            remove_node_aggregates(root)
+                    subtree(model, roots).delete()
+        except Exception as e:
+            # what is left of the nodes shows up again instead of staying hidden
+            unmark_deleting(model, node_ids)
+            status_mgr.send_progress(
+                ProgressStatusOptions.FAILED,
+                f"Deletion failed: {e!s}",
+                deleted,
+                total,
+                extra_args,
+            )
+            raise
+
+        status_mgr.send_progress(
+            ProgressStatusOptions.SUCCESS,
+            "Deleted",
+            total,
+            total,
+            extra_args,
+        )
+
+    return (
+        f"Deleted {len(roots)} {model._meta.verbose_name_plural} "
+        f"with {deleted} documents"
+    )
+
+
+@shared_task(bind=True)
+def run_export_job(self, job_id: int):
+    """
+    Builds the artifact of an export job into the scratch directory,
+    reporting progress over the status websocket of the job's owner
+    """
+    job = ExportJob.objects.get(pk=job_id)
+    ExportJob.objects.filter(pk=job.pk).update(status=states.STARTED)
+    extra_args = {"owner_id": job.owner_id, "export_job_id": job.pk}
+
+    with ProgressManager(job.filename, self.request.id) as status_mgr:
+        status_mgr.send_progress(
+            ProgressStatusOptions.STARTED,
+            "Exporting",
+            0,
+            100,
+            extra_args,
+        )
+
+        def progress(current: int, total: int):
+            status_mgr.send_progress(
+                ProgressStatusOptions.WORKING,
+                "Exporting",
+                current,
+                total,
+                extra_args,
+            )
+
+        try:
+            artifact = build_artifact(job, progress)
+        except Exception as e:
+            logger.exception(f"Export {job.filename} failed")
+            ExportJob.objects.filter(pk=job.pk).update(
+                status=states.FAILURE,
+                result=str(e),
+                finished=timezone.now(),
+            )
+            status_mgr.send_progress(
+                ProgressStatusOptions.FAILED,
+                f"Export failed: {e!s}",
+                100,
+                100,
+                extra_args,
+            )
+            raise
+
+        finished = timezone.now()
+        ExportJob.objects.filter(pk=job.pk).update(
+            status=states.SUCCESS,
+            artifact=str(artifact),
+            finished=finished,
+            expires=finished + timedelta(hours=settings.EXPORT_JOB_EXPIRY_HOURS),
+            result=None,
+        )
+        status_mgr.send_progress(
+            ProgressStatusOptions.SUCCESS,
+            "Exported",
+            100,
+            100,
+            extra_args,
+        )
+
+    return f"Exported {job.filename}"
+
+
+@shared_task
+def remove_expired_export_jobs():
+    """
+    Removes the export jobs and artifacts that can no longer be downloaded
+    """
+    return f"Removed {remove_expired_jobs()} expired exports"
 
 
 @shared_task
@@ -291,8 +543,7 @@ def update_document_archive_file(document_id):
 
         if parser.get_archive_path():
             with transaction.atomic():
-                with open(parser.get_archive_path(), "rb") as f:
-                    checksum = hashlib.md5(f.read()).hexdigest()
+                checksum = compute_checksum(parser.get_archive_path())
                 # I'm going to save first so that in case the file move
                 # fails, the database is rolled back.
                 # We also don't use save() since that triggers the filehandling
@@ -304,8 +555,13 @@ def update_document_archive_file(document_id):
                 oldDocument = Document.objects.get(pk=document.pk)
                 Document.objects.filter(pk=document.pk).update(
                     archive_checksum=checksum,
+                    archive_quick_checksum=compute_quick_checksum(
+                        parser.get_archive_path(),
+                    ),
+                    archive_size=os.path.getsize(parser.get_archive_path()),
                     content=parser.get_text(),
                     archive_filename=document.archive_filename,
+                    modified=timezone.now(),
                 )
                 newDocument = Document.objects.get(pk=document.pk)
                 if settings.AUDIT_LOG_ENABLED:
@@ -337,8 +593,7 @@ def update_document_archive_file(document_id):
                     shutil.move(parser.get_archive_path(), document.archive_path)
                     shutil.move(thumbnail, document.thumbnail_path)
 
-            with index.open_index_writer() as writer:
-                index.update_document(writer, document)
+            index.queue_index_update([document.pk])
 
             clear_document_caches(document.pk)
 
@@ -399,6 +654,10 @@ def update_document_field(document_id):
                             for f in fields:
                                 f.value_text = map_fields.get(f.field.name,None)
                             CustomFieldInstance.objects.bulk_update(fields, ['value_text'])
+                            refresh_instance_dossier_fields([f.pk for f in fields])
+                            Document.objects.filter(pk=document.pk).update(
+                                modified=timezone.now(),
+                            )
                 except Exception as e:
                     logger.exception(f"Error while parsing field form document {document} (ID: {document_id})",
                     # self.log.error("error ocr field",e)
@@ -5,6 +5,7 @@ import os
 import shutil
 import zipfile
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.test import override_settings
 from django.utils import timezone
@@ -15,9 +16,10 @@ from documents.models import Correspondent
 from documents.models import Document
 from documents.models import DocumentType
 from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import ExportJobMixin
 
 
-class TestBulkDownload(DirectoriesMixin, APITestCase):
+class TestBulkDownload(ExportJobMixin, DirectoriesMixin, APITestCase):
     ENDPOINT = "/api/documents/bulk_download/"
 
     def setUp(self):
@@ -80,7 +82,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 2)
             self.assertIn("2021-01-01 document A.pdf", zipf.namelist())
             self.assertIn("2020-03-21 document B.jpg", zipf.namelist())
@@ -101,7 +103,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 2)
             self.assertIn("2021-01-01 document A.pdf", zipf.namelist())
             self.assertIn("2020-03-21 document B.pdf", zipf.namelist())
@@ -122,7 +124,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 3)
             self.assertIn("originals/2021-01-01 document A.pdf", zipf.namelist())
             self.assertIn("archive/2020-03-21 document B.pdf", zipf.namelist())
@@ -156,7 +158,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 2)
 
             self.assertIn("2021-01-01 document A.pdf", zipf.namelist())
@@ -215,7 +217,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 2)
             self.assertIn("a space name/Title 2 - Doc 3.jpg", zipf.namelist())
             self.assertIn("test/This is Doc 2.pdf", zipf.namelist())
@@ -261,7 +263,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 2)
             self.assertIn("somewhere/This is Doc 2.pdf", zipf.namelist())
             self.assertIn("somewhere/Title 2 - Doc 3.pdf", zipf.namelist())
@@ -310,7 +312,7 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response["Content-Type"], "application/zip")
 
-        with zipfile.ZipFile(io.BytesIO(response.content)) as zipf:
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
             self.assertEqual(len(zipf.filelist), 3)
             self.assertIn("originals/bill/This is Doc 2.pdf", zipf.namelist())
             self.assertIn("archive/statement/Title 2 - Doc 3.pdf", zipf.namelist())
@@ -333,3 +335,120 @@ class TestBulkDownload(DirectoriesMixin, APITestCase):
                     f.read(),
                     zipf.read("originals/statement/Title 2 - Doc 3.jpg"),
                 )
+
+    def test_stream_download(self):
+        """
+        GIVEN:
+            - Documents with originals and archived versions
+        WHEN:
+            - A streamed bulk download of both is requested
+        THEN:
+            - The zip is streamed back directly, without an export job
+            - Files clashing by name are still made unique
+            - No temporary file is left in the scratch directory
+        """
+        response = self.client.post(
+            self.ENDPOINT,
+            {
+                "documents": [self.doc2.id, self.doc2b.id, self.doc3.id],
+                "content": "both",
+                "compression": "deflated",
+                "stream": True,
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertTrue(response.streaming)
+        self.export_job_mock.assert_not_called()
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
+            self.assertEqual(zipf.testzip(), None)
+            self.assertCountEqual(
+                zipf.namelist(),
+                [
+                    "originals/2021-01-01 document A.pdf",
+                    "originals/2021-01-01 document A_01.pdf",
+                    "archive/2020-03-21 document B.pdf",
+                    "originals/2020-03-21 document B.jpg",
+                ],
+            )
+            self.assertEqual(
+                zipf.getinfo("originals/2021-01-01 document A.pdf").compress_type,
+                zipfile.ZIP_DEFLATED,
+            )
+            with self.doc3.archive_file as f:
+                self.assertEqual(
+                    f.read(),
+                    zipf.read("archive/2020-03-21 document B.pdf"),
+                )
+
+        self.assertFalse(any(settings.SCRATCH_DIR.glob("*")))
+
+    def test_store_compressed(self):
+        """
+        GIVEN:
+            - A PDF and a JPEG document
+        WHEN:
+            - A compressed bulk download storing compressed formats is requested
+        THEN:
+            - The PDF and JPEG are stored without compression
+        """
+        for stream in [False, True]:
+            response = self.client.post(
+                self.ENDPOINT,
+                {
+                    "documents": [self.doc2.id, self.doc3.id],
+                    "content": "originals",
+                    "compression": "deflated",
+                    "store_compressed": True,
+                    "stream": stream,
+                },
+                format="json",
+            )
+
+            with zipfile.ZipFile(
+                io.BytesIO(b"".join(response.streaming_content)),
+            ) as zipf:
+                self.assertEqual(
+                    {info.compress_type for info in zipf.infolist()},
+                    {zipfile.ZIP_STORED},
+                )
+                with self.doc3.source_file as f:
+                    self.assertEqual(
+                        f.read(),
+                        zipf.read("2020-03-21 document B.jpg"),
+                    )
+
+    def test_background_download(self):
+        """
+        GIVEN:
+            - Documents with originals and archived versions
+        WHEN:
+            - A bulk download is requested in the background
+        THEN:
+            - An export job is created instead of returning the zip
+            - The zip can be downloaded from the job once it finished
+        """
+        response = self.client.post(
+            self.ENDPOINT,
+            {
+                "documents": [self.doc2.id, self.doc3.id],
+                "content": "originals",
+                "background": True,
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.export_job_mock.assert_called_once()
+
+        response = self.download_export(response)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zipf:
+            self.assertCountEqual(
+                zipf.namelist(),
+                ["2021-01-01 document A.pdf", "2020-03-21 document B.jpg"],
+            )
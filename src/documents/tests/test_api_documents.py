@@ -30,14 +30,17 @@ from documents.models import CustomField
 from documents.models import CustomFieldInstance
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import Folder
 from documents.models import MatchingModel
 from documents.models import Note
 from documents.models import SavedView
 from documents.models import ShareLink
 from documents.models import StoragePath
 from documents.models import Tag
+from documents.models import Warehouse
 from documents.tests.utils import DirectoriesMixin
 from documents.tests.utils import DocumentConsumeDelayMixin
+from documents.tests.utils import create_node
 
 
 class TestDocumentApi(DirectoriesMixin, DocumentConsumeDelayMixin, APITestCase):
@@ -552,6 +555,62 @@ class TestDocumentApi(DirectoriesMixin, DocumentConsumeDelayMixin, APITestCase):
             [doc1.id, doc2.id, doc3.id],
         )
 
+    def test_documents_tree_filters(self):
+        """
+        GIVEN:
+            - Documents in nested folders and warehouses
+        WHEN:
+            - Documents are filtered by a top level folder or warehouse
+        THEN:
+            - Documents anywhere below the selected nodes are matched
+        """
+        root = create_node(Folder, "root")
+        child = create_node(Folder, "child", root)
+        other = create_node(Folder, "other")
+        warehouse = create_node(Warehouse, "w", parent_field="parent_warehouse")
+        shelf = create_node(
+            Warehouse,
+            "shelf",
+            warehouse,
+            "parent_warehouse",
+            type=Warehouse.SHELF,
+        )
+        doc1 = Document.objects.create(
+            title="1",
+            checksum="A",
+            mime_type="application/pdf",
+            folder=child,
+            warehouse=shelf,
+        )
+        doc2 = Document.objects.create(
+            title="2",
+            checksum="B",
+            mime_type="application/pdf",
+            folder=other,
+        )
+        doc3 = Document.objects.create(
+            title="3",
+            checksum="C",
+            mime_type="application/pdf",
+        )
+
+        def ids(query):
+            response = self.client.get(f"/api/documents/?{query}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [doc["id"] for doc in response.data["results"]]
+
+        self.assertCountEqual(ids(f"folder__id__in={root.id}"), [doc1.id])
+        self.assertCountEqual(
+            ids(f"folder__id__in={root.id},{other.id}"),
+            [doc1.id, doc2.id],
+        )
+        self.assertCountEqual(ids("folder__id__in=9999"), [])
+        self.assertCountEqual(ids(f"warehouse__id__in={warehouse.id}"), [doc1.id])
+        self.assertCountEqual(
+            ids(f"warehouse__id__none={warehouse.id}"),
+            [doc2.id, doc3.id],
+        )
+
     def test_documents_title_content_filter(self):
         doc1 = Document.objects.create(
             title="title A",
@@ -736,12 +795,15 @@ class TestDocumentApi(DirectoriesMixin, DocumentConsumeDelayMixin, APITestCase):
             checksum="A",
             mime_type="application/pdf",
             content="abc",
+            original_size=100,
+            archive_size=50,
         )
         Document.objects.create(
             title="none2",
             checksum="B",
             mime_type="application/pdf",
             content="123",
+            original_size=20,
         )
         Document.objects.create(
             title="none3",
@@ -775,6 +837,8 @@ class TestDocumentApi(DirectoriesMixin, DocumentConsumeDelayMixin, APITestCase):
             1,
         )
         self.assertEqual(response.data["character_count"], 11)
+        self.assertEqual(response.data["original_size_total"], 120)
+        self.assertEqual(response.data["archive_size_total"], 50)
         self.assertEqual(response.data["tag_count"], 3)
         self.assertEqual(response.data["correspondent_count"], 2)
         self.assertEqual(response.data["document_type_count"], 1)
@@ -1260,6 +1324,34 @@ class TestDocumentApi(DirectoriesMixin, DocumentConsumeDelayMixin, APITestCase):
         self.assertIsNone(meta["archive_metadata"])
         self.assertIsNone(meta["archive_size"])
 
+    def test_get_metadata_stored_sizes(self):
+        """
+        GIVEN:
+            - A document with stored file sizes
+        WHEN:
+            - The metadata is requested
+        THEN:
+            - The stored sizes are returned without reading the files
+        """
+        doc = Document.objects.create(
+            title="test",
+            filename="file.pdf",
+            mime_type="application/pdf",
+            archive_filename="file.pdf",
+            archive_checksum="B",
+            checksum="A",
+            original_size=123,
+            archive_size=456,
+        )
+
+        with mock.patch("documents.views.DocumentViewSet.get_filesize") as m:
+            response = self.client.get(f"/api/documents/{doc.pk}/metadata/")
+            m.assert_not_called()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["original_size"], 123)
+        self.assertEqual(response.data["archive_size"], 456)
+
     def test_get_empty_suggestions(self):
         doc = Document.objects.create(title="test", mime_type="application/pdf")
 
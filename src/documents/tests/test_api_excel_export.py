@@ -0,0 +1,144 @@
+import datetime
+import io
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+from documents.models import Document
+from documents.models import Folder
+from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import ExportJobMixin
+from documents.tests.utils import create_node
+
+
+class TestApiExcelExport(ExportJobMixin, DirectoriesMixin, APITestCase):
+    ENDPOINT = "/api/documents/bulk_export_excel/"
+
+    def setUp(self):
+        super().setUp()
+
+        user = User.objects.create_superuser(username="temp_admin")
+        self.client.force_authenticate(user=user)
+
+        self.name = CustomField.objects.create(
+            name="name",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        self.amount = CustomField.objects.create(
+            name="amount",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        self.root = create_node(Folder, "root")
+        self.child = create_node(Folder, "child", self.root)
+
+    def create_document(self, i, folder=None, **fields):
+        document = Document.objects.create(
+            title=f"document {i}",
+            content=f"content {i}",
+            checksum=f"{i}",
+            mime_type="application/pdf",
+            created=timezone.make_aware(datetime.datetime(2024, 1, i + 1)),
+            folder=folder,
+        )
+        for field, value in fields.items():
+            CustomFieldInstance.objects.create(
+                document=document,
+                field=getattr(self, field),
+                value_text=value,
+            )
+        return document
+
+    def export(self, ids, **kwargs):
+        return self.client.post(
+            self.ENDPOINT,
+            {"documents": ids, **kwargs},
+            format="json",
+        )
+
+    def read_rows(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["Content-Type"],
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+        workbook = load_workbook(io.BytesIO(b"".join(response.streaming_content)))
+        return [list(row) for row in workbook.active.iter_rows(values_only=True)]
+
+    def test_export_documents(self):
+        """
+        GIVEN:
+            - Documents with custom field values
+        WHEN:
+            - The documents are exported to Excel, directly or in the background
+        THEN:
+            - Every document is a row with one column per custom field
+        """
+        doc1 = self.create_document(0, name="Nguyen Van A", amount="10")
+        doc2 = self.create_document(1, amount="20")
+
+        for response in [
+            self.export([doc1.id, doc2.id]),
+            self.download_export(self.export([doc1.id, doc2.id], background=True)),
+        ]:
+            self.assertEqual(
+                self.read_rows(response),
+                [
+                    ["Tên file", "Nội dung", "Ngày tạo", "amount", "name"],
+                    ["document 0", "content 0", "01-01-2024", "10", "Nguyen Van A"],
+                    ["document 1", "content 1", "02-01-2024", "20", None],
+                ],
+            )
+        self.export_job_mock.assert_called_once()
+
+    def test_export_queries(self):
+        """
+        GIVEN:
+            - Documents with custom field values
+        WHEN:
+            - A few or many more documents are exported
+        THEN:
+            - The number of queries stays the same
+        """
+        ids = [self.create_document(0, name="a", amount="1").id]
+        with CaptureQueriesContext(connection) as few:
+            self.read_rows(self.export(ids))
+
+        ids += [self.create_document(i, name="b", amount="2").id for i in range(1, 6)]
+        with CaptureQueriesContext(connection) as many:
+            rows = self.read_rows(self.export(ids))
+
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(len(many), len(few))
+
+    def test_export_folder_subtree(self):
+        """
+        GIVEN:
+            - Documents in a folder, a child folder and outside of both
+        WHEN:
+            - The folder is exported to Excel, directly or in the background
+        THEN:
+            - The documents of the whole subtree are exported
+        """
+        self.create_document(0, folder=self.root, name="a")
+        self.create_document(1, folder=self.child, name="b")
+        self.create_document(2, name="c")
+
+        url = f"/api/folders/{self.root.id}/bulk_export_excel/"
+        for response in [
+            self.client.get(url),
+            self.download_export(self.client.get(url, {"background": "true"})),
+        ]:
+            rows = self.read_rows(response)
+            self.assertEqual(rows[0], ["Tên file", "Nội dung", "Ngày tạo", "name"])
+            self.assertCountEqual(
+                [row[0] for row in rows[1:]],
+                ["document 0", "document 1"],
+            )
+        self.export_job_mock.assert_called_once()
@@ -0,0 +1,304 @@
+import csv
+import datetime
+import io
+from pathlib import Path
+from unittest import mock
+
+from celery import states
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from documents import tasks
+from documents.export_jobs import export_dir
+from documents.export_jobs import write_zip
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+from documents.models import Document
+from documents.models import ExportJob
+from documents.models import Folder
+from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import DummyProgressManager
+from documents.tests.utils import ExportJobMixin
+from documents.tests.utils import create_node
+
+
+class TestApiExportJobs(ExportJobMixin, DirectoriesMixin, APITestCase):
+    ENDPOINT = "/api/export_jobs/"
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_user(username="temp_user")
+        self.client.force_authenticate(user=self.user)
+
+        self.field = CustomField.objects.create(
+            name="name",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        self.root = create_node(Folder, "root")
+        self.file = create_node(Folder, "file", self.root, type=Folder.FILE)
+        self.doc = Document.objects.create(
+            title="document",
+            content="content",
+            checksum="A",
+            mime_type="application/pdf",
+            created=timezone.make_aware(datetime.datetime(2024, 3, 1)),
+            folder=self.file,
+        )
+        CustomFieldInstance.objects.create(
+            document=self.doc,
+            field=self.field,
+            value_text="Nguyen Van A",
+        )
+
+    def test_export_csv(self):
+        """
+        GIVEN:
+            - A folder with a document in its subtree
+        WHEN:
+            - A CSV export job of the folder is created
+        THEN:
+            - The job is accepted and built in the background
+            - Progress is reported to the owner of the job
+            - The finished CSV can be downloaded until the job expires
+        """
+        managers = []
+
+        def progress_manager(*args):
+            managers.append(DummyProgressManager(*args))
+            return managers[-1]
+
+        with mock.patch("documents.tasks.ProgressManager", progress_manager):
+            response = self.client.post(
+                self.ENDPOINT,
+                {"export_type": "csv", "folders": [self.root.id]},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["filename"], "documents.csv")
+        self.assertEqual(response.data["status"], states.PENDING)
+
+        job = ExportJob.objects.get(pk=response.data["id"])
+        self.assertEqual(job.status, states.SUCCESS)
+        self.assertEqual(job.owner, self.user)
+        self.assertIsNotNone(job.expires)
+        payloads = managers[0].payloads
+        self.assertEqual(payloads[-1]["data"]["status"], "SUCCESS")
+        self.assertEqual(payloads[-1]["data"]["owner_id"], self.user.id)
+
+        response = self.client.get(f"{self.ENDPOINT}{job.id}/download/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        content = b"".join(response.streaming_content).decode()
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["id"], str(self.doc.id))
+        self.assertEqual(rows[0]["created"], "2024-03-01T00:00:00+00:00")
+        self.assertEqual(rows[0]["name"], "Nguyen Van A")
+
+    @mock.patch("documents.export_jobs.EXPORT_CHUNK_SIZE", 2)
+    @mock.patch("documents.export_jobs.zip_strategy")
+    def test_zip_progress_per_chunk(self, zip_strategy):
+        """
+        GIVEN:
+            - More documents than fit in one chunk
+        WHEN:
+            - They are written to a zip archive
+        THEN:
+            - Progress is reported once per chunk and at the end
+        """
+        for i in range(2):
+            Document.objects.create(
+                title=f"doc{i}",
+                checksum=f"{i}",
+                mime_type="application/pdf",
+            )
+        progress = mock.Mock()
+        export_dir().mkdir(parents=True, exist_ok=True)
+
+        write_zip(
+            Document.objects.all(),
+            export_dir() / "test.zip",
+            progress=progress,
+        )
+
+        strategy = zip_strategy.return_value.return_value
+        self.assertEqual(strategy.add_document.call_count, 3)
+        self.assertEqual(progress.call_args_list, [mock.call(2, 3), mock.call(3, 3)])
+
+    def test_invalid_export(self):
+        """
+        GIVEN:
+            - Export requests with both or neither documents and folders
+        WHEN:
+            - The export jobs are created
+        THEN:
+            - The requests are rejected and no job is queued
+        """
+        for data in [
+            {"export_type": "excel"},
+            {"export_type": "excel", "documents": [self.doc.id], "folders": [1]},
+            {"export_type": "pdf", "documents": [self.doc.id]},
+        ]:
+            response = self.client.post(self.ENDPOINT, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.export_job_mock.assert_not_called()
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_unfinished_and_failed_export(self):
+        """
+        GIVEN:
+            - An export job that has not run yet and one that failed
+        WHEN:
+            - The artifacts are downloaded
+        THEN:
+            - The download is refused
+            - The failure is recorded on the job
+        """
+        self.export_job_mock.side_effect = None
+        response = self.client.post(
+            self.ENDPOINT,
+            {"export_type": "excel", "documents": [self.doc.id]},
+            format="json",
+        )
+        job = ExportJob.objects.get(pk=response.data["id"])
+        self.export_job_mock.assert_called_once_with((job.pk,), task_id=job.task_id)
+
+        response = self.client.get(f"{self.ENDPOINT}{job.id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        with mock.patch(
+            "documents.tasks.build_artifact",
+            side_effect=OSError("disk full"),
+        ):
+            with self.assertRaises(OSError):
+                tasks.run_export_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, states.FAILURE)
+        self.assertEqual(job.result, "disk full")
+        response = self.client.get(f"{self.ENDPOINT}{job.id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_jobs_of_other_users(self):
+        """
+        GIVEN:
+            - An export job of another user
+        WHEN:
+            - The jobs are listed and the artifact is downloaded
+        THEN:
+            - The job is not visible
+        """
+        other = User.objects.create_user(username="other")
+        job = ExportJob.objects.create(
+            owner=other,
+            export_type=ExportJob.EXPORT_EXCEL,
+            filename="download.xlsx",
+            status=states.SUCCESS,
+        )
+
+        response = self.client.get(self.ENDPOINT)
+        self.assertEqual(response.data["count"], 0)
+        response = self.client.get(f"{self.ENDPOINT}{job.id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_expired_exports(self):
+        """
+        GIVEN:
+            - A finished export job
+        WHEN:
+            - The job expires and expired jobs are removed
+        THEN:
+            - The artifact can no longer be downloaded
+            - The job and its artifact are removed
+        """
+        response = self.client.post(
+            self.ENDPOINT,
+            {"export_type": "excel", "documents": [self.doc.id]},
+            format="json",
+        )
+        job = ExportJob.objects.get(pk=response.data["id"])
+        artifact = Path(job.artifact)
+        self.assertTrue(artifact.is_file())
+
+        ExportJob.objects.filter(pk=job.pk).update(
+            expires=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        response = self.client.get(f"{self.ENDPOINT}{job.id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        tasks.remove_expired_export_jobs()
+
+        self.assertFalse(ExportJob.objects.exists())
+        self.assertFalse(artifact.exists())
+
+    def test_stale_exports(self):
+        """
+        GIVEN:
+            - Export jobs whose task died while pending or started, one of
+              them leaving a partial artifact behind
+            - A recent unfinished export job
+        WHEN:
+            - Expired jobs are removed
+        THEN:
+            - The jobs older than the expiry and their files are removed
+            - The recent job is kept
+        """
+        old = timezone.now() - datetime.timedelta(days=2)
+        pending = ExportJob.objects.create(
+            owner=self.user,
+            export_type=ExportJob.EXPORT_EXCEL,
+            parameters={"documents": [self.doc.id]},
+            filename="pending.xlsx",
+        )
+        started = ExportJob.objects.create(
+            owner=self.user,
+            export_type=ExportJob.EXPORT_EXCEL,
+            parameters={"documents": [self.doc.id]},
+            filename="started.xlsx",
+            status=states.STARTED,
+        )
+        ExportJob.objects.filter(pk__in=[pending.pk, started.pk]).update(
+            created=old,
+        )
+        recent = ExportJob.objects.create(
+            owner=self.user,
+            export_type=ExportJob.EXPORT_EXCEL,
+            parameters={"documents": [self.doc.id]},
+            filename="recent.xlsx",
+            status=states.STARTED,
+        )
+        export_dir().mkdir(parents=True, exist_ok=True)
+        partial = export_dir() / f"{started.pk}-partial.xlsx"
+        partial.touch()
+
+        tasks.remove_expired_export_jobs()
+
+        self.assertQuerySetEqual(ExportJob.objects.all(), [recent])
+        self.assertFalse(partial.exists())
+
+    def test_delete_export(self):
+        """
+        GIVEN:
+            - A finished export job
+        WHEN:
+            - The job is deleted
+        THEN:
+            - Its artifact is removed as well
+        """
+        response = self.client.post(
+            self.ENDPOINT,
+            {"export_type": "excel", "documents": [self.doc.id]},
+            format="json",
+        )
+        job = ExportJob.objects.get(pk=response.data["id"])
+
+        response = self.client.delete(f"{self.ENDPOINT}{job.id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Path(job.artifact).exists())
@@ -3,15 +3,22 @@ from unittest import mock
 
 from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from documents.models import Correspondent
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import Dossier
+from documents.models import Folder
 from documents.models import StoragePath
 from documents.models import Tag
+from documents.models import Warehouse
 from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import create_node
 
 
 class TestApiObjects(DirectoriesMixin, APITestCase):
@@ -427,3 +434,602 @@ class TestBulkEditObjects(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         self.assertEqual(response.content, b"Insufficient permissions")
+
+
+class TestApiTreeMove(DirectoriesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_superuser(username="temp_admin")
+        self.client.force_authenticate(user=self.user)
+
+        self.root1 = create_node(Folder, "root1")
+        self.root2 = create_node(Folder, "root2")
+        self.child = create_node(Folder, "child", self.root1)
+        self.grandchild = create_node(Folder, "grandchild", self.child)
+
+    def test_move_folder(self):
+        """
+        GIVEN:
+            - A folder with nested children
+        WHEN:
+            - The folder is moved to another parent through the API
+        THEN:
+            - The paths of all descendants are updated
+        """
+        response = self.client.patch(
+            f"/api/folders/{self.child.id}/",
+            {"parent_folder": self.root2.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.grandchild.refresh_from_db()
+        self.assertEqual(
+            self.grandchild.path,
+            f"{self.root2.id}/{self.child.id}/{self.grandchild.id}/",
+        )
+
+    def test_move_folder_into_descendant(self):
+        """
+        GIVEN:
+            - A folder with nested children
+        WHEN:
+            - The folder is moved into one of its descendants
+        THEN:
+            - The request is rejected and nothing is changed
+        """
+        response = self.client.patch(
+            f"/api/folders/{self.root1.id}/",
+            {"parent_folder": self.grandchild.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.root1.refresh_from_db()
+        self.assertIsNone(self.root1.parent_folder)
+
+    def test_bulk_move_folders(self):
+        """
+        GIVEN:
+            - Nested folders
+        WHEN:
+            - bulk_edit_objects API endpoint is called with update operation
+        THEN:
+            - The folders and their descendants are moved
+            - Moving a folder into its own subtree is rejected as a whole
+        """
+        response = self.client.post(
+            "/api/bulk_edit_objects/",
+            json.dumps(
+                {
+                    "objects": [self.child.id],
+                    "object_type": "folders",
+                    "operation": "update",
+                    "parent_folder": self.root2.id,
+                },
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.grandchild.refresh_from_db()
+        self.assertEqual(
+            self.grandchild.path,
+            f"{self.root2.id}/{self.child.id}/{self.grandchild.id}/",
+        )
+
+        response = self.client.post(
+            "/api/bulk_edit_objects/",
+            json.dumps(
+                {
+                    "objects": [self.root1.id, self.root2.id],
+                    "object_type": "folders",
+                    "operation": "update",
+                    "parent_folder": self.grandchild.id,
+                },
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.root1.refresh_from_db()
+        self.assertIsNone(self.root1.parent_folder)
+
+    def test_move_warehouse_shelf(self):
+        """
+        GIVEN:
+            - A shelf with a boxcase in a warehouse
+        WHEN:
+            - The shelf is moved to another warehouse or below a shelf
+        THEN:
+            - The boxcase path follows the shelf
+            - A shelf cannot be placed below another shelf
+        """
+        w1 = create_node(Warehouse, "w1", parent_field="parent_warehouse")
+        w2 = create_node(Warehouse, "w2", parent_field="parent_warehouse")
+        shelf = create_node(
+            Warehouse,
+            "shelf",
+            w1,
+            "parent_warehouse",
+            type=Warehouse.SHELF,
+        )
+        other_shelf = create_node(
+            Warehouse,
+            "other shelf",
+            w2,
+            "parent_warehouse",
+            type=Warehouse.SHELF,
+        )
+        box = create_node(
+            Warehouse,
+            "box",
+            shelf,
+            "parent_warehouse",
+            type=Warehouse.BOXCASE,
+        )
+
+        response = self.client.patch(
+            f"/api/warehouses/{shelf.id}/",
+            {"parent_warehouse": w2.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        box.refresh_from_db()
+        self.assertEqual(box.path, f"{w2.id}/{shelf.id}/{box.id}/")
+
+        response = self.client.patch(
+            f"/api/warehouses/{shelf.id}/",
+            {"parent_warehouse": other_shelf.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        shelf.refresh_from_db()
+        self.assertEqual(shelf.parent_warehouse, w2)
+
+    def test_move_dossier(self):
+        """
+        GIVEN:
+            - Nested dossiers
+        WHEN:
+            - A dossier is moved to the top level or into its own subtree
+        THEN:
+            - The paths of its descendants are updated
+            - Moving into its own subtree is rejected
+        """
+        d1 = create_node(Dossier, "d1", parent_field="parent_dossier")
+        d2 = create_node(Dossier, "d2", d1, "parent_dossier")
+        d3 = create_node(Dossier, "d3", d2, "parent_dossier")
+
+        response = self.client.patch(
+            f"/api/dossiers/{d2.id}/",
+            {"parent_dossier": None},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        d3.refresh_from_db()
+        self.assertEqual(d3.path, f"{d2.id}/{d3.id}/")
+
+        response = self.client.patch(
+            f"/api/dossiers/{d2.id}/",
+            {"parent_dossier": d3.id},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        d2.refresh_from_db()
+        self.assertIsNone(d2.parent_dossier)
+
+
+class TestApiWarehouseDocumentCount(DirectoriesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_superuser(username="temp_admin")
+        self.client.force_authenticate(user=self.user)
+
+        self.w1 = create_node(Warehouse, "w1", parent_field="parent_warehouse")
+        self.w2 = create_node(Warehouse, "w2", parent_field="parent_warehouse")
+        self.shelf = create_node(
+            Warehouse,
+            "shelf",
+            self.w1,
+            "parent_warehouse",
+            type=Warehouse.SHELF,
+        )
+        self.box1 = create_node(
+            Warehouse,
+            "box1",
+            self.shelf,
+            "parent_warehouse",
+            type=Warehouse.BOXCASE,
+        )
+        self.box2 = create_node(
+            Warehouse,
+            "box2",
+            self.shelf,
+            "parent_warehouse",
+            type=Warehouse.BOXCASE,
+        )
+        for i, box in enumerate([self.box1, self.box2, self.box2]):
+            Document.objects.create(
+                title=f"doc{i}",
+                checksum=f"{i}",
+                mime_type="application/pdf",
+                warehouse=box,
+            )
+
+    def get_counts(self, **params):
+        response = self.client.get(
+            "/api/warehouses/",
+            {"page_size": 100, **params},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(w["name"], w["document_count"]) for w in response.data["results"]]
+
+    def test_warehouse_document_counts(self):
+        """
+        GIVEN:
+            - A warehouse with a shelf and boxcases containing documents
+        WHEN:
+            - Warehouses are listed, retrieved and ordered by document count
+        THEN:
+            - Every level reports the documents of its whole subtree
+            - The number of queries does not grow with the number of warehouses
+        """
+        self.assertCountEqual(
+            self.get_counts(),
+            [("w1", 3), ("w2", 0), ("shelf", 3), ("box1", 1), ("box2", 2)],
+        )
+
+        response = self.client.get(f"/api/warehouses/{self.shelf.id}/")
+        self.assertEqual(response.data["document_count"], 3)
+
+        self.assertEqual(
+            [name for name, _ in self.get_counts(ordering="document_count")][:3],
+            ["w2", "box1", "box2"],
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            self.get_counts()
+        for i in range(5):
+            create_node(
+                Warehouse,
+                f"box{i + 3}",
+                self.shelf,
+                "parent_warehouse",
+                type=Warehouse.BOXCASE,
+            )
+        with self.assertNumQueries(len(context.captured_queries)):
+            self.get_counts()
+
+    def test_warehouse_document_counts_permissions(self):
+        """
+        GIVEN:
+            - Documents of different owners in a boxcase
+        WHEN:
+            - A regular user lists warehouses
+        THEN:
+            - Only documents visible to the user are counted
+            - The number of queries does not grow with the number of warehouses
+        """
+        user = User.objects.create_user(username="regular")
+        user.user_permissions.add(*Permission.objects.filter(codename="view_warehouse"))
+        self.client.force_authenticate(user=user)
+        Document.objects.filter(title="doc1").update(owner=self.user)
+
+        self.assertCountEqual(
+            self.get_counts(),
+            [("w1", 2), ("w2", 0), ("shelf", 2), ("box1", 1), ("box2", 1)],
+        )
+
+        response = self.client.get(f"/api/warehouses/{self.shelf.id}/")
+        self.assertEqual(response.data["document_count"], 2)
+
+        self.assertCountEqual(
+            self.get_counts(ordering="-document_count")[:2],
+            [("w1", 2), ("shelf", 2)],
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            self.get_counts()
+        for i in range(5):
+            create_node(
+                Warehouse,
+                f"box{i + 3}",
+                self.shelf,
+                "parent_warehouse",
+                type=Warehouse.BOXCASE,
+            )
+        with self.assertNumQueries(len(context.captured_queries)):
+            self.get_counts()
+
+
+class TestApiTreeBrowse(DirectoriesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+        self.user = User.objects.create_superuser(username="temp_admin")
+        self.client.force_authenticate(user=self.user)
+
+        self.root = create_node(Folder, "root")
+        for name in ["b", "A", "c"]:
+            create_node(Folder, name, self.root)
+        for i in range(5):
+            file = create_node(Folder, f"file{i}", self.root, type=Folder.FILE)
+            Document.objects.create(
+                title=f"file{i}",
+                checksum=f"{i}",
+                mime_type="application/pdf",
+                content="a lot of text",
+                folder=file,
+            )
+
+    def browse(self, url="/api/folders/browse/", **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_browse_folder(self):
+        """
+        GIVEN:
+            - A folder with child folders and files
+        WHEN:
+            - The folder is browsed page by page
+        THEN:
+            - Folders are listed first, then files, each ordered by name
+            - Rows leave out document contents and link files to documents
+            - The parent carries its stored totals
+        """
+        names = []
+        url = "/api/folders/browse/"
+        params = {"parent": self.root.id, "page_size": 3}
+        pages = 0
+        while url:
+            response = self.browse(url, **params)
+            names.extend(row["name"] for row in response.data["results"])
+            url, params = response.data["next"], {}
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(
+            names,
+            ["A", "b", "c", "file0", "file1", "file2", "file3", "file4"],
+        )
+
+        response = self.browse(parent=self.root.id, page_size=4)
+        rows = response.data["results"]
+        self.assertNotIn("content", rows[0])
+        self.assertIsNone(rows[0]["document"])
+        self.assertEqual(
+            rows[3]["document"],
+            Document.objects.get(title="file0").id,
+        )
+        self.assertEqual(response.data["parent"]["subtree_document_count"], 5)
+        self.assertEqual(response.data["parent"]["child_count"], 8)
+
+        response = self.browse()
+        self.assertEqual(
+            [row["name"] for row in response.data["results"]],
+            ["root"],
+        )
+        self.assertIsNone(response.data["parent"])
+
+    def test_browse_page_boundary(self):
+        """
+        GIVEN:
+            - A folder without files
+        WHEN:
+            - A page ends with the last folder
+        THEN:
+            - No next page is offered
+        """
+        response = self.browse(parent=self.root.id, page_size=3)
+        self.assertIsNotNone(response.data["next"])
+
+        empty = create_node(Folder, "empty")
+        create_node(Folder, "only", empty)
+        response = self.browse(parent=empty.id, page_size=1)
+        self.assertIsNone(response.data["next"])
+
+    def test_browse_invalid(self):
+        """
+        GIVEN:
+            - A folder owned by another user
+        WHEN:
+            - It is browsed by a regular user, or with an invalid cursor
+        THEN:
+            - The request is rejected
+        """
+        response = self.client.get("/api/folders/browse/", {"cursor": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get("/api/folders/browse/", {"parent": 9999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        user = User.objects.create_user(username="regular")
+        user.user_permissions.add(*Permission.objects.filter(codename="view_folder"))
+        self.client.force_authenticate(user=user)
+        Folder.objects.filter(pk=self.root.pk).update(owner=self.user)
+
+        response = self.client.get(
+            "/api/folders/browse/",
+            {"parent": self.root.id},
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.browse()
+        self.assertEqual(response.data["results"], [])
+
+    def test_browse_totals_permissions(self):
+        """
+        GIVEN:
+            - A folder with files, some of them owned by another user
+        WHEN:
+            - The folder is browsed by a regular user
+        THEN:
+            - The totals only include the documents the user may view
+        """
+        Document.objects.update(original_size=10)
+        Document.objects.filter(title__in=["file0", "file1"]).update(owner=self.user)
+        user = User.objects.create_user(username="regular")
+        user.user_permissions.add(*Permission.objects.filter(codename="view_folder"))
+        self.client.force_authenticate(user=user)
+
+        response = self.browse(parent=self.root.id)
+
+        self.assertEqual(response.data["parent"]["subtree_document_count"], 3)
+        self.assertEqual(response.data["parent"]["subtree_size"], 30)
+        totals = {
+            row["name"]: (row["subtree_document_count"], row["subtree_size"])
+            for row in response.data["results"]
+        }
+        self.assertEqual(totals["A"], (0, 0))
+        self.assertEqual(totals["file0"], (0, 0))
+        self.assertEqual(totals["file2"], (1, 10))
+
+    def test_breadcrumbs(self):
+        """
+        GIVEN:
+            - A folder below a root folder
+        WHEN:
+            - The path of the folder is requested
+        THEN:
+            - The ids and names from the root down to the folder are returned
+        """
+        child = Folder.objects.get(name="b")
+
+        response = self.client.get(f"/api/folders/{child.id}/folder_path/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"id": self.root.id, "name": "root"},
+                {"id": child.id, "name": "b"},
+            ],
+        )
+
+        response = self.client.get("/api/folders/9999/folder_path/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_browse_dossier(self):
+        """
+        GIVEN:
+            - A dossier with a child dossier and a file
+        WHEN:
+            - The dossier is browsed
+        THEN:
+            - The child dossier is listed before the file
+        """
+        dossier = create_node(Dossier, "z", parent_field="parent_dossier")
+        create_node(Dossier, "b", dossier, "parent_dossier", type="FILE")
+        create_node(Dossier, "c", dossier, "parent_dossier")
+
+        response = self.browse("/api/dossiers/browse/", parent=dossier.id)
+
+        self.assertEqual(
+            [row["name"] for row in response.data["results"]],
+            ["c", "b"],
+        )
+
+
+class TestApiTreeDelete(DirectoriesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User.objects.create_superuser(username="temp_admin")
+        self.client.force_authenticate(user=self.user)
+
+        self.root = create_node(Folder, "root")
+        self.child = create_node(Folder, "child", self.root)
+        self.other = create_node(Folder, "other")
+
+    @mock.patch("documents.views.delete_subtree.delay")
+    def test_delete_folder(self, delete):
+        """
+        GIVEN:
+            - A folder with a child folder
+        WHEN:
+            - The folder is deleted
+        THEN:
+            - The subtree is hidden right away
+            - Deleting the subtree is left to a background task
+        """
+        delete.return_value.id = "task-id"
+
+        response = self.client.delete(f"/api/folders/{self.root.id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["task_id"], "task-id")
+        delete.assert_called_once_with(
+            "folder",
+            [self.root.id],
+            owner_id=self.user.id,
+        )
+        self.assertCountEqual(
+            Folder.objects.filter(deleting=True),
+            [self.root, self.child],
+        )
+
+        response = self.client.get("/api/folders/")
+        self.assertEqual(
+            [folder["id"] for folder in response.data["results"]],
+            [self.other.id],
+        )
+
+        response = self.client.delete(f"/api/folders/{self.root.id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @mock.patch("documents.views.delete_subtree.delay")
+    def test_delete_folder_enqueue_failed(self, delete):
+        """
+        GIVEN:
+            - A folder with a child folder
+        WHEN:
+            - The folder is deleted, but the task cannot be queued
+        THEN:
+            - The subtree is not hidden
+        """
+        delete.side_effect = OSError("broker unavailable")
+
+        with self.assertRaises(OSError):
+            self.client.delete(f"/api/folders/{self.root.id}/")
+
+        self.assertFalse(Folder.objects.filter(deleting=True).exists())
+
+    @mock.patch("documents.views.delete_subtree.delay")
+    def test_bulk_delete_dossiers(self, delete):
+        """
+        GIVEN:
+            - Dossiers
+        WHEN:
+            - The dossiers are deleted with bulk edit
+        THEN:
+            - A single background task deletes all of them
+        """
+        delete.return_value.id = "task-id"
+        d1 = create_node(Dossier, "d1", parent_field="parent_dossier")
+        d2 = create_node(Dossier, "d2", parent_field="parent_dossier")
+
+        response = self.client.post(
+            "/api/bulk_edit_objects/",
+            json.dumps(
+                {
+                    "objects": [d1.id, d2.id],
+                    "object_type": "dossiers",
+                    "operation": "delete",
+                },
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        delete.assert_called_once()
+        self.assertCountEqual(delete.call_args.args[1], [d1.id, d2.id])
+        self.assertEqual(Dossier.objects.filter(deleting=True).count(), 2)
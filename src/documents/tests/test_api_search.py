@@ -19,10 +19,14 @@ from documents.models import CustomField
 from documents.models import CustomFieldInstance
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import Dossier
+from documents.models import Folder
 from documents.models import Note
 from documents.models import StoragePath
 from documents.models import Tag
 from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import create_node
+from documents.tree import move_subtree
 
 
 class TestDocumentSearchApi(DirectoriesMixin, APITestCase):
@@ -920,6 +924,195 @@ class TestDocumentSearchApi(DirectoriesMixin, APITestCase):
             ),
         )
 
+    def test_search_filtering_custom_field_columns(self):
+        """
+        GIVEN:
+            - Documents with integer, date, boolean and string custom fields,
+              some of them stored as text as read with OCR
+        WHEN:
+            - Search results are filtered by the values of the fields
+        THEN:
+            - Documents are filtered by the typed values of the fields
+            - Filters with invalid values are ignored
+        """
+        number = CustomField.objects.create(
+            name="number",
+            data_type=CustomField.FieldDataType.INT,
+        )
+        issued = CustomField.objects.create(
+            name="issued",
+            data_type=CustomField.FieldDataType.DATE,
+        )
+        signed = CustomField.objects.create(
+            name="signed",
+            data_type=CustomField.FieldDataType.BOOL,
+        )
+        code = CustomField.objects.create(
+            name="code",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        d1 = Document.objects.create(title="test 1", checksum="1", content="test")
+        d2 = Document.objects.create(title="test 2", checksum="2", content="test")
+        d3 = Document.objects.create(title="test 3", checksum="3", content="test")
+        CustomFieldInstance.objects.create(document=d1, field=number, value_int=42)
+        CustomFieldInstance.objects.create(
+            document=d2,
+            field=number,
+            value_text="1.250",
+        )
+        CustomFieldInstance.objects.create(
+            document=d1,
+            field=issued,
+            value_date=datetime.date(2024, 3, 15),
+        )
+        CustomFieldInstance.objects.create(
+            document=d2,
+            field=issued,
+            value_text="16/03/2024",
+        )
+        CustomFieldInstance.objects.create(document=d1, field=signed, value_bool=True)
+        CustomFieldInstance.objects.create(
+            document=d3,
+            field=signed,
+            value_bool=False,
+        )
+        CustomFieldInstance.objects.create(
+            document=d3,
+            field=code,
+            value_text="QD-12 ",
+        )
+
+        with AsyncWriter(index.open_index()) as writer:
+            for doc in Document.objects.all():
+                index.update_document(writer, doc)
+
+        def search_query(q):
+            r = self.client.get("/api/documents/?query=test" + q)
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            return [hit["id"] for hit in r.data["results"]]
+
+        self.assertEqual(search_query(f"&custom_field_{number.id}__gt=42"), [d2.id])
+        self.assertCountEqual(
+            search_query(f"&custom_field_{number.id}__range=1,1250"),
+            [d1.id, d2.id],
+        )
+        self.assertCountEqual(
+            search_query(f"&custom_field_{number.id}__in=42,7"),
+            [d1.id],
+        )
+        self.assertEqual(
+            search_query(f"&custom_field_{issued.id}__gte=2024-03-16"),
+            [d2.id],
+        )
+        self.assertEqual(
+            search_query(f"&custom_field_{issued.id}__lte=2024-03-15"),
+            [d1.id],
+        )
+        self.assertEqual(
+            search_query(f"&custom_field_{issued.id}__exact=2024-03-15"),
+            [d1.id],
+        )
+        self.assertEqual(
+            search_query(f"&custom_field_{signed.id}__exact=false"),
+            [d3.id],
+        )
+        self.assertEqual(
+            search_query(f"&custom_field_{code.id}__exact=qd-12"),
+            [d3.id],
+        )
+        self.assertEqual(
+            search_query(
+                f"&custom_field_{number.id}__gte=100"
+                f"&custom_field_{issued.id}__lt=2024-03-16",
+            ),
+            [],
+        )
+        self.assertCountEqual(
+            search_query(f"&custom_field_{number.id}__gt=many"),
+            [d1.id, d2.id, d3.id],
+        )
+        self.assertCountEqual(
+            search_query("&custom_field_999__exact=1"),
+            [d1.id, d2.id, d3.id],
+        )
+
+    def test_search_filtering_subtree(self):
+        """
+        GIVEN:
+            - Documents in folders and dossiers at different depths of their
+              trees
+        WHEN:
+            - Search results are filtered by subtree
+            - A folder is moved to another parent
+        THEN:
+            - Documents anywhere below the given nodes are returned
+            - After the move, its documents are found below the new parent
+        """
+        root1 = create_node(Folder, "root1")
+        root2 = create_node(Folder, "root2")
+        child = create_node(Folder, "child", root1)
+        grandchild = create_node(Folder, "grandchild", child)
+        dossier = create_node(Dossier, "dossier", parent_field="parent_dossier")
+        sub_dossier = create_node(
+            Dossier,
+            "sub dossier",
+            dossier,
+            parent_field="parent_dossier",
+        )
+        d1 = Document.objects.create(
+            title="test 1",
+            checksum="1",
+            content="test",
+            folder=root1,
+        )
+        d2 = Document.objects.create(
+            title="test 2",
+            checksum="2",
+            content="test",
+            folder=grandchild,
+            dossier=sub_dossier,
+        )
+        d3 = Document.objects.create(
+            title="test 3",
+            checksum="3",
+            content="test",
+            folder=root2,
+        )
+
+        with AsyncWriter(index.open_index()) as writer:
+            for doc in Document.objects.all():
+                index.update_document(writer, doc)
+
+        def search_query(q):
+            r = self.client.get("/api/documents/?query=test" + q)
+            self.assertEqual(r.status_code, status.HTTP_200_OK)
+            return [hit["id"] for hit in r.data["results"]]
+
+        self.assertCountEqual(
+            search_query(f"&folder__id__subtree={root1.id}"),
+            [d1.id, d2.id],
+        )
+        self.assertEqual(search_query(f"&folder__id__subtree={child.id}"), [d2.id])
+        self.assertCountEqual(
+            search_query(f"&folder__id__subtree={child.id},{root2.id}"),
+            [d2.id, d3.id],
+        )
+        self.assertEqual(search_query(f"&dossier__id__subtree={dossier.id}"), [d2.id])
+        self.assertEqual(search_query(f"&dossier__id={sub_dossier.id}"), [d2.id])
+        self.assertCountEqual(
+            search_query("&dossier__isnull=true"),
+            [d1.id, d3.id],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move_subtree(child, root2)
+
+        self.assertEqual(search_query(f"&folder__id__subtree={root1.id}"), [d1.id])
+        self.assertCountEqual(
+            search_query(f"&folder__id__subtree={root2.id}"),
+            [d2.id, d3.id],
+        )
+
     def test_search_filtering_respect_owner(self):
         """
         GIVEN:
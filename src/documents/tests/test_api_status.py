@@ -84,6 +84,42 @@ class TestSystemStatus(APITestCase):
         response = self.client.get(self.ENDPOINT)
         self.assertEqual(response.data["install_type"], "kubernetes")
 
+    @mock.patch("documents.views.celery_app.connection_for_read")
+    def test_system_status_queue_depths(self, mock_connection):
+        """
+        GIVEN:
+            - Tasks waiting in the task queues
+        WHEN:
+            - The user requests the system status
+        THEN:
+            - The response contains the number of waiting tasks per queue
+        """
+        channel = mock_connection.return_value.__enter__.return_value.default_channel
+        channel.queue_declare.side_effect = lambda queue: mock.Mock(
+            message_count=len(queue),
+        )
+        self.client.force_login(self.user)
+        response = self.client.get(self.ENDPOINT)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["tasks"]["celery_queue_depths"],
+            {"interactive": 11, "mail": 4, "bulk": 4, "scheduled": 9},
+        )
+
+    def test_system_status_queue_depths_unavailable(self):
+        """
+        GIVEN:
+            - The broker is not reachable
+        WHEN:
+            - The user requests the system status
+        THEN:
+            - The queue depths are reported as unknown
+        """
+        self.client.force_login(self.user)
+        response = self.client.get(self.ENDPOINT)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data["tasks"]["celery_queue_depths"])
+
     @mock.patch("redis.Redis.execute_command")
     def test_system_status_redis_ping(self, mock_ping):
         """
@@ -1,10 +1,12 @@
 import shutil
+from datetime import timedelta
 from pathlib import Path
 from unittest import mock
 
 from django.contrib.auth.models import Group
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
 from guardian.shortcuts import assign_perm
 from guardian.shortcuts import get_groups_with_perms
 from guardian.shortcuts import get_users_with_perms
@@ -16,6 +18,8 @@ from documents.models import DocumentType
 from documents.models import StoragePath
 from documents.models import Tag
 from documents.tests.utils import DirectoriesMixin
+from documents.utils import compute_checksum
+from documents.utils import compute_quick_checksum
 
 
 class TestBulkEdit(DirectoriesMixin, TestCase):
@@ -186,9 +190,44 @@ class TestBulkEdit(DirectoriesMixin, TestCase):
         # TODO: doc3 should not be affected, but the query for that is rather complicated
         self.assertCountEqual(kwargs["document_ids"], [self.doc2.id, self.doc3.id])
 
+    def test_edits_bump_modified(self):
+        """
+        GIVEN:
+            - Documents last modified a day ago
+        WHEN:
+            - Fields, tags and permissions are edited in bulk
+        THEN:
+            - The edited documents are marked as modified, so the index
+              catch up picks them up
+            - The other documents keep their modification time
+        """
+        day_ago = timezone.now() - timedelta(days=1)
+        t3 = Tag.objects.create(name="t3")
+        edits = [
+            (bulk_edit.set_correspondent, (self.c2.id,)),
+            (bulk_edit.set_document_type, (self.dt2.id,)),
+            (bulk_edit.set_storage_path, (self.sp1.id,)),
+            (bulk_edit.add_tag, (t3.id,)),
+            (bulk_edit.remove_tag, (self.t1.id,)),
+            (bulk_edit.modify_tags, ([self.t1.id], [])),
+            (bulk_edit.set_permissions, ({}, self.owner, True)),
+        ]
+        for method, args in edits:
+            with self.subTest(method=method.__name__):
+                Document.objects.update(modified=day_ago)
+
+                method([self.doc2.id, self.doc4.id], *args)
+
+                self.assertCountEqual(
+                    Document.objects.filter(modified__gt=day_ago),
+                    [self.doc2, self.doc4],
+                )
+
     def test_delete(self):
         self.assertEqual(Document.objects.count(), 5)
-        bulk_edit.delete([self.doc1.id, self.doc2.id])
+        with mock.patch("documents.index.queue_index_update") as queue:
+            bulk_edit.delete([self.doc1.id, self.doc2.id])
+        queue.assert_called_once_with([self.doc1.id, self.doc2.id])
         self.assertEqual(Document.objects.count(), 3)
         self.assertCountEqual(
             [doc.id for doc in Document.objects.all()],
@@ -474,6 +513,7 @@ class TestPDFActions(DirectoriesMixin, TestCase):
             - Rotate action is called with 2 documents
         THEN:
             - Rotate action should be called twice
+            - The checksums and sizes are those of the rotated files
         """
         doc_ids = [self.doc1.id, self.doc2.id]
         result = bulk_edit.rotate(doc_ids, 90)
@@ -482,6 +522,14 @@ class TestPDFActions(DirectoriesMixin, TestCase):
         mock_chord.assert_called_once()
         self.assertEqual(result, "OK")
 
+        self.doc1.refresh_from_db()
+        self.assertEqual(self.doc1.checksum, compute_checksum(self.doc1.source_path))
+        self.assertEqual(
+            self.doc1.quick_checksum,
+            compute_quick_checksum(self.doc1.source_path),
+        )
+        self.assertEqual(self.doc1.original_size, self.doc1.source_path.stat().st_size)
+
     @mock.patch("documents.tasks.bulk_update_documents.si")
     @mock.patch("documents.tasks.update_document_archive_file.s")
     @mock.patch("pikepdf.Pdf.save")
@@ -0,0 +1,170 @@
+import csv
+import datetime
+from pathlib import Path
+
+import pytest
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from documents.columnar_export import DOCUMENT_COLUMNS
+from documents.columnar_export import iter_typed_chunks
+from documents.columnar_export import parquet_available
+from documents.columnar_export import typed_fields
+from documents.columnar_export import write_parquet
+from documents.columnar_export import write_typed_csv
+from documents.models import Correspondent
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+from documents.models import Document
+from documents.tests.utils import DirectoriesMixin
+
+
+class TestColumnarExport(DirectoriesMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.number = CustomField.objects.create(
+            name="Số văn bản",
+            data_type=CustomField.FieldDataType.INT,
+        )
+        self.issued = CustomField.objects.create(
+            name="Ngày phát hành",
+            data_type=CustomField.FieldDataType.DATE,
+        )
+        self.signed = CustomField.objects.create(
+            name="signed",
+            data_type=CustomField.FieldDataType.BOOL,
+        )
+        correspondent = Correspondent.objects.create(name="Bộ Tài chính")
+        self.doc1 = Document.objects.create(
+            title="first",
+            checksum="A",
+            mime_type="application/pdf",
+            correspondent=correspondent,
+            created=timezone.make_aware(datetime.datetime(2024, 3, 1)),
+            original_size=1024,
+        )
+        self.doc2 = Document.objects.create(
+            title="second",
+            checksum="B",
+            mime_type="application/pdf",
+            created=timezone.make_aware(datetime.datetime(2024, 3, 2)),
+        )
+        CustomFieldInstance.objects.create(
+            document=self.doc1,
+            field=self.number,
+            value_int=42,
+        )
+        CustomFieldInstance.objects.create(
+            document=self.doc1,
+            field=self.issued,
+            value_date=datetime.date(2024, 3, 15),
+        )
+        CustomFieldInstance.objects.create(
+            document=self.doc1,
+            field=self.signed,
+            value_bool=True,
+        )
+        # values read with OCR are stored as text
+        CustomFieldInstance.objects.create(
+            document=self.doc2,
+            field=self.number,
+            value_text="1.250",
+        )
+        CustomFieldInstance.objects.create(
+            document=self.doc2,
+            field=self.issued,
+            value_text="16/03/2024",
+        )
+
+    def test_typed_chunks(self):
+        """
+        GIVEN:
+            - Documents with custom fields of different types, stored in the
+              column of their type or as text
+        WHEN:
+            - The documents are read in chunks of one
+        THEN:
+            - Every field has a column with values of the field's type
+            - The field values are loaded with one query per chunk
+        """
+        documents = Document.objects.all()
+        fields = typed_fields(documents)
+        # the order of names depends on the collation of the database
+        self.assertCountEqual(
+            [name for _, name, _ in fields],
+            ["Ngày phát hành", "signed", "Số văn bản"],
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(iter_typed_chunks(documents, fields, chunk_size=1))
+
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(len(queries), 3)
+        columns = len(DOCUMENT_COLUMNS)
+        names = [name for _, name, _ in fields]
+        (first,), (second,) = chunks
+        self.assertEqual(first[:4], (self.doc1.id, "first", "Bộ Tài chính", None))
+        self.assertEqual(first[columns - 1], 1024)
+        self.assertEqual(
+            dict(zip(names, first[columns:])),
+            {
+                "Ngày phát hành": datetime.date(2024, 3, 15),
+                "signed": True,
+                "Số văn bản": 42,
+            },
+        )
+        self.assertEqual(
+            dict(zip(names, second[columns:])),
+            {
+                "Ngày phát hành": datetime.date(2024, 3, 16),
+                "signed": None,
+                "Số văn bản": 1250,
+            },
+        )
+
+    def test_typed_csv(self):
+        """
+        GIVEN:
+            - Documents with typed custom fields
+        WHEN:
+            - The documents are written to CSV
+        THEN:
+            - Dates are written in ISO 8601 and numbers without formatting
+        """
+        path = Path(self.dirs.scratch_dir) / "export.csv"
+
+        write_typed_csv(Document.objects.all(), path)
+
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]["title"], "first")
+        self.assertEqual(rows[0]["created"], "2024-03-01T00:00:00+00:00")
+        self.assertEqual(rows[0]["Ngày phát hành"], "2024-03-15")
+        self.assertEqual(rows[0]["signed"], "true")
+        self.assertEqual(rows[1]["Số văn bản"], "1250")
+        self.assertEqual(rows[1]["signed"], "")
+
+    @pytest.mark.skipif(not parquet_available(), reason="No pyarrow")
+    def test_parquet(self):
+        """
+        GIVEN:
+            - Documents with typed custom fields
+        WHEN:
+            - The documents are written to parquet
+        THEN:
+            - The columns of the fields have the types of the fields
+        """
+        import pyarrow.parquet as pq
+
+        path = Path(self.dirs.scratch_dir) / "export.parquet"
+
+        write_parquet(Document.objects.all(), path)
+
+        table = pq.read_table(path)
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(str(table.schema.field("Số văn bản").type), "int64")
+        self.assertEqual(str(table.schema.field("Ngày phát hành").type), "date32[day]")
+        self.assertEqual(table.column("Số văn bản").to_pylist(), [42, 1250])
@@ -23,8 +23,12 @@ from documents.consumer import ConsumerError
 from documents.consumer import ConsumerFilePhase
 from documents.models import Correspondent
 from documents.models import CustomField
+from documents.models import CustomFieldInstance
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import Dossier
+from documents.models import DossierFieldValue
+from documents.models import DossierForm
 from documents.models import FileInfo
 from documents.models import StoragePath
 from documents.models import Tag
@@ -33,6 +37,9 @@ from documents.parsers import ParseError
 from documents.tasks import sanity_check
 from documents.tests.utils import DirectoriesMixin
 from documents.tests.utils import FileSystemAssertsMixin
+from documents.utils import QUICK_CHECKSUM_SAMPLE_SIZE
+from documents.utils import compute_checksum
+from documents.utils import compute_quick_checksum
 
 
 class TestAttributes(TestCase):
@@ -759,6 +766,36 @@ class TestConsumer(DirectoriesMixin, FileSystemAssertsMixin, TestCase):
 
         self._assert_first_last_send_progress(last_status="FAILED")
 
+    @override_settings(FILENAME_FORMAT=None)
+    def test_checksum_after_pre_consume_script(self):
+        """
+        GIVEN:
+            - A pre-consume script which changes the working copy
+        WHEN:
+            - A file is consumed
+        THEN:
+            - The checksums of the document are those of the stored file
+        """
+        filename = self.get_test_file()
+        with tempfile.NamedTemporaryFile(mode="w", delete=False) as script:
+            script.write("#!/usr/bin/env bash\n")
+            script.write('echo "%%EOF" >> "$DOCUMENT_WORKING_PATH"\n')
+        self.addCleanup(os.unlink, script.name)
+        os.chmod(script.name, os.stat(script.name).st_mode | stat.S_IEXEC)
+
+        with override_settings(PRE_CONSUME_SCRIPT=script.name), mock.patch(
+            "documents.consumer.custom_get_parser_class_for_mime_type",
+            return_value=self.make_dummy_parser,
+        ):
+            document = self.consumer.try_consume_file(filename)
+
+        self.assertNotEqual(document.checksum, "42995833e01aea9b3edee44bbfdd7ce1")
+        self.assertEqual(document.checksum, compute_checksum(document.source_path))
+        self.assertEqual(
+            document.quick_checksum,
+            compute_quick_checksum(document.source_path),
+        )
+
     @override_settings(FILENAME_FORMAT="{title}")
     @mock.patch("documents.parsers.document_consumer_declaration.send")
     def test_similar_filenames(self, m):
@@ -805,6 +842,365 @@ class TestConsumer(DirectoriesMixin, FileSystemAssertsMixin, TestCase):
 
 
 @mock.patch("documents.consumer.magic.from_file", fake_magic_from_file)
+class TestConsumerProgress(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.consumer = Consumer()
+        self.consumer.filename = "sample.pdf"
+        self.consumer.channel_layer = mock.Mock()
+        self.consumer.channel_layer.group_send = mock.AsyncMock()
+
+    def _sent_progress(self):
+        return [
+            call.args[1]["data"]["current_progress"]
+            for call in self.consumer.channel_layer.group_send.call_args_list
+        ]
+
+    @override_settings(CONSUMER_PROGRESS_INTERVAL=60)
+    def test_progress_throttled(self):
+        """
+        GIVEN:
+            - Many plain progress updates within the minimum interval
+        WHEN:
+            - The updates are sent
+        THEN:
+            - Only the first plain update is published
+            - Updates with a message or a new status are always published
+        """
+        self.consumer._send_progress(0, 100, ConsumerFilePhase.STARTED)
+        for progress in range(20, 70):
+            self.consumer._send_progress(progress, 100, ConsumerFilePhase.WORKING)
+        self.consumer._send_progress(100, 100, ConsumerFilePhase.SUCCESS)
+
+        self.assertEqual(self._sent_progress(), [0, 100])
+
+    @override_settings(CONSUMER_PROGRESS_INTERVAL=0)
+    def test_progress_duplicates_dropped(self):
+        """
+        GIVEN:
+            - Plain progress updates repeating the same value
+        WHEN:
+            - The updates are sent
+        THEN:
+            - Each value is only published once
+        """
+        for progress in [20, 20, 21, 21, 21, 22]:
+            self.consumer._send_progress(progress, 100, ConsumerFilePhase.WORKING)
+
+        self.assertEqual(self._sent_progress(), [20, 21, 22])
+
+    def test_progress_owner_group(self):
+        """
+        GIVEN:
+            - Consumption with an owner override
+        WHEN:
+            - Progress is sent
+        THEN:
+            - The update is only published to the owner and superuser groups
+        """
+        self.consumer.override_owner_id = 4
+        self.consumer._send_progress(0, 100, ConsumerFilePhase.STARTED)
+
+        self.assertEqual(
+            [
+                call.args[0]
+                for call in self.consumer.channel_layer.group_send.call_args_list
+            ],
+            ["status_updates_4", "status_updates_superusers"],
+        )
+
+
+class TestConsumerDuplicateCheck(DirectoriesMixin, TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.consumer = Consumer()
+        self.consumer._send_progress = mock.Mock()
+        self.consumer.original_path = self.dirs.scratch_dir / "sample.pdf"
+        self.consumer.filename = "sample.pdf"
+        shutil.copy(
+            os.path.join(os.path.dirname(__file__), "samples", "simple.pdf"),
+            self.consumer.original_path,
+        )
+
+    def test_duplicate_prefilter_miss(self):
+        """
+        GIVEN:
+            - A document with the same size but a different fingerprint
+        WHEN:
+            - The duplicate check runs
+        THEN:
+            - The check passes without hashing the whole file
+        """
+        Document.objects.create(
+            checksum="A",
+            quick_checksum=f"{self.consumer.original_path.stat().st_size}:abc",
+        )
+
+        with mock.patch("documents.consumer.compute_checksum") as mocked_checksum:
+            self.consumer.pre_check_duplicate()
+            mocked_checksum.assert_not_called()
+
+        self.assertIsNone(self.consumer.checksum)
+
+    def test_duplicate_prefilter_hit(self):
+        """
+        GIVEN:
+            - A document with the same fingerprint but another checksum
+        WHEN:
+            - The duplicate check runs
+        THEN:
+            - The check passes
+            - The full checksum is kept for storing the document
+        """
+        Document.objects.create(
+            checksum="A",
+            quick_checksum=compute_quick_checksum(self.consumer.original_path),
+        )
+
+        self.consumer.pre_check_duplicate()
+
+        self.assertEqual(
+            self.consumer.checksum,
+            compute_checksum(self.consumer.original_path),
+        )
+
+    def test_duplicate_found(self):
+        """
+        GIVEN:
+            - A document with the same fingerprint and checksum
+        WHEN:
+            - The duplicate check runs
+        THEN:
+            - Consumption fails
+        """
+        Document.objects.create(
+            checksum=compute_checksum(self.consumer.original_path),
+            quick_checksum=compute_quick_checksum(self.consumer.original_path),
+        )
+
+        with self.assertRaisesMessage(ConsumerError, "It is a duplicate"):
+            self.consumer.pre_check_duplicate()
+
+    def test_duplicate_without_quick_checksum(self):
+        """
+        GIVEN:
+            - A document with the same checksum but no quick checksum, as for
+              encrypted documents
+        WHEN:
+            - The duplicate check runs
+        THEN:
+            - Consumption fails
+        """
+        Document.objects.create(
+            checksum=compute_checksum(self.consumer.original_path),
+            quick_checksum=None,
+            storage_type=Document.STORAGE_TYPE_GPG,
+        )
+
+        with self.assertRaisesMessage(ConsumerError, "It is a duplicate"):
+            self.consumer.pre_check_duplicate()
+
+    def test_duplicate_without_quick_checksum_size_prefilter(self):
+        """
+        GIVEN:
+            - Unencrypted documents without a quick checksum, one of them with
+              the same size and checksum
+        WHEN:
+            - The duplicate check runs
+        THEN:
+            - Only documents of the same size are compared
+        """
+        size = self.consumer.original_path.stat().st_size
+        Document.objects.create(checksum="A", original_size=size + 1)
+
+        with mock.patch("documents.consumer.compute_checksum") as mocked_checksum:
+            self.consumer.pre_check_duplicate()
+            mocked_checksum.assert_not_called()
+
+        Document.objects.create(
+            checksum=compute_checksum(self.consumer.original_path),
+            original_size=size,
+        )
+
+        with self.assertRaisesMessage(ConsumerError, "It is a duplicate"):
+            self.consumer.pre_check_duplicate()
+
+    def test_duplicate_without_quick_checksum_and_size(self):
+        """
+        GIVEN:
+            - Documents from before quick checksums and sizes were stored, one
+              with the same checksum as its original, one as its archive
+        WHEN:
+            - The duplicate check runs
+        THEN:
+            - Consumption fails
+        """
+        checksum = compute_checksum(self.consumer.original_path)
+        document = Document.objects.create(checksum=checksum)
+
+        with self.assertRaisesMessage(ConsumerError, "It is a duplicate"):
+            self.consumer.pre_check_duplicate()
+
+        Document.objects.filter(pk=document.pk).update(
+            checksum="A",
+            quick_checksum="1:abc",
+            original_size=1,
+            archive_checksum=checksum,
+        )
+
+        with self.assertRaisesMessage(ConsumerError, "It is a duplicate"):
+            self.consumer.pre_check_duplicate()
+
+    def test_quick_checksum_large_file(self):
+        """
+        GIVEN:
+            - Two large files only differing in the middle
+        WHEN:
+            - Their quick checksums are computed
+        THEN:
+            - The quick checksums are equal, the checksums are not
+        """
+        size = 3 * QUICK_CHECKSUM_SAMPLE_SIZE
+        file1 = self.dirs.scratch_dir / "file1"
+        file2 = self.dirs.scratch_dir / "file2"
+        file1.write_bytes(b"a" * size)
+        file2.write_bytes(
+            b"a" * QUICK_CHECKSUM_SAMPLE_SIZE
+            + b"b" * QUICK_CHECKSUM_SAMPLE_SIZE
+            + b"a" * QUICK_CHECKSUM_SAMPLE_SIZE,
+        )
+
+        self.assertEqual(compute_quick_checksum(file1), compute_quick_checksum(file2))
+        self.assertTrue(compute_quick_checksum(file1).startswith(f"{size}:"))
+        self.assertNotEqual(compute_checksum(file1), compute_checksum(file2))
+
+
+class TestConsumerFillCustomField(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.document_form = DossierForm.objects.create(
+            name="document form",
+            type="DOCUMENT",
+        )
+        self.dossier_form = DossierForm.objects.create(name="dossier form")
+        self.field_name = CustomField.objects.create(
+            name="name",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        self.field_owner = CustomField.objects.create(
+            name="owner",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+
+        self.root = Dossier.objects.create(
+            name="root",
+            type="DOSSIER",
+            dossier_form=self.dossier_form,
+        )
+        self.root.path = f"{self.root.id}"
+        self.root.save()
+        self.empty_root = Dossier.objects.create(
+            name="empty",
+            type="DOSSIER",
+            parent_dossier=self.root,
+            dossier_form=self.dossier_form,
+        )
+        self.empty_root.path = f"{self.root.path}/{self.empty_root.id}"
+        self.empty_root.save()
+        self.dossier = Dossier.objects.create(
+            name="dossier",
+            type="DOCUMENT",
+            parent_dossier=self.empty_root,
+            dossier_form=self.document_form,
+        )
+        self.dossier.path = f"{self.empty_root.path}/{self.dossier.id}"
+        self.dossier.save()
+        self.dossier_file = Dossier.objects.create(
+            name="file",
+            type="FILE",
+            parent_dossier=self.dossier,
+        )
+        self.dossier_file.path = f"{self.dossier.path}/{self.dossier_file.id}"
+        self.dossier_file.save()
+
+        form_field = CustomFieldInstance.objects.create(
+            field=self.field_name,
+            dossier_form=self.document_form,
+            match_value="ho_ten",
+        )
+        CustomFieldInstance.objects.create(
+            field=self.field_owner,
+            dossier_form=self.dossier_form,
+            reference=form_field,
+        )
+        self.dossier_field = CustomFieldInstance.objects.create(
+            field=self.field_name,
+            dossier=self.dossier,
+            value_text="",
+        )
+        self.root_field = CustomFieldInstance.objects.create(
+            field=self.field_owner,
+            dossier=self.root,
+            value_text="",
+        )
+
+        self.document = Document.objects.create(
+            title="doc",
+            checksum="A",
+            dossier=self.dossier,
+        )
+        self.consumer = Consumer()
+        self.consumer.override_dossier_id = self.dossier.id
+
+    def test_fill_custom_field(self):
+        """
+        GIVEN:
+            - A dossier tree with a document form and an ancestor form
+              referencing its field
+        WHEN:
+            - A document with OCR fields is consumed into the tree
+        THEN:
+            - The document and its dossier get the OCR value
+            - Ancestors referencing the field get the value as well
+            - Ancestors without the field get an empty instance
+            - The instances are written in bulk
+            - The effective values below the changed dossiers are refreshed
+        """
+        data_ocr_fields = (
+            [{"fields": [{"name": "ho_ten", "values": [{"value": "Nguyen Van A"}]}]}],
+            "",
+        )
+
+        # 5 queries filling the instances, 1 collecting the dossiers that
+        # depend on them, 4 refreshing the effective values
+        with self.assertNumQueries(10):
+            self.consumer.fill_custom_field(
+                self.document,
+                data_ocr_fields,
+                self.dossier_file,
+            )
+
+        document_field = CustomFieldInstance.objects.get(document=self.document)
+        self.assertEqual(document_field.field, self.field_name)
+        self.assertEqual(document_field.value_text, "Nguyen Van A")
+        self.assertEqual(document_field.dossier, self.dossier_file)
+        self.dossier_field.refresh_from_db()
+        self.assertEqual(self.dossier_field.value_text, "Nguyen Van A")
+        self.root_field.refresh_from_db()
+        self.assertEqual(self.root_field.value_text, "Nguyen Van A")
+        self.assertEqual(
+            CustomFieldInstance.objects.get(dossier=self.empty_root).value_text,
+            "",
+        )
+        self.assertEqual(
+            DossierFieldValue.objects.get(
+                dossier=self.dossier_file,
+                field=self.field_name,
+            ).value_text,
+            "Nguyen Van A",
+        )
+
+
 class TestConsumerCreatedDate(DirectoriesMixin, TestCase):
     def setUp(self):
         super().setUp()
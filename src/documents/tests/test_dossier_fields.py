@@ -0,0 +1,382 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from documents.dossier_fields import refresh_dossier_fields
+from documents.dossier_fields import refresh_instance_dossier_fields
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
+from documents.models import Dossier
+from documents.models import DossierFieldValue
+from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import create_node
+from documents.tree import move_subtree
+
+
+def effective_values(dossier):
+    return {
+        row.field_id: (row.value_text, row.inherited)
+        for row in DossierFieldValue.objects.filter(dossier=dossier)
+    }
+
+
+class TestDossierFields(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.name = CustomField.objects.create(
+            name="name",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        self.number = CustomField.objects.create(
+            name="number",
+            data_type=CustomField.FieldDataType.INT,
+        )
+        self.root = create_node(Dossier, "root", parent_field="parent_dossier")
+        self.child = create_node(
+            Dossier,
+            "child",
+            self.root,
+            parent_field="parent_dossier",
+        )
+        self.grandchild = create_node(
+            Dossier,
+            "grandchild",
+            self.child,
+            parent_field="parent_dossier",
+        )
+        self.other = create_node(Dossier, "other", parent_field="parent_dossier")
+
+    def test_inherited_values(self):
+        """
+        GIVEN:
+            - Nested dossiers with field values on the root and the child
+        WHEN:
+            - The values are changed
+        THEN:
+            - Every dossier stores its own values and inherits the others
+            - Values set further down override inherited ones
+        """
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.name,
+            value_text="root name",
+        )
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.number,
+            value_int=1,
+        )
+        instance = CustomFieldInstance.objects.create(
+            dossier=self.child,
+            field=self.number,
+            value_int=2,
+        )
+
+        self.assertEqual(
+            effective_values(self.root),
+            {self.name.id: ("root name", False), self.number.id: ("1", False)},
+        )
+        self.assertEqual(
+            effective_values(self.child),
+            {self.name.id: ("root name", True), self.number.id: ("2", False)},
+        )
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("root name", True), self.number.id: ("2", True)},
+        )
+        self.assertEqual(effective_values(self.other), {})
+
+        instance.delete()
+
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("root name", True), self.number.id: ("1", True)},
+        )
+
+    def test_referenced_values(self):
+        """
+        GIVEN:
+            - A dossier field without a value referencing a field of another
+              dossier
+        WHEN:
+            - The referenced value changes
+        THEN:
+            - The dossier and its descendants take the referenced value
+        """
+        source = CustomFieldInstance.objects.create(
+            dossier=self.other,
+            field=self.name,
+            value_text="first",
+        )
+        CustomFieldInstance.objects.create(
+            dossier=self.child,
+            field=self.name,
+            reference=source,
+        )
+
+        self.assertEqual(effective_values(self.child), {self.name.id: ("first", False)})
+
+        source.value_text = "second"
+        source.save()
+
+        self.assertEqual(
+            effective_values(self.child),
+            {self.name.id: ("second", False)},
+        )
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("second", True)},
+        )
+        self.assertEqual(
+            DossierFieldValue.objects.get(dossier=self.grandchild).source_id,
+            source.id,
+        )
+
+    def test_referenced_values_chain(self):
+        """
+        GIVEN:
+            - A dossier field referencing a field without a value, which
+              references a field of a third dossier
+        WHEN:
+            - The value at the end of the chain changes
+        THEN:
+            - Both referencing dossiers take the new value
+        """
+        source = CustomFieldInstance.objects.create(
+            dossier=self.other,
+            field=self.name,
+            value_text="first",
+        )
+        middle = CustomFieldInstance.objects.create(
+            dossier=self.child,
+            field=self.name,
+            reference=source,
+        )
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.name,
+            reference=middle,
+        )
+        self.assertEqual(
+            effective_values(self.root),
+            {self.name.id: ("first", False)},
+        )
+
+        source.value_text = "second"
+        source.save()
+
+        self.assertEqual(
+            effective_values(self.root),
+            {self.name.id: ("second", False)},
+        )
+        self.assertEqual(
+            effective_values(self.child),
+            {self.name.id: ("second", False)},
+        )
+
+    def test_deleted_referenced_value(self):
+        """
+        GIVEN:
+            - A dossier field without a value referencing a field of another
+              dossier
+        WHEN:
+            - The referenced field instance is deleted
+        THEN:
+            - The dossier and its descendants no longer have the value
+        """
+        source = CustomFieldInstance.objects.create(
+            dossier=self.other,
+            field=self.name,
+            value_text="first",
+        )
+        CustomFieldInstance.objects.create(
+            dossier=self.child,
+            field=self.name,
+            reference=source,
+        )
+        self.assertEqual(effective_values(self.child), {self.name.id: ("first", False)})
+
+        source.delete()
+
+        self.assertEqual(effective_values(self.child), {self.name.id: (None, False)})
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: (None, True)},
+        )
+        self.assertEqual(effective_values(self.other), {})
+
+    def test_moved_subtree(self):
+        """
+        GIVEN:
+            - A dossier inheriting a value from its parent
+        WHEN:
+            - The dossier is moved below another dossier
+        THEN:
+            - The moved subtree inherits the values of its new parent
+        """
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.name,
+            value_text="root",
+        )
+        CustomFieldInstance.objects.create(
+            dossier=self.other,
+            field=self.name,
+            value_text="other",
+        )
+
+        move_subtree(self.child, self.other)
+
+        self.assertEqual(effective_values(self.child), {self.name.id: ("other", True)})
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("other", True)},
+        )
+
+    def test_refresh_writes_changes_only(self):
+        """
+        GIVEN:
+            - Stored effective values that are up to date
+        WHEN:
+            - The values are refreshed again, after one was changed directly
+        THEN:
+            - Only the outdated value is written
+        """
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.name,
+            value_text="root",
+        )
+        self.assertEqual(refresh_dossier_fields(), 0)
+
+        DossierFieldValue.objects.filter(dossier=self.grandchild).update(
+            value_text="stale",
+        )
+
+        self.assertEqual(refresh_dossier_fields([self.child.path]), 1)
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("root", True)},
+        )
+
+
+    def test_refresh_after_bulk_update(self):
+        """
+        GIVEN:
+            - A dossier field and a field referencing it from another dossier
+        WHEN:
+            - The referenced value is changed with a bulk update, which sends
+              no signals
+        THEN:
+            - Refreshing by the changed instance updates both dossiers and
+              the descendants
+        """
+        source = CustomFieldInstance.objects.create(
+            dossier=self.other,
+            field=self.name,
+            value_text="first",
+        )
+        CustomFieldInstance.objects.create(
+            dossier=self.child,
+            field=self.name,
+            reference=source,
+        )
+
+        source.value_text = "second"
+        CustomFieldInstance.objects.bulk_update([source], ["value_text"])
+        self.assertEqual(effective_values(self.other), {self.name.id: ("first", False)})
+
+        refresh_instance_dossier_fields([source.pk])
+
+        self.assertEqual(effective_values(self.other), {self.name.id: ("second", False)})
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("second", True)},
+        )
+
+    def test_rebuild_command(self):
+        """
+        GIVEN:
+            - Stored effective values that were changed directly
+        WHEN:
+            - The dossier fields command is run
+        THEN:
+            - The values are recomputed
+        """
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.name,
+            value_text="root",
+        )
+        DossierFieldValue.objects.all().delete()
+
+        call_command("document_dossier_fields")
+
+        self.assertEqual(
+            effective_values(self.grandchild),
+            {self.name.id: ("root", True)},
+        )
+
+
+class TestApiDossierFields(DirectoriesMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_superuser(username="temp_admin")
+        self.client.force_authenticate(user=self.user)
+
+        self.field = CustomField.objects.create(
+            name="customer",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        self.root = create_node(Dossier, "root", parent_field="parent_dossier")
+        self.child = create_node(
+            Dossier,
+            "child",
+            self.root,
+            parent_field="parent_dossier",
+        )
+        self.other = create_node(Dossier, "other", parent_field="parent_dossier")
+        CustomFieldInstance.objects.create(
+            dossier=self.root,
+            field=self.field,
+            value_text="ACME Corp",
+        )
+
+    def test_effective_fields(self):
+        """
+        GIVEN:
+            - A dossier inheriting a field value from its parent
+        WHEN:
+            - The dossier is retrieved
+        THEN:
+            - The inherited value is listed with its field
+        """
+        response = self.client.get(f"/api/dossiers/{self.child.id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["effective_fields"],
+            [{"field": self.field.id, "value": "ACME Corp", "inherited": True}],
+        )
+
+    def test_filter_effective_field(self):
+        """
+        GIVEN:
+            - Dossiers with and without an effective field value
+        WHEN:
+            - Dossiers are filtered by the field value
+        THEN:
+            - Dossiers having or inheriting the value are returned
+        """
+        response = self.client.get(
+            "/api/dossiers/",
+            {"effective_field": f"{self.field.id}:acme"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(
+            [dossier["id"] for dossier in response.data["results"]],
+            [self.root.id, self.child.id],
+        )
@@ -1,9 +1,15 @@
+from datetime import timedelta
 from unittest import mock
 
 from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+from whoosh import query
 
 from documents import index
+from documents import tasks
 from documents.models import Document
+from documents.models import IndexQueueItem
 from documents.tests.utils import DirectoriesMixin
 
 
@@ -90,3 +96,274 @@ class TestAutoComplete(DirectoriesMixin, TestCase):
             _, kwargs = mocked_update_doc.call_args
 
             self.assertIsNone(kwargs["asn"])
+
+
+class TestIndexQueue(DirectoriesMixin, TestCase):
+    @override_settings(INDEX_QUEUE_SYNCHRONOUS=False)
+    def test_queue_coalesces_updates(self):
+        """
+        GIVEN:
+            - Several documents, some queued more than once
+        WHEN:
+            - The index queue is flushed
+        THEN:
+            - All documents are written with a single commit
+            - The queue is empty afterwards
+        """
+        doc1 = Document.objects.create(title="doc1", checksum="A", content="apple")
+        doc2 = Document.objects.create(title="doc2", checksum="B", content="banana")
+
+        index.queue_index_update([doc1.pk])
+        index.queue_index_update([doc1.pk, doc2.pk])
+        self.assertEqual(IndexQueueItem.objects.count(), 3)
+
+        with mock.patch(
+            "documents.index.AsyncWriter.commit",
+            autospec=True,
+        ) as mocked_commit:
+            mocked_commit.side_effect = lambda writer, **kwargs: writer.writer.commit(
+                **kwargs,
+            )
+            self.assertEqual(index.flush_index_queue(), 2)
+            mocked_commit.assert_called_once()
+
+        self.assertEqual(IndexQueueItem.objects.count(), 0)
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 2)
+
+    @override_settings(INDEX_QUEUE_SYNCHRONOUS=False)
+    def test_queue_batches(self):
+        """
+        GIVEN:
+            - More queued documents than fit in one batch
+        WHEN:
+            - The index queue is flushed
+        THEN:
+            - All documents are indexed
+        """
+        docs = [
+            Document.objects.create(title=f"doc{i}", checksum=str(i), content="test")
+            for i in range(5)
+        ]
+        index.queue_index_update([doc.pk for doc in docs])
+
+        self.assertEqual(index.flush_index_queue(batch_size=2), 5)
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 5)
+
+    @override_settings(INDEX_QUEUE_SYNCHRONOUS=False)
+    def test_queue_skips_failing_document(self):
+        """
+        GIVEN:
+            - Several queued documents, one of which cannot be indexed
+        WHEN:
+            - The index queue is flushed
+        THEN:
+            - The other documents are indexed
+            - The queue is empty afterwards
+        """
+        docs = [
+            Document.objects.create(title=f"doc{i}", checksum=str(i), content="test")
+            for i in range(3)
+        ]
+        index.queue_index_update([doc.pk for doc in docs])
+
+        update_document = index.update_document
+
+        def fail_for_second(writer, doc, viewer_ids=None):
+            if doc.pk == docs[1].pk:
+                raise ValueError("Cannot encode field value")
+            update_document(writer, doc, viewer_ids)
+
+        with mock.patch(
+            "documents.index.update_document",
+            side_effect=fail_for_second,
+        ):
+            self.assertEqual(index.flush_index_queue(), 2)
+
+        self.assertEqual(IndexQueueItem.objects.count(), 0)
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 2)
+            self.assertIsNone(searcher.document(id=docs[1].pk))
+
+    @override_settings(INDEX_QUEUE_SYNCHRONOUS=False)
+    def test_queue_removes_deleted_documents(self):
+        """
+        GIVEN:
+            - An indexed document which was deleted afterwards
+        WHEN:
+            - The document id is queued and the queue is flushed
+        THEN:
+            - The document is removed from the index
+        """
+        doc = Document.objects.create(title="doc1", checksum="A", content="test")
+        index.add_or_update_document(doc)
+        doc_id = doc.pk
+        doc.delete()
+
+        index.queue_index_update([doc_id])
+        index.flush_index_queue()
+
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 0)
+
+    @override_settings(INDEX_QUEUE_SYNCHRONOUS=False)
+    @mock.patch("documents.tasks.index_flush_queue.apply_async")
+    def test_queue_schedules_single_flush(self, mocked_apply_async):
+        """
+        GIVEN:
+            - Asynchronous index queue
+        WHEN:
+            - Documents are queued several times
+        THEN:
+            - Only one flush task is scheduled, after the transaction commits
+        """
+        doc = Document.objects.create(title="doc1", checksum="A", content="test")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            index.queue_index_update([doc.pk])
+            index.queue_index_update([doc.pk])
+            mocked_apply_async.assert_not_called()
+
+        mocked_apply_async.assert_called_once()
+
+    def test_queue_synchronous(self):
+        """
+        GIVEN:
+            - Synchronous index queue, as configured for tests
+        WHEN:
+            - A document is queued
+        THEN:
+            - The document is indexed right away
+        """
+        doc = Document.objects.create(title="doc1", checksum="A", content="test")
+
+        index.queue_index_update([doc.pk])
+
+        self.assertEqual(IndexQueueItem.objects.count(), 0)
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 1)
+
+
+class TestIndexCatchUp(DirectoriesMixin, TestCase):
+    def test_catch_up(self):
+        """
+        GIVEN:
+            - An index which was rebuilt a day after the documents changed
+            - A document changed since without updating the index
+            - An indexed document which no longer exists
+        WHEN:
+            - The index is caught up
+        THEN:
+            - Only the changed document is indexed again
+            - The document which no longer exists is removed
+            - Documents changed within the overlap are indexed again
+        """
+        doc1 = Document.objects.create(title="doc1", checksum="A", content="apple")
+        doc2 = Document.objects.create(title="doc2", checksum="B", content="banana")
+        Document.objects.update(modified=timezone.now() - timedelta(days=1))
+        tasks.index_reindex()
+        with index.open_index_writer() as writer:
+            writer.add_document(id=1000, title="gone")
+        Document.objects.filter(pk=doc2.pk).update(
+            content="cherry",
+            modified=timezone.now(),
+        )
+
+        with mock.patch(
+            "documents.index.update_document",
+            wraps=index.update_document,
+        ) as mocked_update:
+            self.assertEqual(index.catch_up_index(), (1, 1))
+            self.assertEqual(
+                [call.args[1] for call in mocked_update.call_args_list],
+                [doc2],
+            )
+
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(
+                {fields["id"] for fields in searcher.all_stored_fields()},
+                {doc1.pk, doc2.pk},
+            )
+            self.assertEqual(
+                len(searcher.search(query.Term("content", "cherry"))),
+                1,
+            )
+
+        # changes shortly before the last catch up are caught up again, in case
+        # they were committed after it
+        self.assertEqual(index.catch_up_index(), (1, 0))
+        with override_settings(INDEX_CATCHUP_OVERLAP=0):
+            self.assertEqual(index.catch_up_index(), (0, 0))
+
+    def test_catch_up_missing(self):
+        """
+        GIVEN:
+            - An index which was rebuilt after the documents changed
+            - An unchanged document missing from the index
+        WHEN:
+            - The index is caught up twice
+        THEN:
+            - The missing document is indexed the first time
+            - Nothing is left to index the second time
+        """
+        doc1 = Document.objects.create(title="doc1", checksum="A", content="apple")
+        doc2 = Document.objects.create(title="doc2", checksum="B", content="banana")
+        Document.objects.update(modified=timezone.now() - timedelta(days=1))
+        tasks.index_reindex()
+        with index.open_index_writer() as writer:
+            index.remove_document_by_id(writer, doc2.pk)
+
+        self.assertEqual(index.catch_up_index(), (1, 0))
+
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(
+                {fields["id"] for fields in searcher.all_stored_fields()},
+                {doc1.pk, doc2.pk},
+            )
+        self.assertEqual(index.catch_up_index(), (0, 0))
+
+    def test_catch_up_missing_and_stale(self):
+        """
+        GIVEN:
+            - An index missing an unchanged document and holding one which no
+              longer exists, so it has as many documents as the database
+        WHEN:
+            - The index is caught up
+        THEN:
+            - The missing document is indexed and the other one removed
+        """
+        doc1 = Document.objects.create(title="doc1", checksum="A", content="apple")
+        doc2 = Document.objects.create(title="doc2", checksum="B", content="banana")
+        Document.objects.update(modified=timezone.now() - timedelta(days=1))
+        tasks.index_reindex()
+        with index.open_index_writer() as writer:
+            index.remove_document_by_id(writer, doc2.pk)
+            writer.add_document(id=1000, title="gone")
+
+        self.assertEqual(index.catch_up_index(), (1, 1))
+
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(
+                {fields["id"] for fields in searcher.all_stored_fields()},
+                {doc1.pk, doc2.pk},
+            )
+
+    def test_catch_up_without_watermark(self):
+        """
+        GIVEN:
+            - An index without a watermark
+        WHEN:
+            - The index is caught up
+        THEN:
+            - All documents are indexed
+        """
+        Document.objects.create(title="doc1", checksum="A", content="apple")
+        Document.objects.create(title="doc2", checksum="B", content="banana")
+
+        self.assertIsNone(index.get_watermark())
+        self.assertEqual(index.catch_up_index(), (2, 0))
+
+        self.assertIsNotNone(index.get_watermark())
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 2)
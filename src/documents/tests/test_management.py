@@ -12,9 +12,11 @@ from django.test import override_settings
 
 from documents.file_handling import generate_filename
 from documents.models import Document
+from documents.models import Folder
 from documents.tasks import update_document_archive_file
 from documents.tests.utils import DirectoriesMixin
 from documents.tests.utils import FileSystemAssertsMixin
+from documents.utils import compute_quick_checksum
 
 sample_file = os.path.join(os.path.dirname(__file__), "samples", "simple.pdf")
 
@@ -205,6 +207,105 @@ class TestRenamer(DirectoriesMixin, FileSystemAssertsMixin, TestCase):
         self.assertIsFile(doc2.archive_path)
 
 
+class TestDocumentSizes(DirectoriesMixin, TestCase):
+    def test_document_sizes(self):
+        """
+        GIVEN:
+            - A document in a folder without stored file sizes
+        WHEN:
+            - The document_sizes command is run
+        THEN:
+            - The sizes of the original and archive are stored
+            - The folder total includes the original size
+        """
+        folder = Folder.objects.create(name="folder")
+        folder.path = f"{folder.pk}/"
+        folder.save()
+        doc = Document.objects.create(
+            title="test",
+            checksum="A",
+            mime_type="application/pdf",
+            filename="0000001.pdf",
+            archive_filename="0000001.pdf",
+            folder=folder,
+        )
+        shutil.copy(sample_file, doc.source_path)
+        Path(doc.archive_path).write_bytes(b"archive")
+
+        call_command("document_sizes", "--no-progress-bar")
+
+        doc.refresh_from_db()
+        folder.refresh_from_db()
+        self.assertEqual(doc.original_size, os.path.getsize(sample_file))
+        self.assertEqual(doc.archive_size, 7)
+        self.assertEqual(folder.subtree_size, doc.original_size)
+
+        Document.objects.filter(pk=doc.pk).update(archive_size=1)
+
+        call_command("document_sizes", "--no-progress-bar")
+        doc.refresh_from_db()
+        self.assertEqual(doc.archive_size, 1)
+
+        call_command("document_sizes", "--no-progress-bar", "--all")
+        doc.refresh_from_db()
+        self.assertEqual(doc.archive_size, 7)
+
+
+class TestDocumentQuickChecksums(DirectoriesMixin, TestCase):
+    def test_document_quick_checksums(self):
+        """
+        GIVEN:
+            - A document without stored quick checksums
+            - An encrypted document
+        WHEN:
+            - The document_quick_checksums command is run
+        THEN:
+            - The quick checksums of the original and archive are stored
+            - The encrypted document is skipped
+        """
+        doc = Document.objects.create(
+            title="test",
+            checksum="A",
+            mime_type="application/pdf",
+            filename="0000001.pdf",
+            archive_filename="0000001.pdf",
+        )
+        shutil.copy(sample_file, doc.source_path)
+        Path(doc.archive_path).write_bytes(b"archive")
+        encrypted = Document.objects.create(
+            title="encrypted",
+            checksum="B",
+            mime_type="application/pdf",
+            filename="0000002.pdf",
+            storage_type=Document.STORAGE_TYPE_GPG,
+        )
+        Path(encrypted.source_path).write_bytes(b"encrypted")
+
+        call_command("document_quick_checksums", "--no-progress-bar")
+
+        doc.refresh_from_db()
+        encrypted.refresh_from_db()
+        self.assertEqual(doc.quick_checksum, compute_quick_checksum(sample_file))
+        self.assertEqual(
+            doc.archive_quick_checksum,
+            compute_quick_checksum(doc.archive_path),
+        )
+        self.assertIsNone(encrypted.quick_checksum)
+
+        Document.objects.filter(pk=doc.pk).update(archive_quick_checksum="1:abc")
+
+        call_command("document_quick_checksums", "--no-progress-bar")
+        doc.refresh_from_db()
+        self.assertEqual(doc.archive_quick_checksum, "1:abc")
+
+        call_command("document_quick_checksums", "--no-progress-bar", "--all")
+        doc.refresh_from_db()
+        self.assertEqual(
+            doc.archive_quick_checksum,
+            compute_quick_checksum(doc.archive_path),
+        )
+
+
 class TestCreateClassifier(TestCase):
     @mock.patch(
         "documents.management.commands.document_create_classifier.train_classifier",
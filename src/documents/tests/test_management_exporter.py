@@ -12,6 +12,7 @@ from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import IntegrityError
 from django.test import TestCase
 from django.test import override_settings
@@ -21,6 +22,7 @@ from guardian.models import UserObjectPermission
 from guardian.shortcuts import assign_perm
 
 from documents.management.commands import document_exporter
+from documents.management.commands import document_importer
 from documents.models import Correspondent
 from documents.models import CustomField
 from documents.models import CustomFieldInstance
@@ -713,6 +715,131 @@ class TestExportImport(DirectoriesMixin, FileSystemAssertsMixin, TestCase):
             self.assertEqual(Document.objects.count(), 4)
             self.assertEqual(CustomFieldInstance.objects.count(), 1)
 
+    @mock.patch.object(document_exporter, "MANIFEST_CHUNK_SIZE", 1)
+    def test_export_in_chunks(self):
+        """
+        GIVEN:
+            - Request to export documents to directory
+        WHEN:
+            - The manifest is written in chunks of one record and files are
+              copied by two threads
+        THEN:
+            - Every record and file is exported once
+            - Notes and custom field instances are in the manifests of their
+              documents
+        """
+        shutil.rmtree(os.path.join(self.dirs.media_dir, "documents"))
+        shutil.copytree(
+            os.path.join(os.path.dirname(__file__), "samples", "documents"),
+            os.path.join(self.dirs.media_dir, "documents"),
+        )
+
+        call_command(
+            "document_exporter",
+            self.target,
+            "--threads",
+            "2",
+            "--no-progress-bar",
+        )
+
+        with open(os.path.join(self.target, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.assertCountEqual(
+            [e["pk"] for e in manifest if e["model"] == "documents.document"],
+            [self.d1.id, self.d2.id, self.d3.id, self.d4.id],
+        )
+        self.assertCountEqual(
+            [e["pk"] for e in manifest if e["model"] == "auth.user"],
+            [self.user.id, self.user2.id],
+        )
+        d1 = self._get_document_from_manifest(manifest, self.d1.id)
+        self.assertEqual(d1["fields"]["tags"], [self.t1.id])
+        self.assertIsFile(os.path.join(self.target, d1[EXPORTER_FILE_NAME]))
+        self.assertIsNotFile(os.path.join(self.target, "manifest.json.tmp"))
+
+        call_command(
+            "document_exporter",
+            self.target,
+            "--split-manifest",
+            "--threads",
+            "2",
+            "--no-progress-bar",
+        )
+
+        with open(
+            os.path.join(self.target, d1[EXPORTER_FILE_NAME] + "-manifest.json"),
+        ) as f:
+            document_manifest = json.load(f)
+        self.assertEqual(
+            [e["model"] for e in document_manifest],
+            ["documents.document", "documents.note", "documents.customfieldinstance"],
+        )
+
+    def test_export_invalid_threads(self):
+        """
+        GIVEN:
+            - Request to export documents to directory
+        WHEN:
+            - Less than one thread is requested
+        THEN:
+            - Error is raised
+        """
+        with self.assertRaises(CommandError):
+            call_command("document_exporter", self.target, "--threads", "0")
+
+    def test_import_in_batches(self):
+        """
+        GIVEN:
+            - An export of documents
+        WHEN:
+            - The export is imported in batches of one, hard linking files
+        THEN:
+            - The rows are inserted with their exported timestamps and relations
+            - The files are hard linked from the export
+            - New rows get primary keys after the imported ones
+        """
+        shutil.rmtree(os.path.join(self.dirs.media_dir, "documents"))
+        shutil.copytree(
+            os.path.join(os.path.dirname(__file__), "samples", "documents"),
+            os.path.join(self.dirs.media_dir, "documents"),
+        )
+        manifest = self._do_export()
+        d1 = self._get_document_from_manifest(manifest, self.d1.id)
+
+        with paperless_environment():
+            Document.objects.all().delete()
+            Tag.objects.all().delete()
+            Permission.objects.all().delete()
+            UserObjectPermission.objects.all().delete()
+            GroupObjectPermission.objects.all().delete()
+            shutil.copytree(self.target, self.dirs.scratch_dir / "export")
+
+            with mock.patch.object(document_importer, "IMPORT_BATCH_SIZE", 1):
+                call_command(
+                    "document_importer",
+                    "--no-progress-bar",
+                    "--link",
+                    "--threads",
+                    "2",
+                    self.dirs.scratch_dir / "export",
+                )
+
+            document = Document.objects.get(pk=self.d1.id)
+            self.assertEqual(
+                DjangoJSONEncoder().default(document.modified),
+                d1["fields"]["modified"],
+            )
+            self.assertEqual(list(document.tags.all()), [self.t1])
+            self.assertEqual(
+                os.stat(document.source_path).st_ino,
+                os.stat(self.dirs.scratch_dir / "export" / d1[EXPORTER_FILE_NAME]).st_ino,
+            )
+            self.assertEqual(
+                Document.objects.get(pk=self.d2.id).original_size,
+                os.path.getsize(Document.objects.get(pk=self.d2.id).source_path),
+            )
+            self.assertGreater(Tag.objects.create(name="new").pk, self.t1.pk)
+
     def test_folder_prefix(self):
         """
         GIVEN:
@@ -6,9 +6,15 @@ from pathlib import Path
 from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db import IntegrityError
+from django.db import transaction
 from django.test import TestCase
 
 from documents.management.commands.document_importer import Command
+from documents.management.commands.document_importer import sort_dependencies
+from documents.models import Correspondent
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
 from documents.models import Document
 from documents.settings import EXPORTER_ARCHIVE_NAME
 from documents.settings import EXPORTER_FILE_NAME
@@ -272,3 +278,48 @@ class TestCommandImport(DirectoriesMixin, FileSystemAssertsMixin, TestCase):
             "Found existing documents(s), this might indicate a non-empty installation",
             str(stdout.read()),
         )
+
+    def test_sort_dependencies(self):
+        """
+        GIVEN:
+            - Models which refer to each other
+        WHEN:
+            - The models are sorted in dependency order
+        THEN:
+            - Every model comes after the models it refers to
+        """
+        self.assertEqual(
+            sort_dependencies(
+                [CustomFieldInstance, Document, CustomField, Correspondent, User],
+            ),
+            [CustomField, User, Correspondent, Document, CustomFieldInstance],
+        )
+
+    def test_load_manifest_checks_many_to_many(self):
+        """
+        GIVEN:
+            - A manifest with a document tagged with a tag that doesn't exist
+        WHEN:
+            - The manifest is loaded
+        THEN:
+            - The broken relation is reported once all rows are in
+        """
+        cmd = Command()
+        cmd.manifest = [
+            {
+                "model": "documents.document",
+                "pk": 1,
+                "fields": {
+                    "title": "doc",
+                    "checksum": "abc",
+                    "mime_type": "application/pdf",
+                    "created": "2024-01-01T00:00:00Z",
+                    "modified": "2024-01-01T00:00:00Z",
+                    "added": "2024-01-01T00:00:00Z",
+                    "tags": [999],
+                },
+            },
+        ]
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            cmd._load_manifest()
@@ -0,0 +1,59 @@
+from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import TestMigrations
+
+
+class TestMigrateDossierFieldValues(DirectoriesMixin, TestMigrations):
+    migrate_from = "1112_tree_deleting"
+    migrate_to = "1113_dossier_field_values"
+
+    def setUpBeforeMigration(self, apps):
+        CustomField = apps.get_model("documents", "CustomField")
+        CustomFieldInstance = apps.get_model("documents", "CustomFieldInstance")
+        Dossier = apps.get_model("documents", "Dossier")
+
+        name = CustomField.objects.create(name="name", data_type="string")
+        number = CustomField.objects.create(name="number", data_type="integer")
+        root = Dossier.objects.create(name="root")
+        root.path = f"{root.id}/"
+        root.save()
+        child = Dossier.objects.create(name="child", parent_dossier=root)
+        child.path = f"{root.id}/{child.id}/"
+        child.save()
+        other = Dossier.objects.create(name="other")
+        other.path = f"{other.id}/"
+        other.save()
+
+        source = CustomFieldInstance.objects.create(
+            field=number,
+            dossier=other,
+            value_int=7,
+        )
+        CustomFieldInstance.objects.create(
+            field=name,
+            dossier=root,
+            value_text="root name",
+        )
+        CustomFieldInstance.objects.create(
+            field=number,
+            dossier=child,
+            reference=source,
+        )
+        self.name_id = name.id
+        self.number_id = number.id
+        self.root_id = root.id
+        self.child_id = child.id
+
+    def test_values_filled(self):
+        DossierFieldValue = self.apps.get_model("documents", "DossierFieldValue")
+
+        self.assertEqual(
+            {
+                row.field_id: (row.value_text, row.inherited)
+                for row in DossierFieldValue.objects.filter(dossier_id=self.child_id)
+            },
+            {self.name_id: ("root name", True), self.number_id: ("7", False)},
+        )
+        self.assertEqual(
+            DossierFieldValue.objects.filter(dossier_id=self.root_id).count(),
+            1,
+        )
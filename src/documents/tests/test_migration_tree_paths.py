@@ -0,0 +1,76 @@
+from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import TestMigrations
+
+
+class TestMigrateTreePaths(DirectoriesMixin, TestMigrations):
+    migrate_from = "1107_document_quick_checksum"
+    migrate_to = "1108_tree_path_index"
+
+    def setUpBeforeMigration(self, apps):
+        Folder = apps.get_model("documents", "Folder")
+        Dossier = apps.get_model("documents", "Dossier")
+
+        root = Folder.objects.create(name="root", path="")
+        root.path = str(root.id)
+        root.save()
+        child = Folder.objects.create(name="child", parent_folder=root)
+        child.path = f"{root.id}/{child.id}"
+        child.save()
+        self.root_id = root.id
+        self.child_id = child.id
+
+        dossier = Dossier.objects.create(name="dossier")
+        dossier.path = str(dossier.id)
+        dossier.save()
+        # stored with a wrong id by older versions of the consumer
+        dossier_file = Dossier.objects.create(
+            name="file",
+            type="FILE",
+            parent_dossier=dossier,
+            path=f"{dossier.id}/999",
+        )
+        self.dossier_id = dossier.id
+        self.dossier_file_id = dossier_file.id
+
+    def test_paths_migrated(self):
+        Folder = self.apps.get_model("documents", "Folder")
+        Dossier = self.apps.get_model("documents", "Dossier")
+
+        self.assertEqual(Folder.objects.get(id=self.root_id).path, f"{self.root_id}/")
+        self.assertEqual(
+            Folder.objects.get(id=self.child_id).path,
+            f"{self.root_id}/{self.child_id}/",
+        )
+        self.assertEqual(
+            Dossier.objects.get(id=self.dossier_file_id).path,
+            f"{self.dossier_id}/{self.dossier_file_id}/",
+        )
+
+
+class TestMigrateTreePathsBackwards(DirectoriesMixin, TestMigrations):
+    migrate_from = "1108_tree_path_index"
+    migrate_to = "1107_document_quick_checksum"
+
+    def setUpBeforeMigration(self, apps):
+        Warehouse = apps.get_model("documents", "Warehouse")
+
+        warehouse = Warehouse.objects.create(name="warehouse")
+        warehouse.path = f"{warehouse.id}/"
+        warehouse.save()
+        shelf = Warehouse.objects.create(
+            name="shelf",
+            type="Shelf",
+            parent_warehouse=warehouse,
+        )
+        shelf.path = f"{warehouse.id}/{shelf.id}/"
+        shelf.save()
+        self.warehouse_id = warehouse.id
+        self.shelf_id = shelf.id
+
+    def test_paths_reverted(self):
+        Warehouse = self.apps.get_model("documents", "Warehouse")
+
+        self.assertEqual(
+            Warehouse.objects.get(id=self.shelf_id).path,
+            f"{self.warehouse_id}/{self.shelf_id}",
+        )
@@ -1,20 +1,37 @@
 import os
+from pathlib import Path
 from unittest import mock
 
 from django.conf import settings
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from guardian.shortcuts import assign_perm
+from whoosh import query
 
+from documents import index
 from documents import tasks
 from documents.models import Correspondent
+from documents.models import CustomField
+from documents.models import CustomFieldInstance
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import Dossier
+from documents.models import Folder
+from documents.models import Note
 from documents.models import Tag
+from documents.models import Warehouse
 from documents.sanity_checker import SanityCheckFailedException
 from documents.sanity_checker import SanityCheckMessages
 from documents.tests.test_classifier import dummy_preprocess
 from documents.tests.utils import DirectoriesMixin
+from documents.tests.utils import DummyProgressManager
 from documents.tests.utils import FileSystemAssertsMixin
+from documents.tests.utils import create_node
+from documents.tree import mark_deleting
 
 
 class TestIndexReindex(DirectoriesMixin, TestCase):
@@ -30,6 +47,88 @@ class TestIndexReindex(DirectoriesMixin, TestCase):
 
         tasks.index_reindex()
 
+    def create_documents(self, start, count, user, group):
+        for i in range(start, start + count):
+            doc = Document.objects.create(
+                title=f"document {i}",
+                content=f"content {i}",
+                checksum=f"{i}",
+            )
+            doc.tags.add(self.tag)
+            Note.objects.create(document=doc, note=f"note {i}", user=user)
+            CustomFieldInstance.objects.create(
+                document=doc,
+                field=self.field,
+                value_text=f"value {i}",
+            )
+            assign_perm("view_document", user, doc)
+            assign_perm("view_document", group, doc)
+
+    def test_index_reindex_prefetched(self):
+        """
+        GIVEN:
+            - Documents with tags, notes, custom fields and viewers
+        WHEN:
+            - A few or many more documents are reindexed
+        THEN:
+            - The number of queries stays the same
+            - The documents are indexed with their relations and viewers
+        """
+        self.tag = Tag.objects.create(name="tag")
+        self.field = CustomField.objects.create(
+            name="field",
+            data_type=CustomField.FieldDataType.STRING,
+        )
+        user = User.objects.create(username="viewer")
+        group_user = User.objects.create(username="group viewer")
+        group = Group.objects.create(name="group")
+        group_user.groups.add(group)
+
+        self.create_documents(0, 1, user, group)
+        with CaptureQueriesContext(connection) as few:
+            tasks.index_reindex()
+        self.create_documents(1, 5, user, group)
+        with CaptureQueriesContext(connection) as many:
+            tasks.index_reindex()
+
+        self.assertEqual(len(many), len(few))
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 6)
+            results = searcher.search(
+                query.And(
+                    [
+                        query.Term("tag", "tag"),
+                        query.Term("notes", "note"),
+                        query.Term("custom_fields", "value"),
+                        query.Term("viewer_id", str(user.id)),
+                        query.Term("viewer_id", str(group_user.id)),
+                    ],
+                ),
+            )
+            self.assertEqual(len(results), 6)
+
+    def test_index_reindex_processes(self):
+        """
+        GIVEN:
+            - Documents
+        WHEN:
+            - The documents are reindexed by several processes
+        THEN:
+            - All documents are indexed into a single segment
+        """
+        for i in range(5):
+            Document.objects.create(
+                title=f"document {i}",
+                content=f"content {i}",
+                checksum=f"{i}",
+            )
+
+        tasks.index_reindex(processes=2)
+
+        ix = index.open_index()
+        self.assertEqual(ix.doc_count(), 5)
+        self.assertEqual(len(ix._segments()), 1)
+
     def test_index_optimize(self):
         Document.objects.create(
             title="test",
@@ -150,3 +249,150 @@ class TestBulkUpdate(DirectoriesMixin, TestCase):
         )
 
         tasks.bulk_update_documents([doc1.pk])
+
+        with index.open_index_searcher() as searcher:
+            self.assertEqual(searcher.doc_count(), 1)
+
+
+@mock.patch("documents.tasks.ProgressManager", mock.MagicMock())
+class TestDeleteSubtree(DirectoriesMixin, FileSystemAssertsMixin, TestCase):
+    def create_document(self, checksum, directory="nested", **kwargs):
+        doc = Document.objects.create(
+            title=checksum,
+            checksum=checksum,
+            mime_type="application/pdf",
+            filename=f"{directory}/{checksum}.pdf",
+            **kwargs,
+        )
+        Path(doc.source_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(doc.source_path).touch()
+        return doc
+
+    def test_delete_folder_subtree(self):
+        """
+        GIVEN:
+            - A folder tree with documents and a folder outside of it
+        WHEN:
+            - The subtree is deleted in batches
+        THEN:
+            - The documents, their files and the folders are deleted
+            - Every batch is queued for removal from the index
+            - Empty directories are pruned
+        """
+        root = create_node(Folder, "root")
+        child = create_node(Folder, "child", root)
+        other = create_node(Folder, "other")
+        doc1 = self.create_document("A", folder=root)
+        doc2 = self.create_document("B", folder=child)
+        doc3 = self.create_document("C", "kept", folder=other)
+
+        with mock.patch("documents.tasks.index.queue_index_update") as queue:
+            result = tasks.delete_subtree("folder", [root.pk], batch_size=1)
+
+        self.assertEqual(
+            queue.call_args_list,
+            [mock.call([doc1.pk]), mock.call([doc2.pk])],
+        )
+        self.assertIn("2 documents", result)
+        self.assertCountEqual(Folder.objects.all(), [other])
+        self.assertCountEqual(Document.objects.all(), [doc3])
+        self.assertIsNotFile(doc1.source_path)
+        self.assertIsNotFile(doc2.source_path)
+        self.assertIsFile(doc3.source_path)
+        self.assertIsNotDir(os.path.join(settings.ORIGINALS_DIR, "nested"))
+
+    def test_delete_subtree_aggregates(self):
+        """
+        GIVEN:
+            - A folder tree below another folder, with documents that are in
+              a warehouse as well
+        WHEN:
+            - The subtree is deleted
+        THEN:
+            - The aggregates are not updated per document
+            - The totals of the remaining folder and warehouse are correct
+        """
+        top = create_node(Folder, "top")
+        root = create_node(Folder, "root", top)
+        child = create_node(Folder, "child", root)
+        warehouse = create_node(Warehouse, "warehouse", parent_field="parent_warehouse")
+        self.create_document("A", folder=root, warehouse=warehouse, original_size=10)
+        self.create_document("B", folder=child, warehouse=warehouse, original_size=5)
+        self.create_document("C", "kept", folder=top, original_size=1)
+
+        with mock.patch(
+            "documents.tree.remove_document_aggregates",
+        ) as remove_document_aggregates:
+            tasks.delete_subtree("folder", [root.pk, child.pk])
+            remove_document_aggregates.assert_not_called()
+
+        top.refresh_from_db()
+        warehouse.refresh_from_db()
+        self.assertEqual(
+            (top.subtree_document_count, top.subtree_size, top.child_count),
+            (1, 1, 0),
+        )
+        self.assertEqual(
+            (warehouse.subtree_document_count, warehouse.subtree_size),
+            (0, 0),
+        )
+
+    def test_delete_subtree_failed(self):
+        """
+        GIVEN:
+            - A folder tree marked as being deleted
+        WHEN:
+            - Deleting the subtree fails
+        THEN:
+            - The folders are no longer marked as being deleted
+            - The failure is reported to the user who requested the deletion
+        """
+        root = create_node(Folder, "root")
+        child = create_node(Folder, "child", root)
+        self.create_document("A", folder=child)
+        mark_deleting(Folder, [root.pk])
+        managers = []
+
+        def progress_manager(*args):
+            managers.append(DummyProgressManager(*args))
+            return managers[-1]
+
+        with mock.patch(
+            "documents.tasks.index.queue_index_update",
+            side_effect=OSError("index locked"),
+        ), mock.patch("documents.tasks.ProgressManager", progress_manager):
+            with self.assertRaises(OSError):
+                tasks.delete_subtree("folder", [root.pk], owner_id=42)
+
+        self.assertFalse(Folder.objects.filter(deleting=True).exists())
+        payloads = managers[0].payloads
+        self.assertEqual(payloads[-1]["data"]["status"], "FAILED")
+        self.assertTrue(
+            all(payload["data"]["owner_id"] == 42 for payload in payloads),
+        )
+        self.assertCountEqual(Folder.objects.all(), [root, child])
+
+    def test_delete_dossier_subtree(self):
+        """
+        GIVEN:
+            - A dossier with a document that has a file node in a folder
+        WHEN:
+            - The dossier is deleted
+        THEN:
+            - The file node of the document is deleted as well
+        """
+        folder = create_node(Folder, "folder")
+        file = create_node(Folder, "file", folder, type=Folder.FILE)
+        dossier = create_node(Dossier, "dossier", parent_field="parent_dossier")
+        self.create_document("A", folder=file, dossier=dossier)
+
+        tasks.delete_subtree("dossier", [dossier.pk])
+
+        self.assertEqual(Document.objects.count(), 0)
+        self.assertFalse(Dossier.objects.exists())
+        self.assertCountEqual(Folder.objects.all(), [folder])
+        folder.refresh_from_db()
+        self.assertEqual(
+            (folder.subtree_document_count, folder.child_count),
+            (0, 0),
+        )
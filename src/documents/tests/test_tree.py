@@ -0,0 +1,490 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from documents import bulk_edit
+from documents.caching import invalidate_breadcrumb_cache
+from documents.caching import set_breadcrumb_cache
+from documents.models import Document
+from documents.models import Dossier
+from documents.models import Folder
+from documents.models import Warehouse
+from documents.tests.utils import create_node
+from documents.tree import TreeMoveError
+from documents.tree import build_path
+from documents.tree import get_breadcrumbs
+from documents.tree import is_in_subtree
+from documents.tree import move_subtree
+from documents.tree import path_ids
+from documents.tree import rebuild_aggregates
+from documents.tree import subtree
+from documents.tree import subtree_filter
+
+
+class TestMoveSubtree(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.root1 = create_node(Folder, "root1")
+        self.root2 = create_node(Folder, "root2")
+        self.child = create_node(Folder, "child", self.root1)
+        self.grandchild = create_node(Folder, "grandchild", self.child)
+        self.file = create_node(Folder, "file", self.grandchild, type=Folder.FILE)
+
+    def assertPaths(self, *nodes):
+        for node in nodes:
+            node.refresh_from_db()
+            self.assertEqual(node.path, build_path(node, node.parent_folder))
+
+    def test_move_subtree(self):
+        """
+        GIVEN:
+            - A folder with nested children
+        WHEN:
+            - The folder is moved below another root folder
+        THEN:
+            - The paths of all descendants are rewritten in a single update
+        """
+        with self.assertNumQueries(7):
+            moved = move_subtree(self.child, self.root2)
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(self.child.parent_folder, self.root2)
+        self.assertEqual(
+            self.child.path,
+            f"{self.root2.pk}/{self.child.pk}/",
+        )
+        self.assertPaths(self.child, self.grandchild, self.file)
+        self.file.refresh_from_db()
+        self.assertEqual(
+            self.file.path,
+            f"{self.root2.pk}/{self.child.pk}/{self.grandchild.pk}/{self.file.pk}/",
+        )
+        self.root1.refresh_from_db()
+        self.assertEqual(self.root1.path, f"{self.root1.pk}/")
+
+    def test_move_subtree_to_root(self):
+        """
+        GIVEN:
+            - A nested folder
+        WHEN:
+            - The folder is moved to the top level
+        THEN:
+            - The folder and its descendants get root based paths
+        """
+        move_subtree(self.grandchild, None)
+
+        self.grandchild.refresh_from_db()
+        self.assertIsNone(self.grandchild.parent_folder)
+        self.assertEqual(self.grandchild.path, f"{self.grandchild.pk}/")
+        self.assertPaths(self.file)
+
+    def test_move_subtree_cycle(self):
+        """
+        GIVEN:
+            - A folder with nested children
+        WHEN:
+            - The folder is moved into itself or one of its descendants
+        THEN:
+            - The move is rejected and no path is changed
+        """
+        for target in [self.child, self.grandchild, self.file]:
+            with self.assertRaises(TreeMoveError):
+                move_subtree(self.child, target)
+
+        self.assertPaths(self.child, self.grandchild, self.file)
+        self.child.refresh_from_db()
+        self.assertEqual(self.child.parent_folder, self.root1)
+
+    def test_is_in_subtree_prefix(self):
+        """
+        GIVEN:
+            - Folders whose paths share a textual prefix
+        WHEN:
+            - Checking subtree membership
+        THEN:
+            - Only real descendants are part of the subtree
+        """
+        a = Folder(pk=1, path="1/")
+        b = Folder(pk=12, path="12/")
+        c = Folder(pk=13, path="1/13/")
+
+        self.assertFalse(is_in_subtree(b, a))
+        self.assertTrue(is_in_subtree(c, a))
+        self.assertTrue(is_in_subtree(a, a))
+        self.assertFalse(is_in_subtree(a, c))
+
+    def test_move_subtree_other_trees(self):
+        """
+        GIVEN:
+            - Warehouse and dossier trees
+        WHEN:
+            - Subtrees are moved
+        THEN:
+            - All levels below the moved node get new paths
+        """
+        w1 = create_node(Warehouse, "w1", parent_field="parent_warehouse")
+        w2 = create_node(Warehouse, "w2", parent_field="parent_warehouse")
+        shelf = create_node(
+            Warehouse,
+            "shelf",
+            w1,
+            "parent_warehouse",
+            type=Warehouse.SHELF,
+        )
+        box = create_node(
+            Warehouse,
+            "box",
+            shelf,
+            "parent_warehouse",
+            type=Warehouse.BOXCASE,
+        )
+
+        move_subtree(shelf, w2)
+
+        box.refresh_from_db()
+        self.assertEqual(box.path, f"{w2.pk}/{shelf.pk}/{box.pk}/")
+
+        d1 = create_node(Dossier, "d1", parent_field="parent_dossier")
+        d2 = create_node(Dossier, "d2", d1, "parent_dossier")
+        d3 = create_node(Dossier, "d3", d2, "parent_dossier")
+
+        move_subtree(d2, None)
+
+        d3.refresh_from_db()
+        self.assertEqual(d3.path, f"{d2.pk}/{d3.pk}/")
+
+        with self.assertRaises(TreeMoveError):
+            move_subtree(d2, w1)
+
+
+class TestSubtree(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.root = create_node(Folder, "root")
+        self.child = create_node(Folder, "child", self.root)
+        self.grandchild = create_node(Folder, "grandchild", self.child)
+        self.other = create_node(Folder, "other")
+
+    def test_subtree(self):
+        """
+        GIVEN:
+            - Two folder trees
+        WHEN:
+            - The subtree of a folder is requested
+        THEN:
+            - The folder and all of its descendants are returned
+        """
+        self.assertCountEqual(
+            subtree(Folder, self.root),
+            [self.root, self.child, self.grandchild],
+        )
+        self.assertCountEqual(
+            subtree(Folder.objects.all(), self.child, include_roots=False),
+            [self.grandchild],
+        )
+        self.assertCountEqual(
+            subtree(Folder, [self.child, self.other]),
+            [self.child, self.grandchild, self.other],
+        )
+        self.assertCountEqual(
+            subtree(Folder, self.grandchild.path),
+            [self.grandchild],
+        )
+        self.assertEqual(subtree(Folder, []).count(), 0)
+
+    def test_subtree_sibling_prefix(self):
+        """
+        GIVEN:
+            - Root folders whose ids share a textual prefix
+        WHEN:
+            - The subtree of the folder with the shorter id is requested
+        THEN:
+            - The other folder is not part of it
+        """
+        node = Folder.objects.create(name="prefix")
+        sibling = Folder.objects.create(id=int(f"{node.pk}0"), name="sibling")
+        for folder in [node, sibling]:
+            folder.path = build_path(folder, None)
+            folder.save()
+
+        self.assertCountEqual(subtree(Folder, node), [node])
+
+    def test_subtree_filter(self):
+        """
+        GIVEN:
+            - Documents in two folder trees
+        WHEN:
+            - Documents are filtered by the subtree of a root folder
+        THEN:
+            - The filter joins to the folders on the path prefix
+            - Descendant ids are not loaded
+        """
+        doc = Document.objects.create(
+            title="doc",
+            checksum="A",
+            mime_type="application/pdf",
+            folder=self.grandchild,
+        )
+        Document.objects.create(
+            title="other",
+            checksum="B",
+            mime_type="application/pdf",
+            folder=self.other,
+        )
+
+        with self.assertNumQueries(1):
+            in_subtree = subtree_filter("folder", Folder, [self.root.pk])
+        query = Document.objects.filter(in_subtree)
+        self.assertIn("LIKE", str(query.query))
+        self.assertCountEqual(query, [doc])
+
+        self.assertIsNone(subtree_filter("folder", Folder, [9999]))
+
+    def test_path_ids(self):
+        """
+        GIVEN:
+            - Materialized paths
+        WHEN:
+            - The ids of the path are requested
+        THEN:
+            - The ids from the root down to the node are returned
+        """
+        self.assertEqual(
+            path_ids(self.grandchild.path),
+            [self.root.pk, self.child.pk, self.grandchild.pk],
+        )
+        self.assertEqual(path_ids(None), [])
+
+
+class TestTreeAggregates(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.root = create_node(Folder, "root")
+        self.child = create_node(Folder, "child", self.root)
+        self.other = create_node(Folder, "other")
+
+    def create_document(self, folder, size, **kwargs):
+        return Document.objects.create(
+            title="doc",
+            checksum=f"{folder.pk}-{Document.objects.count()}",
+            mime_type="application/pdf",
+            folder=folder,
+            original_size=size,
+            **kwargs,
+        )
+
+    def assertAggregates(self, node, documents, size, children):
+        node.refresh_from_db()
+        self.assertEqual(
+            (node.subtree_document_count, node.subtree_size, node.child_count),
+            (documents, size, children),
+        )
+
+    def test_document_added_moved_deleted(self):
+        """
+        GIVEN:
+            - A folder tree
+        WHEN:
+            - Documents are added, moved between folders and deleted
+        THEN:
+            - The totals of all ancestors follow
+        """
+        doc = self.create_document(self.child, 100)
+        self.create_document(self.root, 20)
+
+        self.assertAggregates(self.root, 2, 120, 1)
+        self.assertAggregates(self.child, 1, 100, 0)
+
+        doc.folder = self.other
+        doc.save()
+
+        self.assertAggregates(self.root, 1, 20, 1)
+        self.assertAggregates(self.child, 0, 0, 0)
+        self.assertAggregates(self.other, 1, 100, 0)
+
+        doc.title = "renamed"
+        with mock.patch("documents.tree.get_saved_document_state") as state:
+            doc.save(update_fields=["title"])
+            state.assert_not_called()
+
+        doc.delete()
+
+        self.assertAggregates(self.other, 0, 0, 0)
+        self.assertAggregates(self.root, 1, 20, 1)
+
+    def test_nodes_moved_and_deleted(self):
+        """
+        GIVEN:
+            - A folder tree with documents
+        WHEN:
+            - A subtree is moved and then deleted
+        THEN:
+            - The totals and child counts of the old and new ancestors follow
+        """
+        grandchild = create_node(Folder, "grandchild", self.child)
+        self.create_document(grandchild, 50)
+        self.assertAggregates(self.root, 1, 50, 1)
+        self.assertAggregates(self.child, 1, 50, 1)
+
+        move_subtree(self.child, self.other)
+
+        self.assertAggregates(self.root, 0, 0, 0)
+        self.assertAggregates(self.other, 1, 50, 1)
+
+        Folder.objects.get(pk=self.child.pk).delete()
+
+        self.assertAggregates(self.other, 0, 0, 0)
+
+    def test_bulk_edit_set_folder(self):
+        """
+        GIVEN:
+            - Documents in different folders
+        WHEN:
+            - The documents are moved to a folder with bulk edit
+        THEN:
+            - The totals of the old and new folders follow
+        """
+        doc1 = self.create_document(self.child, 10)
+        doc2 = self.create_document(self.other, 5)
+
+        with mock.patch("documents.bulk_edit.bulk_update_documents.delay"):
+            bulk_edit.set_folder([doc1.pk, doc2.pk], self.root.pk)
+
+        self.assertAggregates(self.root, 2, 15, 1)
+        self.assertAggregates(self.child, 0, 0, 0)
+        self.assertAggregates(self.other, 0, 0, 0)
+
+    def test_rebuild_aggregates(self):
+        """
+        GIVEN:
+            - Folders whose totals drifted
+        WHEN:
+            - The aggregates are rebuilt
+        THEN:
+            - The totals are recomputed and only drifted folders are changed
+        """
+        self.create_document(self.child, 10)
+        Folder.objects.filter(pk=self.root.pk).update(
+            subtree_document_count=7,
+            child_count=0,
+        )
+
+        self.assertEqual(rebuild_aggregates(Folder), 1)
+        self.assertAggregates(self.root, 1, 10, 1)
+        self.assertAggregates(self.child, 1, 10, 0)
+
+        Folder.objects.filter(pk=self.child.pk).update(subtree_size=0)
+        call_command("document_tree_aggregates")
+        self.assertAggregates(self.child, 1, 10, 0)
+
+
+class TestBreadcrumbs(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.root = create_node(Folder, "root")
+        self.child = create_node(Folder, "child", self.root)
+        self.grandchild = create_node(Folder, "grandchild", self.child)
+        self.other = create_node(Folder, "other")
+
+    def names(self, node):
+        return [crumb["name"] for crumb in get_breadcrumbs(Folder, node.pk)]
+
+    def test_breadcrumbs_cached(self):
+        """
+        GIVEN:
+            - A nested folder
+        WHEN:
+            - Its breadcrumbs are requested twice
+        THEN:
+            - The ids and names from the root are returned
+            - The second request does not query the database
+        """
+        self.assertEqual(
+            get_breadcrumbs(Folder, self.grandchild.pk),
+            [
+                {"id": self.root.pk, "name": "root"},
+                {"id": self.child.pk, "name": "child"},
+                {"id": self.grandchild.pk, "name": "grandchild"},
+            ],
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.names(self.grandchild),
+                ["root", "child", "grandchild"],
+            )
+        self.assertIsNone(get_breadcrumbs(Folder, 9999))
+
+    def test_breadcrumbs_invalidated(self):
+        """
+        GIVEN:
+            - Cached breadcrumbs of a nested folder
+        WHEN:
+            - An ancestor is renamed, moved or deleted
+        THEN:
+            - The breadcrumbs follow
+        """
+        self.assertEqual(self.names(self.grandchild), ["root", "child", "grandchild"])
+
+        self.child.name = "renamed"
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.child.save()
+        # cleared only once the rename is committed
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.names(self.grandchild),
+                ["root", "child", "grandchild"],
+            )
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            self.names(self.grandchild),
+            ["root", "renamed", "grandchild"],
+        )
+
+        self.child.save()
+        with self.assertNumQueries(0):
+            self.names(self.grandchild)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move_subtree(self.child, self.other)
+        self.assertEqual(
+            self.names(self.grandchild),
+            ["other", "renamed", "grandchild"],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        self.assertIsNone(get_breadcrumbs(Folder, self.grandchild.pk))
+
+    def test_breadcrumbs_invalidated_while_loading(self):
+        """
+        GIVEN:
+            - Breadcrumbs of a nested folder which are not cached
+        WHEN:
+            - An ancestor is renamed and committed after the breadcrumbs were
+              loaded, but before they are cached
+        THEN:
+            - The stale breadcrumbs are not served afterwards
+        """
+
+        def rename_then_set(*args, **kwargs):
+            Folder.objects.filter(pk=self.child.pk).update(name="renamed")
+            invalidate_breadcrumb_cache("folder")
+            set_breadcrumb_cache(*args, **kwargs)
+
+        with mock.patch(
+            "documents.tree.set_breadcrumb_cache",
+            side_effect=rename_then_set,
+        ):
+            self.assertEqual(
+                self.names(self.grandchild),
+                ["root", "child", "grandchild"],
+            )
+
+        self.assertEqual(
+            self.names(self.grandchild),
+            ["root", "renamed", "grandchild"],
+        )
@@ -25,6 +25,7 @@ from documents.data_models import ConsumableDocument
 from documents.data_models import DocumentMetadataOverrides
 from documents.parsers import ParseError
 from documents.plugins.helpers import ProgressStatusOptions
+from documents.tree import build_path
 
 
 def setup_directories():
@@ -60,6 +61,8 @@ def setup_directories():
         STATIC_ROOT=dirs.static_dir,
         MODEL_FILE=dirs.data_dir / "classification_model.pickle",
         MEDIA_LOCK=dirs.media_dir / "media.lock",
+        INDEX_QUEUE_LOCK=dirs.data_dir / "index_queue.lock",
+        INDEX_QUEUE_SYNCHRONOUS=True,
     )
     dirs.settings_override.enable()
 
@@ -147,6 +150,13 @@ def util_call_with_backoff(
     return succeeded, result
 
 
+def create_node(model, name, parent=None, parent_field="parent_folder", **kwargs):
+    node = model.objects.create(name=name, **{parent_field: parent}, **kwargs)
+    node.path = build_path(node, parent)
+    node.save()
+    return node
+
+
 class DirectoriesMixin:
     """
     Creates and overrides settings for all folders and paths, then ensures
@@ -275,6 +285,40 @@ class DocumentConsumeDelayMixin:
         return (input_doc, overrides)
 
 
+class ExportJobMixin:
+    """
+    Runs export jobs as soon as they are queued, with a dummy progress
+    manager, and provides downloading their artifacts
+    """
+
+    def setUp(self) -> None:
+        from documents import tasks
+
+        self.export_job_patcher = mock.patch(
+            "documents.views.run_export_job.apply_async",
+            side_effect=lambda args, **kwargs: tasks.run_export_job(*args),
+        )
+        self.export_job_mock = self.export_job_patcher.start()
+        self.progress_patcher = mock.patch(
+            "documents.tasks.ProgressManager",
+            DummyProgressManager,
+        )
+        self.progress_patcher.start()
+        super().setUp()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.progress_patcher.stop()
+        self.export_job_patcher.stop()
+
+    def download_export(self, response):
+        """
+        Downloads the artifact of the export job created by response
+        """
+        self.assertEqual(response.status_code, 202)
+        return self.client.get(f"/api/export_jobs/{response.data['id']}/download/")
+
+
 class TestMigrations(TransactionTestCase):
     @property
     def app(self):
@@ -0,0 +1,718 @@
+import logging
+from collections import Counter
+from collections import defaultdict
+from collections.abc import Iterable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import reduce
+from operator import or_
+from typing import Optional
+from typing import Union
+
+from django.db import models
+from django.db import transaction
+from django.db.models import CharField
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Func
+from django.db.models import IntegerField
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import QuerySet
+from django.db.models import Subquery
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Concat
+from django.db.models.functions import Greatest
+from django.db.models.functions import Substr
+
+from documents.caching import get_breadcrumb_cache
+from documents.caching import get_tree_version
+from documents.caching import invalidate_breadcrumb_cache
+from documents.caching import set_breadcrumb_cache
+from documents.models import Document
+from documents.models import Dossier
+from documents.models import Folder
+from documents.models import Warehouse
+
+logger = logging.getLogger("paperless.tree")
+
+PATH_SEPARATOR = "/"
+
+PARENT_FIELDS = {
+    Folder: "parent_folder",
+    Dossier: "parent_dossier",
+    Warehouse: "parent_warehouse",
+}
+
+# the field linking a document to a node of each tree
+DOCUMENT_FIELDS = {
+    Folder: "folder",
+    Dossier: "dossier",
+    Warehouse: "warehouse",
+}
+
+TREE_MODELS = {model._meta.model_name: model for model in PARENT_FIELDS}
+
+AGGREGATE_FIELDS = ["subtree_document_count", "subtree_size", "child_count"]
+
+# document fields that change the aggregates when saved
+DOCUMENT_TREE_FIELDS = {
+    *DOCUMENT_FIELDS.values(),
+    *[f"{field}_id" for field in DOCUMENT_FIELDS.values()],
+    "original_size",
+}
+
+
+class TreeMoveError(ValueError):
+    pass
+
+
+def get_parent_field(model: type[models.Model]) -> str:
+    return PARENT_FIELDS[model]
+
+
+def build_path(node: models.Model, parent: Optional[models.Model]) -> str:
+    """
+    Returns the materialized path of node when placed below parent.
+
+    Paths are the ids from the root down to node, each one terminated by the
+    separator ("1/12/"), so the path of a node is a prefix of exactly the
+    paths in its subtree.
+    """
+    prefix = parent.path if parent is not None else ""
+    return f"{prefix}{node.pk}{PATH_SEPARATOR}"
+
+
+def path_ids(path: Optional[str]) -> list[int]:
+    """
+    Returns the ids from the root down to the node of a materialized path
+    """
+    if not path:
+        return []
+    return [int(part) for part in path.split(PATH_SEPARATOR) if part]
+
+
+def is_in_subtree(node: models.Model, root: models.Model) -> bool:
+    """
+    Returns True if node is root itself or one of its descendants
+    """
+    if node.pk == root.pk:
+        return True
+    if not node.path or not root.path:
+        return False
+    return node.path.startswith(root.path)
+
+
+Roots = Union[models.Model, str, Iterable[Union[models.Model, str]]]
+
+
+def subtree(
+    queryset: Union[QuerySet, type[models.Model]],
+    roots: Roots,
+    include_roots: bool = True,
+) -> QuerySet:
+    """
+    Filters queryset down to the subtrees below roots, which may be nodes,
+    materialized paths or an iterable of those.
+
+    Every subtree is a prefix match on the indexed path column, which the
+    database can answer with an index range scan.
+    """
+    if isinstance(queryset, type):
+        queryset = queryset.objects.all()
+    if isinstance(roots, (models.Model, str)):
+        roots = [roots]
+
+    paths = set()
+    for root in roots:
+        path = root if isinstance(root, str) else root.path
+        if path:
+            paths.add(path)
+
+    if not paths:
+        return queryset.none()
+
+    queryset = queryset.filter(_paths_q("path", paths))
+    if not include_roots:
+        queryset = queryset.exclude(path__in=paths)
+    return queryset
+
+
+def _paths_q(field_name: str, paths: Iterable[str]) -> Q:
+    return reduce(
+        or_,
+        (Q(**{f"{field_name}__startswith": path}) for path in sorted(paths)),
+    )
+
+
+def subtree_filter(
+    field_name: str,
+    model: type[models.Model],
+    root_ids: Iterable[int],
+) -> Optional[Q]:
+    """
+    Returns a filter matching rows whose field_name points into the subtrees
+    below the nodes with root_ids, or None if none of them exist.
+
+    Only the paths of the roots are loaded. The filter itself is a join to
+    the tree table with a prefix match on its indexed path column, so the
+    ids of the descendants never leave the database.
+    """
+    paths = {
+        path
+        for path in model.objects.filter(pk__in=root_ids).values_list(
+            "path",
+            flat=True,
+        )
+        if path
+    }
+    if not paths:
+        return None
+    return _paths_q(f"{field_name}__path", paths)
+
+
+def annotate_subtree_document_count(
+    queryset: QuerySet,
+    documents: Optional[QuerySet] = None,
+    name: str = "document_count",
+) -> QuerySet:
+    """
+    Annotates every node of queryset with the number of documents in its
+    subtree, optionally restricted to the given documents.
+
+    The count is a correlated subquery joining documents to their node on the
+    path prefix. The prefix is not a constant, so it can't use the path index,
+    only use it where every node must be counted, such as to order by the
+    count. Prefer the stored subtree_document_count, or
+    subtree_document_counts for a page of nodes.
+    """
+    field = DOCUMENT_FIELDS[queryset.model]
+    in_subtree = Document.objects.filter(
+        **{f"{field}__path__startswith": OuterRef("path")},
+    )
+    if documents is not None:
+        in_subtree = in_subtree.filter(id__in=documents.values("id"))
+    count = (
+        in_subtree.order_by()
+        .annotate(count=Func(F("id"), function="COUNT"))
+        .values("count")
+    )
+    return queryset.annotate(
+        **{
+            name: Coalesce(
+                Subquery(count, output_field=IntegerField()),
+                Value(0),
+            ),
+        },
+    )
+
+
+def subtree_document_totals(
+    nodes: Iterable[models.Model],
+    documents: Optional[QuerySet] = None,
+) -> dict[int, tuple[int, int]]:
+    """
+    Returns the number and total original size of the documents in the
+    subtree of each of the nodes, optionally restricted to the given
+    documents, by the id of the node.
+
+    The documents below all nodes are grouped by their node in a single
+    query, using the path index, and added up to the nodes in Python.
+    """
+    nodes = list(nodes)
+    totals = {node.pk: [0, 0] for node in nodes}
+    paths = {node.path for node in nodes if node.path}
+    if paths:
+        field = DOCUMENT_FIELDS[type(nodes[0])]
+        in_subtrees = Document.objects.filter(_paths_q(f"{field}__path", paths))
+        if documents is not None:
+            in_subtrees = in_subtrees.filter(id__in=documents.values("id"))
+        groups = (
+            in_subtrees.order_by()
+            .values(f"{field}__path")
+            .annotate(count=Count("id"), size=Sum("original_size"))
+            .values_list(f"{field}__path", "count", "size")
+        )
+        for path, count, size in groups:
+            for ancestor_id in path_ids(path):
+                if ancestor_id in totals:
+                    totals[ancestor_id][0] += count
+                    totals[ancestor_id][1] += size or 0
+    return {pk: (count, size) for pk, (count, size) in totals.items()}
+
+
+def subtree_document_counts(
+    nodes: Iterable[models.Model],
+    documents: Optional[QuerySet] = None,
+) -> dict[int, int]:
+    """
+    Returns the number of documents in the subtree of each of the nodes,
+    optionally restricted to the given documents, by the id of the node
+    """
+    totals = subtree_document_totals(nodes, documents)
+    return {pk: count for pk, (count, _) in totals.items()}
+
+
+def get_breadcrumbs(
+    model: type[models.Model],
+    node_id: int,
+) -> Optional[list[dict]]:
+    """
+    Returns the ids and names from the root down to the node, or None if
+    the node does not exist. The chains are cached per node and dropped
+    whenever nodes of the tree are moved, renamed or deleted.
+    """
+    model_name = model._meta.model_name
+    breadcrumbs = get_breadcrumb_cache(model_name, node_id)
+    if breadcrumbs is not None:
+        return breadcrumbs
+
+    tree_version = get_tree_version(model_name)
+    path = model.objects.filter(pk=node_id).values_list("path", flat=True).first()
+    if path is None and not model.objects.filter(pk=node_id).exists():
+        return None
+    ids = path_ids(path) or [node_id]
+    names = dict(model.objects.filter(pk__in=ids).values_list("pk", "name"))
+    breadcrumbs = [{"id": pk, "name": names[pk]} for pk in ids if pk in names]
+
+    set_breadcrumb_cache(model_name, node_id, tree_version, breadcrumbs)
+    return breadcrumbs
+
+
+def mark_deleting(model: type[models.Model], node_ids: Iterable[int]) -> list[int]:
+    """
+    Flags the nodes with node_ids and their subtrees as being deleted, so
+    they disappear from the API before delete_subtree removes them. Returns
+    the ids of the roots that were not already being deleted.
+    """
+    roots = list(model.objects.filter(pk__in=node_ids, deleting=False))
+    subtree(model, roots).update(deleting=True)
+    return [root.pk for root in roots]
+
+
+def unmark_deleting(model: type[models.Model], node_ids: Iterable[int]) -> None:
+    """
+    Clears the deleting flag of the nodes with node_ids and their subtrees,
+    for deletions that failed
+    """
+    subtree(model, model.objects.filter(pk__in=node_ids)).update(deleting=False)
+
+
+def check_move(node: models.Model, new_parent: Optional[models.Model]) -> None:
+    """
+    Raises TreeMoveError if node cannot be moved below new_parent
+    """
+    if new_parent is None:
+        return
+    if type(new_parent) is not type(node):
+        raise TreeMoveError(
+            f"Cannot move a {node._meta.verbose_name} "
+            f"below a {new_parent._meta.verbose_name}.",
+        )
+    if is_in_subtree(new_parent, node):
+        raise TreeMoveError(
+            f"Cannot move a {node._meta.verbose_name} into itself "
+            f"or one of its children.",
+        )
+
+
+def move_subtree(node: models.Model, new_parent: Optional[models.Model]) -> int:
+    """
+    Moves node and all of its descendants below new_parent.
+
+    The paths of the whole subtree are rewritten with a single prefix
+    replacing UPDATE instead of walking the tree, so no signals are sent
+    for the moved nodes. Returns the number of descendants that were moved
+    along with node.
+    """
+    model = type(node)
+    parent_field = get_parent_field(model)
+
+    check_move(node, new_parent)
+
+    with transaction.atomic():
+        # lock both rows so concurrent moves cannot create a cycle
+        locked = model.objects.select_for_update().filter(
+            pk__in=[node.pk] + ([new_parent.pk] if new_parent else []),
+        )
+        current = {obj.pk: obj for obj in locked}
+        node_current = current[node.pk]
+        parent_current = current[new_parent.pk] if new_parent else None
+
+        # paths may have changed since node and new_parent were loaded
+        check_move(node_current, parent_current)
+
+        old_path = node_current.path or build_path(node_current, None)
+        new_path = build_path(node_current, parent_current)
+
+        model.objects.filter(pk=node.pk).update(
+            **{parent_field: parent_current, "path": new_path},
+        )
+
+        moved = 0
+        if old_path != new_path:
+            moved = subtree(model, old_path).update(
+                path=Concat(
+                    Value(new_path),
+                    Substr("path", len(old_path) + 1),
+                    output_field=CharField(),
+                ),
+            )
+            _move_subtree_aggregates(model, node_current, old_path, new_path)
+
+    setattr(node, parent_field, parent_current)
+    node.path = new_path
+
+    if old_path != new_path:
+        transaction.on_commit(
+            lambda: invalidate_breadcrumb_cache(model._meta.model_name),
+        )
+        if model is Dossier:
+            from documents.dossier_fields import refresh_dossier_fields
+
+            refresh_dossier_fields([new_path])
+        transaction.on_commit(lambda: _queue_subtree_index_update(model, new_path))
+
+    logger.debug(
+        f"Moved {node._meta.verbose_name} {node.pk} from {old_path} to "
+        f"{new_path} with {moved} descendants",
+    )
+
+    return moved
+
+
+def _queue_subtree_index_update(model, path: str) -> None:
+    """
+    Queues the documents below path for indexing, since the ancestors they
+    are indexed with changed
+    """
+    from documents import index
+
+    document_ids = list(
+        Document.objects.filter(
+            _paths_q(f"{DOCUMENT_FIELDS[model]}__path", [path]),
+        ).values_list("pk", flat=True),
+    )
+    if document_ids:
+        index.queue_index_update(document_ids)
+
+
+def _move_subtree_aggregates(model, node, old_path: str, new_path: str) -> None:
+    old_ancestors = path_ids(old_path)[:-1]
+    new_ancestors = path_ids(new_path)[:-1]
+
+    # ancestors shared by both positions keep their totals
+    removed = set(old_ancestors) - set(new_ancestors)
+    added = set(new_ancestors) - set(old_ancestors)
+    update_aggregates(
+        model,
+        removed,
+        documents=-node.subtree_document_count,
+        size=-node.subtree_size,
+    )
+    update_aggregates(
+        model,
+        added,
+        documents=node.subtree_document_count,
+        size=node.subtree_size,
+    )
+
+    if old_ancestors:
+        update_aggregates(model, [old_ancestors[-1]], children=-1)
+    if new_ancestors:
+        update_aggregates(model, [new_ancestors[-1]], children=1)
+
+
+# set while documents or nodes are deleted in bulk, whose aggregates are
+# updated once for the whole batch instead of by the signal handlers
+_aggregates_suspended: ContextVar[bool] = ContextVar(
+    "aggregates_suspended",
+    default=False,
+)
+
+
+@contextmanager
+def suspended_aggregates():
+    """
+    Keeps the signal handlers from updating aggregates inside the block. The
+    caller is responsible for updating them for everything changed in it.
+    """
+    token = _aggregates_suspended.set(True)
+    try:
+        yield
+    finally:
+        _aggregates_suspended.reset(token)
+
+
+def aggregates_suspended() -> bool:
+    return _aggregates_suspended.get()
+
+
+def update_aggregates(
+    model: type[models.Model],
+    node_ids: Iterable[int],
+    documents: int = 0,
+    size: int = 0,
+    children: int = 0,
+) -> None:
+    """
+    Adds the given deltas to the aggregates of the nodes with node_ids.
+    Totals never drop below zero; drift is repaired by rebuild_aggregates.
+    """
+    node_ids = [node_id for node_id in node_ids if node_id is not None]
+    deltas = {
+        "subtree_document_count": documents,
+        "subtree_size": size,
+        "child_count": children,
+    }
+    updates = {
+        field: Greatest(F(field) + delta, Value(0))
+        for field, delta in deltas.items()
+        if delta
+    }
+    if node_ids and updates:
+        model.objects.filter(pk__in=node_ids).update(**updates)
+
+
+def get_ancestor_ids(model: type[models.Model], node_id: Optional[int]) -> list[int]:
+    """
+    Returns the ids from the root down to and including the node
+    """
+    if node_id is None:
+        return []
+    path = model.objects.filter(pk=node_id).values_list("path", flat=True).first()
+    return path_ids(path) or [node_id]
+
+
+def get_document_size(document: Document) -> int:
+    return document.original_size or 0
+
+
+def get_document_nodes(document: Document) -> dict[type[models.Model], Optional[int]]:
+    return {
+        model: getattr(document, f"{field}_id")
+        for model, field in DOCUMENT_FIELDS.items()
+    }
+
+
+def get_saved_document_state(document_id: int) -> Optional[dict]:
+    """
+    Returns the tree nodes and size of a document as currently stored
+    """
+    values = (
+        Document.objects.values(
+            "original_size",
+            *[f"{field}_id" for field in DOCUMENT_FIELDS.values()],
+        )
+        .filter(pk=document_id)
+        .first()
+    )
+    if values is None:
+        return None
+    return {
+        "size": values["original_size"] or 0,
+        "nodes": {
+            model: values[f"{field}_id"] for model, field in DOCUMENT_FIELDS.items()
+        },
+    }
+
+
+def update_document_aggregates(document: Document, old_state: Optional[dict]) -> None:
+    """
+    Moves the contribution of document from the nodes and size recorded in
+    old_state, None for a new document, to its current nodes and size
+    """
+    old_nodes = old_state["nodes"] if old_state else {}
+    old_size = old_state["size"] if old_state else 0
+    new_size = get_document_size(document)
+
+    for model, new_id in get_document_nodes(document).items():
+        old_id = old_nodes.get(model)
+        if old_id == new_id and old_size == new_size:
+            continue
+        old_ancestors = set(get_ancestor_ids(model, old_id))
+        new_ancestors = (
+            old_ancestors if old_id == new_id else set(get_ancestor_ids(model, new_id))
+        )
+        update_aggregates(
+            model,
+            old_ancestors - new_ancestors,
+            documents=-1,
+            size=-old_size,
+        )
+        update_aggregates(
+            model,
+            new_ancestors - old_ancestors,
+            documents=1,
+            size=new_size,
+        )
+        update_aggregates(
+            model,
+            old_ancestors & new_ancestors,
+            size=new_size - old_size,
+        )
+
+
+def remove_document_aggregates(document: Document) -> None:
+    size = get_document_size(document)
+    for model, node_id in get_document_nodes(document).items():
+        update_aggregates(
+            model,
+            get_ancestor_ids(model, node_id),
+            documents=-1,
+            size=-size,
+        )
+
+
+def reassign_document_aggregates(
+    model: type[models.Model],
+    documents: QuerySet,
+    node: Optional[models.Model],
+) -> None:
+    """
+    Moves the contribution of documents to node in the tree of model. Used
+    before the documents are reassigned with a queryset update, which sends
+    no signals.
+    """
+    field = DOCUMENT_FIELDS[model]
+    new_ancestors = set(get_ancestor_ids(model, node.pk if node else None))
+    groups = documents.values(f"{field}_id").annotate(
+        count=Count("id"),
+        size=Sum("original_size"),
+    )
+    for group in groups:
+        old_ancestors = set(get_ancestor_ids(model, group[f"{field}_id"]))
+        size = group["size"] or 0
+        update_aggregates(
+            model,
+            old_ancestors - new_ancestors,
+            documents=-group["count"],
+            size=-size,
+        )
+        update_aggregates(
+            model,
+            new_ancestors - old_ancestors,
+            documents=group["count"],
+            size=size,
+        )
+
+
+def remove_documents_aggregates(
+    model: type[models.Model],
+    documents: QuerySet,
+    skip_ids: Iterable[int] = (),
+) -> None:
+    """
+    Removes the contribution of documents from the aggregates of the tree of
+    model, with one update per distinct change instead of one per document
+    and ancestor. Nodes with skip_ids are left alone, as they are deleted
+    along with the documents. Used before the documents are deleted with the
+    aggregates suspended.
+    """
+    field = DOCUMENT_FIELDS[model]
+    skip_ids = set(skip_ids)
+    totals = defaultdict(lambda: [0, 0])
+    groups = (
+        documents.filter(**{f"{field}__isnull": False})
+        .order_by()
+        .values(f"{field}_id", f"{field}__path")
+        .annotate(count=Count("id"), size=Sum("original_size"))
+    )
+    for group in groups:
+        node_id = group[f"{field}_id"]
+        for ancestor in path_ids(group[f"{field}__path"]) or [node_id]:
+            if ancestor not in skip_ids:
+                totals[ancestor][0] += group["count"]
+                totals[ancestor][1] += group["size"] or 0
+
+    deltas = defaultdict(list)
+    for node_id, (count, size) in totals.items():
+        deltas[(count, size)].append(node_id)
+    for (count, size), node_ids in deltas.items():
+        update_aggregates(model, node_ids, documents=-count, size=-size)
+
+
+def remove_leaf_aggregates(model: type[models.Model], node_ids: Iterable[int]) -> None:
+    """
+    Removes deleted nodes without children, whose documents were already
+    removed from the aggregates, from the child counts of their parents
+    """
+    parent_field = get_parent_field(model)
+    parents = Counter(
+        model.objects.filter(pk__in=node_ids).values_list(
+            f"{parent_field}_id",
+            flat=True,
+        ),
+    )
+    deltas = defaultdict(list)
+    for parent_id, count in parents.items():
+        deltas[count].append(parent_id)
+    for count, parent_ids in deltas.items():
+        update_aggregates(model, parent_ids, children=-count)
+
+
+def remove_node_aggregates(node: models.Model) -> None:
+    """
+    Removes a deleted node from the aggregates of its ancestors. Only the
+    topmost node of a deleted subtree is removed, its descendants are
+    already part of its totals.
+    """
+    model = type(node)
+    parent_id = getattr(node, f"{get_parent_field(model)}_id")
+    if parent_id is None or not model.objects.filter(pk=parent_id).exists():
+        return
+    ancestors = path_ids(node.path)[:-1] or [parent_id]
+    update_aggregates(
+        model,
+        ancestors,
+        documents=-node.subtree_document_count,
+        size=-node.subtree_size,
+    )
+    update_aggregates(model, [parent_id], children=-1)
+
+
+def rebuild_aggregates(model: type[models.Model]) -> int:
+    """
+    Recomputes the aggregates of all nodes of model from scratch and returns
+    the number of nodes that were corrected
+    """
+    field = DOCUMENT_FIELDS[model]
+    parent_field = get_parent_field(model)
+
+    paths = {}
+    totals = defaultdict(lambda: [0, 0, 0])
+    for node_id, path, parent_id in model.objects.values_list(
+        "pk",
+        "path",
+        f"{parent_field}_id",
+    ).iterator():
+        paths[node_id] = path
+        if parent_id is not None:
+            totals[parent_id][2] += 1
+
+    groups = (
+        Document.objects.filter(**{f"{field}__isnull": False})
+        .values(f"{field}_id")
+        .annotate(count=Count("id"), size=Sum("original_size"))
+    )
+    for group in groups:
+        node_id = group[f"{field}_id"]
+        for ancestor in path_ids(paths.get(node_id)) or [node_id]:
+            if ancestor in paths:
+                totals[ancestor][0] += group["count"]
+                totals[ancestor][1] += group["size"] or 0
+
+    changed = []
+    for node in model.objects.only("pk", *AGGREGATE_FIELDS).iterator():
+        values = totals.get(node.pk, [0, 0, 0])
+        current = [getattr(node, name) for name in AGGREGATE_FIELDS]
+        if current != values:
+            for name, value in zip(AGGREGATE_FIELDS, values):
+                setattr(node, name, value)
+            changed.append(node)
+
+    model.objects.bulk_update(changed, AGGREGATE_FIELDS, batch_size=1000)
+
+    return len(changed)
@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import os
 import shutil
 from os import utime
 from pathlib import Path
@@ -49,6 +51,40 @@ def copy_file_with_basic_stats(
     copy_basic_file_stats(source, dest)
 
 
+# How much of the start and of the end of a file goes into its quick checksum
+QUICK_CHECKSUM_SAMPLE_SIZE = 4 * 1024 * 1024
+
+
+def compute_checksum(path: Union[Path, str], chunk_size: int = 1024 * 1024) -> str:
+    """
+    Calculates the MD5 of a file, reading it in chunks instead of loading it
+    into memory at once
+    """
+    checksum = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def compute_quick_checksum(path: Union[Path, str]) -> str:
+    """
+    Calculates a cheap fingerprint of a file from its size and the MD5 of its
+    first and last few MB. Identical files always have the same fingerprint,
+    so a file whose fingerprint is unknown can't be a duplicate.
+    """
+    size = os.path.getsize(path)
+    checksum = hashlib.md5()
+    with open(path, "rb") as f:
+        if size <= 2 * QUICK_CHECKSUM_SAMPLE_SIZE:
+            checksum.update(f.read())
+        else:
+            checksum.update(f.read(QUICK_CHECKSUM_SAMPLE_SIZE))
+            f.seek(-QUICK_CHECKSUM_SAMPLE_SIZE, os.SEEK_END)
+            checksum.update(f.read(QUICK_CHECKSUM_SAMPLE_SIZE))
+    return f"{size}:{checksum.hexdigest()}"
+
+
 def maybe_override_pixel_limit() -> None:
     """
     Maybe overrides the PIL limit on pixel count, if configured to allow it
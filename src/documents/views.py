@@ -1,3 +1,4 @@
+import base64
 import hashlib
 import itertools
 import json
@@ -7,37 +8,43 @@ import platform
 import re
 import tempfile
 import urllib
-import zipfile
+import uuid
 from datetime import datetime
 from pathlib import Path
 from time import mktime
 from unicodedata import normalize
 from urllib.parse import quote
 from urllib.parse import urlparse
-import pandas as pd
 
 import pathvalidate
+from celery import states
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.db import connections
+from django.db import transaction
 from django.db.migrations.loader import MigrationLoader
 from django.db.migrations.recorder import MigrationRecorder
 from django.db.models import Case
 from django.db.models import Count
+from django.db.models import F
 from django.db.models import IntegerField
 from django.db.models import Max
+from django.db.models import OuterRef
 from django.db.models import Q
+from django.db.models import Subquery
 from django.db.models import Sum
 from django.db.models import When
 from django.db.models.functions import Length
 from django.db.models.functions import Lower
+from django.http import FileResponse
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseForbidden
 from django.http import HttpResponseRedirect
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.decorators import method_decorator
@@ -55,6 +62,7 @@ from redis import Redis
 from rest_framework import parsers, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
 from rest_framework.filters import SearchFilter
 from rest_framework.generics import GenericAPIView
@@ -62,9 +70,11 @@ from rest_framework.mixins import DestroyModelMixin
 from rest_framework.mixins import ListModelMixin
 from rest_framework.mixins import RetrieveModelMixin
 from rest_framework.mixins import UpdateModelMixin
+from rest_framework.pagination import BasePagination
 from rest_framework.permissions import DjangoModelPermissions
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.viewsets import ModelViewSet
@@ -73,9 +83,8 @@ from rest_framework.viewsets import ViewSet
 
 from documents import bulk_edit
 from documents import index
-from documents.bulk_download import ArchiveOnlyStrategy
-from documents.bulk_download import OriginalAndArchiveStrategy
-from documents.bulk_download import OriginalsOnlyStrategy
+from documents.bulk_download import stream_zip
+from documents.bulk_download import zip_strategy
 from documents.caching import CACHE_50_MINUTES
 from documents.caching import get_metadata_cache
 from documents.caching import get_suggestion_cache
@@ -94,6 +103,11 @@ from documents.conditionals import thumbnail_last_modified
 from documents.data_models import ConsumableDocument
 from documents.data_models import DocumentMetadataOverrides
 from documents.data_models import DocumentSource
+from documents.excel_export import excel_response
+from documents.export_jobs import ARTIFACT_TYPES
+from documents.export_jobs import content_type
+from documents.export_jobs import remove_artifact
+from documents.export_jobs import write_zip
 from documents.filters import CorrespondentFilterSet, DossierFilterSet, DossierFormFilterSet
 from documents.filters import CustomFieldFilterSet
 from documents.filters import DocumentFilterSet
@@ -115,6 +129,7 @@ from documents.models import Approval, Correspondent, CustomFieldInstance, Dossi
 from documents.models import CustomField
 from documents.models import Document
 from documents.models import DocumentType
+from documents.models import ExportJob
 from documents.models import Note
 from documents.models import PaperlessTask
 from documents.models import SavedView
@@ -144,6 +159,8 @@ from documents.serialisers import CustomFieldSerializer
 from documents.serialisers import DocumentListSerializer
 from documents.serialisers import DocumentSerializer
 from documents.serialisers import DocumentTypeSerializer
+from documents.serialisers import ExportJobCreateSerializer
+from documents.serialisers import ExportJobSerializer
 from documents.serialisers import PostDocumentSerializer
 from documents.serialisers import SavedViewSerializer
 from documents.serialisers import ShareLinkSerializer
@@ -161,6 +178,22 @@ from documents.serialisers import FolderSerializer
 from documents.signals import document_updated
 from documents.signals import approval_updated
 from documents.tasks import consume_file
+from documents.tasks import delete_subtree
+from documents.tasks import run_export_job
+from documents.tree import DOCUMENT_FIELDS
+from documents.tree import TreeMoveError
+from documents.tree import annotate_subtree_document_count
+from documents.tree import build_path
+from documents.tree import get_breadcrumbs
+from documents.tree import get_parent_field
+from documents.tree import mark_deleting
+from documents.tree import is_in_subtree
+from documents.tree import move_subtree
+from documents.tree import subtree
+from documents.tree import subtree_document_counts
+from documents.tree import subtree_document_totals
+from documents.tree import subtree_filter
+from documents.tree import unmark_deleting
 from paperless import version
 from paperless.celery import app as celery_app
 from paperless.config import GeneralConfig
@@ -255,6 +288,282 @@ class PermissionsAwareDocumentCountMixin(PassUserMixin):
         )
 
 
+def get_countable_documents(user):
+    """
+    Returns the documents the user may count in subtree totals, or None if
+    all of them, so the stored totals can be used
+    """
+    if user is None or user.is_superuser:
+        return None
+    return get_objects_for_user_owner_aware(
+        user,
+        "documents.view_document",
+        Document,
+    )
+
+
+class PermissionsAwareSubtreeDocumentCountMixin(PassUserMixin):
+    """
+    Mixin to add the document count of each subtree to a tree queryset,
+    permissions-aware if needed
+    """
+
+    def get_count_documents(self):
+        return get_countable_documents(self.request.user)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        documents = self.get_count_documents()
+        if documents is None:
+            return queryset.annotate(document_count=F("subtree_document_count"))
+        if "document_count" in self.request.query_params.get("ordering", ""):
+            # ordering needs the count of every node, not only of the page
+            return annotate_subtree_document_count(queryset, documents)
+        return queryset
+
+    def set_document_counts(self, nodes):
+        documents = self.get_count_documents()
+        nodes = [node for node in nodes if not hasattr(node, "document_count")]
+        if documents is None or not nodes:
+            return
+        counts = subtree_document_counts(nodes, documents)
+        for node in nodes:
+            node.document_count = counts[node.pk]
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.set_document_counts(page)
+        return page
+
+    def get_object(self):
+        node = super().get_object()
+        self.set_document_counts([node])
+        return node
+
+
+def queue_subtree_deletion(request, model, node_ids):
+    """
+    Hides the given nodes and their subtrees right away and deletes them with
+    their documents in the background, reporting progress to the requesting
+    user
+    """
+    roots = mark_deleting(model, node_ids)
+    if not roots:
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    try:
+        task = delete_subtree.delay(
+            model._meta.model_name,
+            roots,
+            owner_id=request.user.id,
+        )
+    except Exception:
+        # without a task nothing would ever delete or show them again
+        unmark_deleting(model, roots)
+        raise
+    return Response({"task_id": task.id}, status=status.HTTP_202_ACCEPTED)
+
+
+def queue_export_job(request, export_type, parameters, filename=None):
+    """
+    Creates an export job for the requesting user and builds its artifact in
+    the background
+    """
+    if filename is None:
+        suffix, _ = ARTIFACT_TYPES[export_type]
+        filename = f"documents{suffix}"
+    job = ExportJob.objects.create(
+        owner=request.user,
+        export_type=export_type,
+        parameters=parameters,
+        filename=filename,
+        task_id=str(uuid.uuid4()),
+    )
+    run_export_job.apply_async((job.pk,), task_id=job.task_id)
+    return Response(
+        ExportJobSerializer(job).data,
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+class TreeBrowsePagination(BasePagination):
+    """
+    Keyset pagination over consecutive segments of tree nodes, each ordered
+    by name. The cursor holds the segment and the last name and id returned,
+    so every page is a range scan no matter how deep into a folder it is.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 0, None
+        try:
+            segment, name, pk = json.loads(
+                base64.urlsafe_b64decode(encoded.encode()).decode(),
+            )
+            return int(segment), (name, int(pk)) if name is not None else None
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, segment, name=None, pk=None):
+        return base64.urlsafe_b64encode(
+            json.dumps([segment, name, pk]).encode(),
+        ).decode()
+
+    def paginate_queryset(self, segments, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        segment, position = self.decode_cursor(request)
+
+        results = []
+        self.next_cursor = None
+        for index in range(segment, len(segments)):
+            queryset = (
+                segments[index]
+                .annotate(browse_name=Lower("name"))
+                .order_by("browse_name", "id")
+            )
+            if index == segment and position is not None:
+                name, pk = position
+                queryset = queryset.filter(
+                    Q(browse_name__gt=name) | Q(browse_name=name, id__gt=pk),
+                )
+            remaining = page_size - len(results)
+            rows = list(queryset[: remaining + 1])
+            if len(rows) > remaining:
+                results.extend(rows[:remaining])
+                last = results[-1]
+                self.next_cursor = self.encode_cursor(
+                    index,
+                    last["browse_name"],
+                    last["id"],
+                )
+                break
+            results.extend(rows)
+            if len(results) == page_size:
+                following = segments[index + 1 :]
+                if any(queryset.exists() for queryset in following):
+                    self.next_cursor = self.encode_cursor(index + 1)
+                break
+
+        for row in results:
+            del row["browse_name"]
+        return results
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+
+class TreeBrowseMixin:
+    """
+    Adds a browse action listing the children of a node, containers first and
+    then files, with a fixed projection that leaves out document contents and
+    the stored subtree totals instead of counting them per request. Users who
+    may not see every document get totals of the documents they can see,
+    computed for the page only.
+    """
+
+    browse_file_types: list[str] = []
+    browse_fields = [
+        "id",
+        "name",
+        "type",
+        "path",
+        "owner",
+        "created",
+        "child_count",
+        "subtree_document_count",
+        "subtree_size",
+    ]
+
+    def get_browse_queryset(self, parent):
+        model = self.model
+        queryset = ObjectOwnedOrGrantedPermissionsFilter().filter_queryset(
+            self.request,
+            model.objects.filter(
+                **{get_parent_field(model): parent},
+                deleting=False,
+            ),
+            self,
+        )
+        document = Document.objects.filter(
+            **{DOCUMENT_FIELDS[model]: OuterRef("pk")},
+        ).order_by("id")
+        return queryset.annotate(
+            document=Subquery(document.values("id")[:1]),
+        ).values(*self.browse_fields, "document")
+
+    def set_browse_totals(self, rows):
+        documents = get_countable_documents(self.request.user)
+        if documents is None or not rows:
+            return
+        model = self.model
+        totals = subtree_document_totals(
+            [model(pk=row["id"], path=row["path"]) for row in rows],
+            documents,
+        )
+        for row in rows:
+            row["subtree_document_count"], row["subtree_size"] = totals[row["id"]]
+
+    @action(methods=["get"], detail=False)
+    def browse(self, request):
+        model = self.model
+        parent = None
+        parent_id = request.query_params.get("parent")
+        if parent_id:
+            try:
+                parent = model.objects.get(pk=parent_id)
+            except (model.DoesNotExist, ValueError):
+                raise Http404
+            if not has_perms_owner_aware(
+                request.user,
+                f"view_{model._meta.model_name}",
+                parent,
+            ):
+                return HttpResponseForbidden(
+                    f"Insufficient permissions to view {model._meta.verbose_name_plural}",
+                )
+
+        children = self.get_browse_queryset(parent)
+        segments = [
+            children.exclude(type__in=self.browse_file_types),
+            children.filter(type__in=self.browse_file_types),
+        ]
+        paginator = TreeBrowsePagination()
+        page = paginator.paginate_queryset(segments, request, self)
+        parent_row = (
+            model.objects.filter(pk=parent.pk).values(*self.browse_fields).first()
+            if parent is not None
+            else None
+        )
+        self.set_browse_totals(page + ([parent_row] if parent_row else []))
+        response = paginator.get_paginated_response(page)
+        response.data["parent"] = parent_row
+        return response
+
+
 class CorrespondentViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
     model = Correspondent
 
@@ -384,7 +693,7 @@ class DocumentViewSet(
         response = super().update(request, *args, **kwargs)
         from documents import index
 
-        index.add_or_update_document(self.get_object())
+        index.queue_index_update([self.get_object().pk])
 
         document_updated.send(
             sender=self.__class__,
@@ -472,7 +781,6 @@ class DocumentViewSet(
         document_cached_metadata = get_metadata_cache(doc.pk)
 
         archive_metadata = None
-        archive_filesize = None
         if document_cached_metadata is not None:
             original_metadata = document_cached_metadata.original_metadata
             archive_metadata = document_cached_metadata.archive_metadata
@@ -481,16 +789,24 @@ class DocumentViewSet(
             original_metadata = self.get_metadata(doc.source_path, doc.mime_type)
 
             if doc.has_archive_version:
-                archive_filesize = self.get_filesize(doc.archive_path)
                 archive_metadata = self.get_metadata(
                     doc.archive_path,
                     "application/pdf",
                 )
             set_metadata_cache(doc, original_metadata, archive_metadata)
 
+        # sizes are stored since they were added, older documents fall back
+        # to the files until they are backfilled
+        original_size = doc.original_size
+        if original_size is None:
+            original_size = self.get_filesize(doc.source_path)
+        archive_size = doc.archive_size
+        if archive_size is None and doc.has_archive_version:
+            archive_size = self.get_filesize(doc.archive_path)
+
         meta = {
             "original_checksum": doc.checksum,
-            "original_size": self.get_filesize(doc.source_path),
+            "original_size": original_size,
             "original_mime_type": doc.mime_type,
             "media_filename": doc.filename,
             "has_archive_version": doc.has_archive_version,
@@ -498,7 +814,7 @@ class DocumentViewSet(
             "archive_checksum": doc.archive_checksum,
             "archive_media_filename": doc.archive_filename,
             "original_filename": doc.original_filename,
-            "archive_size": archive_filesize,
+            "archive_size": archive_size,
             "archive_metadata": archive_metadata,
         }
 
@@ -616,32 +932,11 @@ class DocumentViewSet(
     @action(methods=["get"], detail=True)
     def export_excel(self, request, pk=None):
         try:
-
             document = Document.objects.get(pk=pk)
-            fields = CustomFieldInstance.objects.filter(document=pk)
-
-            data = {
-                'Tên file': document.title,
-                'Nội dung': [document.content],
-                'Ngày tạo': [document.created.strftime('%d-%m-%Y')],
-            }
-
-            for f in fields:
-                data[f.field.name] = [f.value_text]
-
-            df = pd.DataFrame(data)
-
-            # Tên file Excel sẽ được tạo
-            excel_file_name = f"{document.title}.xlsx"
-
-            # Tạo response để trả về file Excel
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="{excel_file_name}"'
-
-            # Ghi DataFrame vào response dưới dạng Excel
-            df.to_excel(response, index=False)
-
-            return response
+            return excel_response(
+                Document.objects.filter(pk=document.pk),
+                f"{document.title}.xlsx",
+            )
         except (FileNotFoundError, Document.DoesNotExist):
             raise Http404
 
@@ -718,7 +1013,7 @@ class DocumentViewSet(
 
                 from documents import index
 
-                index.add_or_update_document(self.get_object())
+                index.queue_index_update([doc.pk])
 
                 return Response(self.getNotes(doc))
             except Exception as e:
@@ -755,7 +1050,7 @@ class DocumentViewSet(
 
             from documents import index
 
-            index.add_or_update_document(doc)
+            index.queue_index_update([doc.pk])
 
             return Response(self.getNotes(doc))
 
@@ -851,7 +1146,7 @@ class DocumentViewSet(
 
                 from documents import index
 
-                index.add_or_update_document(self.get_object())
+                index.queue_index_update([doc.pk])
 
                 return Response(self.getNotes(doc))
             except Exception as e:
@@ -1357,6 +1652,11 @@ class StatisticsView(APIView):
             .get("characters__sum")
         )
 
+        sizes = documents.aggregate(
+            original_size=Sum("original_size"),
+            archive_size=Sum("archive_size"),
+        )
+
         return Response(
             {
                 "documents_total": documents_total,
@@ -1364,6 +1664,8 @@ class StatisticsView(APIView):
                 "inbox_tag": inbox_tag.first().pk if inbox_tag.exists() else None,
                 "document_file_type_counts": document_file_type_counts,
                 "character_count": character_count,
+                "original_size_total": sizes["original_size"] or 0,
+                "archive_size_total": sizes["archive_size"] or 0,
                 "tag_count": len(tags),
                 "correspondent_count": correspondent_count,
                 "document_type_count": document_type_count,
@@ -1384,38 +1686,64 @@ class BulkDownloadView(GenericAPIView):
         serializer.is_valid(raise_exception=True)
 
         ids = serializer.validated_data.get("documents")
-        compression = serializer.validated_data.get("compression")
         content = serializer.validated_data.get("content")
-        follow_filename_format = serializer.validated_data.get("follow_formatting")
+        compression = serializer.validated_data.get("compression")
+        follow_formatting = serializer.validated_data.get("follow_formatting")
+        store_compressed = serializer.validated_data.get("store_compressed")
+
+        if serializer.validated_data.get("stream"):
+            response = StreamingHttpResponse(
+                stream_zip(
+                    Document.objects.filter(id__in=ids).order_by("pk").iterator(),
+                    zip_strategy(content),
+                    compression,
+                    follow_formatting,
+                    store_compressed,
+                ),
+                content_type="application/zip",
+            )
+            response["Content-Disposition"] = 'attachment; filename="documents.zip"'
+            return response
+
+        if serializer.validated_data.get("background"):
+            return queue_export_job(
+                request,
+                ExportJob.EXPORT_ZIP,
+                {
+                    "documents": ids,
+                    "content": content,
+                    "compression": compression,
+                    "follow_formatting": follow_formatting,
+                    "store_compressed": store_compressed,
+                },
+                "documents.zip",
+            )
 
         settings.SCRATCH_DIR.mkdir(parents=True, exist_ok=True)
         temp = tempfile.NamedTemporaryFile(
             dir=settings.SCRATCH_DIR,
             suffix="-compressed-archive",
-            delete=False,
         )
-
-        if content == "both":
-            strategy_class = OriginalAndArchiveStrategy
-        elif content == "originals":
-            strategy_class = OriginalsOnlyStrategy
-        else:
-            strategy_class = ArchiveOnlyStrategy
-
-        with zipfile.ZipFile(temp.name, "w", compression) as zipf:
-            strategy = strategy_class(zipf, follow_filename_format)
-            for id in ids:
-                doc = Document.objects.get(id=id)
-                strategy.add_document(doc)
-
-        with open(temp.name, "rb") as f:
-            response = HttpResponse(f, content_type="application/zip")
-            response["Content-Disposition"] = '{}; filename="{}"'.format(
-                "attachment",
-                "documents.zip",
+        try:
+            write_zip(
+                Document.objects.filter(id__in=ids),
+                Path(temp.name),
+                content,
+                compression,
+                follow_formatting,
+                store_compressed,
             )
+        except Exception:
+            temp.close()
+            raise
+        # the temporary file is removed once the response closes it
+        return FileResponse(
+            temp,
+            as_attachment=True,
+            filename="documents.zip",
+            content_type="application/zip",
+        )
 
-            return response
 
 class BulkExportExcelView(GenericAPIView):
     permission_classes = (IsAuthenticated,)
@@ -1427,80 +1755,37 @@ class BulkExportExcelView(GenericAPIView):
         serializer.is_valid(raise_exception=True)
 
         ids = serializer.validated_data.get("documents")
+        if serializer.validated_data.get("background"):
+            return queue_export_job(
+                request,
+                ExportJob.EXPORT_EXCEL,
+                {"documents": ids},
+                "download.xlsx",
+            )
+        return excel_response(Document.objects.filter(id__in=ids), "download.xlsx")
 
-        try:
-
-            documents = Document.objects.filter(id__in=ids)
-            # fields = CustomFieldInstance.objects.filter(document__in=ids)
-            data = []
-            for document in documents:
-                fields = CustomFieldInstance.objects.filter(document=document.pk)
-                row_data = {
-                    'Tên file': document.title,
-                    'Nội dung': document.content,
-                    'Ngày tạo': document.created.strftime('%d-%m-%Y'),
-                }
-                for f in fields:
-                    row_data[f.field.name] = f.value_text
-                data.append(row_data)
-
-            df = pd.DataFrame(data)
-            excel_file_name = f"download.xlsx"
-            # Tạo response để trả về file Excel
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="{excel_file_name}"'
-
-            df.to_excel(response, index=False)
-
-            return response
-        except (FileNotFoundError, Document.DoesNotExist):
-            raise Http404
 
 class BulkExportExcelFromFolderView(GenericAPIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = ExportDocumentFromFolderSerializer
 
-
     def post(self, request, format=None):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        ids = serializer.validated_data.get("folders")
-
-        try:
-
-            folder_ids = Folder.objects.filter(id__in=ids).values_list('id',flat=False)
-            folder_ids = [x[0] for x in folder_ids]
-            if len(ids)==0:
-                folder_ids = Folder.objects.all().values_list('id',flat=False)
-                folder_ids = [x[0] for x in folder_ids]
-
-
-            documents = Document.objects.filter(folder__in=ids)
-            # fields = CustomFieldInstance.objects.filter(document__in=ids)
-            data = []
-            for document in documents:
-                fields = CustomFieldInstance.objects.filter(document=document.pk)
-                row_data = {
-                    'Tên file': document.title,
-                    'Nội dung': document.content,
-                    'Ngày tạo': document.created.strftime('%d-%m-%Y'),
-                }
-                for f in fields:
-                    row_data[f.field.name] = f.value_text
-                data.append(row_data)
-
-            df = pd.DataFrame(data)
-            excel_file_name = f"download.xlsx"
-            # Tạo response để trả về file Excel
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="{excel_file_name}"'
+        folders = list(serializer.validated_data.get("folders"))
+        if serializer.validated_data.get("background"):
+            return queue_export_job(
+                request,
+                ExportJob.EXPORT_EXCEL,
+                {"folders": folders, "subtree": False},
+                "download.xlsx",
+            )
+        return excel_response(
+            Document.objects.filter(folder__in=folders),
+            "download.xlsx",
+        )
 
-            df.to_excel(response, index=False)
-
-            return response
-        except (FileNotFoundError, Document.DoesNotExist):
-            raise Http404
 
 class StoragePathViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
     model = StoragePath
@@ -1650,6 +1935,71 @@ class RemoteVersionView(GenericAPIView):
         )
 
 
+class ExportJobViewSet(
+    ListModelMixin,
+    RetrieveModelMixin,
+    DestroyModelMixin,
+    GenericViewSet,
+):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ExportJobSerializer
+    pagination_class = StandardPagination
+
+    def get_queryset(self):
+        queryset = ExportJob.objects.select_related("owner").order_by("-created")
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(owner=self.request.user)
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        serializer = ExportJobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        export_type = data["export_type"]
+        if "folders" in data:
+            parameters = {"folders": data["folders"], "subtree": data["subtree"]}
+        else:
+            parameters = {"documents": data["documents"]}
+        if export_type == ExportJob.EXPORT_ZIP:
+            parameters.update(
+                content=data["content"],
+                compression=data["compression"],
+                follow_formatting=data["follow_formatting"],
+                store_compressed=data["store_compressed"],
+            )
+        return queue_export_job(
+            request,
+            export_type,
+            parameters,
+            data.get("filename"),
+        )
+
+    def perform_destroy(self, instance):
+        remove_artifact(instance)
+        instance.delete()
+
+    @action(methods=["get"], detail=True)
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != states.SUCCESS:
+            return Response(
+                {"detail": "The export is not finished."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if job.expires is not None and job.expires <= timezone.now():
+            raise Http404
+        try:
+            return FileResponse(
+                open(job.artifact, "rb"),
+                as_attachment=True,
+                filename=job.filename,
+                content_type=content_type(job),
+            )
+        except (FileNotFoundError, TypeError):
+            raise Http404
+
+
 class TasksViewSet(ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticated,)
     serializer_class = TasksViewSerializer
@@ -1913,73 +2263,25 @@ class BulkEditObjectsView(PassUserMixin):
             parent_folder_id = serializer.validated_data.get("parent_folder")
             parent_folder_obj = Folder.objects.get(pk=parent_folder_id) if parent_folder_id else None
 
-            for folder_id in object_ids:
-                folder = Folder.objects.get(id=folder_id)
-                # folder.parent_folder = parent_folder_obj
-                # folder.path = f"{folder.parent_folder.path}/{folder.id}"
-                # folder.save()
-
-                # print(folder.id)
-                # print(int(request.data['parent_folder'][0]))
-                if request.data.get('parent_folder') is None:
-                    pass
-                elif int(request.data['parent_folder']) == folder.id:
-                    return Response(status=status.HTTP_400_BAD_REQUEST)
-                elif 'parent_folder' in request.data:
-                    new_parent_folder = Folder.objects.get(id=int(request.data['parent_folder']))
-                    if new_parent_folder.path.startswith(folder.path):
-                        return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': 'Cannot move a folder into one of its child folders.'})
-                    elif new_parent_folder.type == "file":
-                        return Response(status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    request.data['parent_folder'] = None
-
-                old_parent_folder = folder.parent_folder
-                folder.parent_folder = parent_folder_obj
-
-                if old_parent_folder != folder.parent_folder:
-                    if folder.parent_folder:
-                        folder.path = f"{folder.parent_folder.path}/{folder.id}"
-                        folder.parent_folder = parent_folder_obj
-
-                    else:
-                        folder.path = f"{folder.id}"
-                    folder.save()
-
-                    self.update_child_folder_paths(folder)
-
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-        elif operation == "delete" and object_type == "warehouses":
-            for warehouse_id in object_ids:
-                warehouse = Warehouse.objects.get(id=int(warehouse_id))
-                warehouses = Warehouse.objects.filter(path__startswith=warehouse.path)
-                documents = Document.objects.filter(warehouse__in=warehouses)
-                documents.delete()
-                warehouses.delete()
-
-
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            if parent_folder_obj is not None and parent_folder_obj.type == Folder.FILE:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        elif operation == "delete" and object_type == "folders":
-            for folder_id in object_ids:
-                folder = Folder.objects.get(id=int(folder_id))
-                folders = Folder.objects.filter(path__startswith=folder.path)
-                documents = Document.objects.filter(folder__in=folders)
-                documents.delete()
-                folders.delete()
+            try:
+                with transaction.atomic():
+                    for folder in objs:
+                        if folder.parent_folder_id != parent_folder_id:
+                            move_subtree(folder, parent_folder_obj)
+            except TreeMoveError as e:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': str(e)})
 
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        elif operation == "delete" and object_type == "dossiers":
-            for dossier_id in object_ids:
-                dossier = Dossier.objects.get(id=int(dossier_id))
-                dossiers = Dossier.objects.filter(path__startswith=dossier.path)
-                documents = Document.objects.filter(dossier__in=dossier)
-                documents.delete()
-                dossiers.delete()
-
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        elif operation == "delete" and object_type in (
+            "warehouses",
+            "folders",
+            "dossiers",
+        ):
+            return queue_subtree_deletion(request, object_class, object_ids)
 
         elif operation == "delete":
 
@@ -1987,15 +2289,7 @@ class BulkEditObjectsView(PassUserMixin):
 
 
         return Response({"result": "OK"})
-    def update_child_folder_paths(self, folder):
-        child_folders = Folder.objects.filter(parent_folder=folder)
-        for child_folder in child_folders:
-            if folder.path:
-                child_folder.path = f"{folder.path}/{child_folder.id}"
-            else:
-                child_folder.path = f"{child_folder.id}"
-            child_folder.save()
-            self.update_child_folder_paths(child_folder)
+
 
 class WorkflowTriggerViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, PaperlessObjectPermissions)
@@ -2123,6 +2417,20 @@ class SystemStatusView(PassUserMixin):
         except Exception:
             celery_active = "ERROR"
 
+        celery_queue_depths = None
+        try:
+            with celery_app.connection_for_read() as conn:
+                conn.ensure_connection(max_retries=1, interval_start=0)
+                channel = conn.default_channel
+                celery_queue_depths = {
+                    queue: channel.queue_declare(queue=queue).message_count
+                    for queue in settings.TASK_QUEUES
+                }
+        except Exception as e:
+            logger.warning(
+                f"System status could not determine the task queue depths: {e}",
+            )
+
         index_error = None
         try:
             ix = index.open_index()
@@ -2224,6 +2532,7 @@ class SystemStatusView(PassUserMixin):
                     "redis_status": redis_status,
                     "redis_error": redis_error,
                     "celery_status": celery_active,
+                    "celery_queue_depths": celery_queue_depths,
                     "index_status": index_status,
                     "index_last_modified": index_last_modified,
                     "index_error": index_error,
@@ -2236,11 +2545,13 @@ class SystemStatusView(PassUserMixin):
 
 
 
-class WarehouseViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
+class WarehouseViewSet(ModelViewSet, PermissionsAwareSubtreeDocumentCountMixin):
     model = Warehouse
 
-    queryset = Warehouse.objects.select_related("owner").order_by(
-        Lower("name"),
+    queryset = (
+        Warehouse.objects.filter(deleting=False)
+        .select_related("owner")
+        .order_by(Lower("name"))
     )
 
     serializer_class = WarehouseSerializer
@@ -2254,9 +2565,6 @@ class WarehouseViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
     filterset_class = WarehouseFilterSet
     ordering_fields = ("name", "type", "parent_warehouse", "document_count")
 
-
-
-
     def create(self, request, *args, **kwargs):
         # try:
         serializer = WarehouseSerializer(data=request.data)
@@ -2268,15 +2576,15 @@ class WarehouseViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
         if serializer.validated_data.get("type") == Warehouse.WAREHOUSE and not parent_warehouse:
             warehouse = serializer.save(owner=request.user)
-            warehouse.path = str(warehouse.id)
+            warehouse.path = build_path(warehouse, None)
             warehouse.save()
         elif serializer.validated_data.get("type", "") == Warehouse.SHELF and  getattr(parent_warehouse, 'type', "") == Warehouse.WAREHOUSE :
             warehouse = serializer.save(type=Warehouse.SHELF, parent_warehouse=parent_warehouse,owner=request.user)
-            warehouse.path = f"{parent_warehouse.path}/{warehouse.id}"
+            warehouse.path = build_path(warehouse, parent_warehouse)
             warehouse.save()
         elif serializer.validated_data.get("type", "") == Warehouse.BOXCASE and  getattr(parent_warehouse, 'type', "") == Warehouse.SHELF :
             warehouse = serializer.save(type=Warehouse.BOXCASE, parent_warehouse=parent_warehouse,owner=request.user)
-            warehouse.path = f"{parent_warehouse.path}/{warehouse.id}"
+            warehouse.path = build_path(warehouse, parent_warehouse)
             warehouse.save()
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -2289,28 +2597,28 @@ class WarehouseViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
 
-
         old_parent_warehouse = instance.parent_warehouse
-
-        self.perform_update(serializer)
-
-        if old_parent_warehouse != instance.parent_warehouse:
-
-            if instance.type == Warehouse.SHELF and getattr(instance.parent_warehouse, 'type', "") == Warehouse.WAREHOUSE :
-                instance.path = f"{instance.parent_warehouse.path}/{instance.id}"
-            elif instance.type == Warehouse.BOXCASE and  getattr(instance.parent_warehouse, 'type', "") == Warehouse.SHELF :
-                instance.path = f"{instance.parent_warehouse.path}/{instance.id}"
-            elif instance.type == Warehouse.WAREHOUSE and not instance.parent_warehouse:
-                instance.path = str(instance.id)
+        new_parent_warehouse = serializer.validated_data.get('parent_warehouse', old_parent_warehouse)
+        new_type = serializer.validated_data.get('type', instance.type)
+
+        if old_parent_warehouse != new_parent_warehouse:
+            if new_type == Warehouse.SHELF and getattr(new_parent_warehouse, 'type', "") == Warehouse.WAREHOUSE :
+                pass
+            elif new_type == Warehouse.BOXCASE and  getattr(new_parent_warehouse, 'type', "") == Warehouse.SHELF :
+                pass
+            elif new_type == Warehouse.WAREHOUSE and not new_parent_warehouse:
+                pass
             else:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
-            instance.save()
 
-            boxcase_warehouses = Warehouse.objects.filter(type=Warehouse.BOXCASE, parent_warehouse=instance)
-            for boxcase_warehouse in boxcase_warehouses:
-                boxcase_warehouse.path = f"{instance.path}/{boxcase_warehouse.id}"
-                boxcase_warehouse.save()
+        try:
+            with transaction.atomic():
+                self.perform_update(serializer)
 
+                if old_parent_warehouse != instance.parent_warehouse:
+                    move_subtree(instance, instance.parent_warehouse)
+        except TreeMoveError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': str(e)})
 
         return Response(serializer.data)
 
@@ -2320,46 +2628,45 @@ class WarehouseViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
 
-
         old_parent_warehouse = instance.parent_warehouse
-
-        self.perform_update(serializer)
-
-        if old_parent_warehouse != instance.parent_warehouse:
-
-            if instance.type == Warehouse.SHELF and getattr(instance.parent_warehouse, 'type', "") == Warehouse.WAREHOUSE :
-                instance.path = f"{instance.parent_warehouse.path}/{instance.id}"
-            elif instance.type == Warehouse.BOXCASE and  getattr(instance.parent_warehouse, 'type', "") == Warehouse.SHELF :
-                instance.path = f"{instance.parent_warehouse.path}/{instance.id}"
-            elif instance.type == Warehouse.WAREHOUSE and not instance.parent_warehouse:
-                instance.path = str(instance.id)
+        new_parent_warehouse = serializer.validated_data.get('parent_warehouse', old_parent_warehouse)
+        new_type = serializer.validated_data.get('type', instance.type)
+
+        if old_parent_warehouse != new_parent_warehouse:
+            if new_type == Warehouse.SHELF and getattr(new_parent_warehouse, 'type', "") == Warehouse.WAREHOUSE :
+                pass
+            elif new_type == Warehouse.BOXCASE and  getattr(new_parent_warehouse, 'type', "") == Warehouse.SHELF :
+                pass
+            elif new_type == Warehouse.WAREHOUSE and not new_parent_warehouse:
+                pass
             else:
                 return Response(status=status.HTTP_400_BAD_REQUEST)
-            instance.save()
 
-            boxcase_warehouses = Warehouse.objects.filter(type=Warehouse.BOXCASE, parent_warehouse=instance)
-            for boxcase_warehouse in boxcase_warehouses:
-                boxcase_warehouse.path = f"{instance.path}/{boxcase_warehouse.id}"
-                boxcase_warehouse.save()
+        try:
+            with transaction.atomic():
+                self.perform_update(serializer)
 
+                if old_parent_warehouse != instance.parent_warehouse:
+                    move_subtree(instance, instance.parent_warehouse)
+        except TreeMoveError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': str(e)})
 
         return Response(serializer.data)
 
-    def destroy(self, request, pk, *args, **kwargs):
-        warehouse = Warehouse.objects.get(id=pk)
-        warehouses = Warehouse.objects.filter(path__startswith=warehouse.path)
-        documents = Document.objects.filter(warehouse__in=warehouses)
-        documents.delete()
-        warehouses.delete()
-
-        return Response(status=status.HTTP_204_NO_CONTENT)
+    def destroy(self, request, *args, **kwargs):
+        return queue_subtree_deletion(request, Warehouse, [self.get_object().pk])
 
 
 
-class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
+class FolderViewSet(
+    TreeBrowseMixin,
+    ModelViewSet,
+    PermissionsAwareDocumentCountMixin,
+):
     model = Folder
+    browse_file_types = [Folder.FILE]
 
-    queryset = Folder.objects.annotate(
+    queryset = Folder.objects.filter(deleting=False).annotate(
         type_order=Case(
             When(type='folder', then=0),  # Gán giá trị 0 cho folder
             When(type='file', then=1),  # Gán giá trị 1 cho file
@@ -2403,53 +2710,30 @@ class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
     @action(methods=["get"], detail=True)
     def bulk_export_excel(self, request, pk=None):
-        try:
-            folder = Folder.objects.get(pk=pk)
-            list_folders = Folder.objects.filter(path__startswith = folder.path).values_list("id")
-            folder_ids = [x[0] for x in list_folders]
-            documents = Document.objects.filter(folder__id__in = folder_ids)
-            data = []
-            for document in documents:
-                row_data = {
-                    'Tên file': document.title,
-                    'Nội dung': document.content,
-                    'Ngày tạo': document.created.strftime('%d-%m-%Y'),
-                }
-                fields = CustomFieldInstance.objects.filter(document=document)
-                for f in fields:
-                    row_data[f.field.name] = f.value_text
-                data.append(row_data)
-
-            df = pd.DataFrame(data)
-            excel_file_name = f"download.xlsx"
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="{excel_file_name}"'
-            df.to_excel(response, index=False)
-            return response
-        except (FileNotFoundError, Document.DoesNotExist):
+        if not Folder.objects.filter(pk=pk, deleting=False).exists():
             raise Http404
+        background = request.query_params.get("background", "false")
+        if background.lower() in ["true", "1"]:
+            return queue_export_job(
+                request,
+                ExportJob.EXPORT_EXCEL,
+                {"folders": [int(pk)], "subtree": True},
+                "download.xlsx",
+            )
+        documents = Document.objects.filter(
+            subtree_filter("folder", Folder, [int(pk)]),
+        )
+        return excel_response(documents, "download.xlsx")
+
     @action(methods=["get"], detail=True)
     def folder_path(self, request, pk=None):
-        if request.method == "GET":
-            try:
-                fol = Folder.objects.get(pk=pk)
-                folder_path = fol.path.split('/')
-                folders = Folder.objects.filter(id__in = folder_path)
-                folders_dict = {}
-                for f in folders:
-                    folders_dict[f.id] = f
-                    # print(f)
-                new_folder_path = []
-                for p in folder_path:
-                    value = folders_dict.get(int(p))
-                    new_folder_path.append(value)
-                folders_serialisers = FolderSerializer(new_folder_path, many=True)
-                return Response({"results":folders_serialisers.data},status=status.HTTP_200_OK)
-            except Exception as e:
-                logger.warning(f"An error occurred retrieving folders: {e!s}")
-                return Response(
-                    {"error": "Error retrieving folders, check logs for more detail."},
-                )
+        try:
+            breadcrumbs = get_breadcrumbs(Folder, int(pk))
+        except ValueError:
+            raise Http404
+        if breadcrumbs is None:
+            raise Http404
+        return Response({"results": breadcrumbs}, status=status.HTTP_200_OK)
 
 
     def getFolderDocById(self, fol):
@@ -2497,12 +2781,12 @@ class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
         if parent_folder == None:
             folder = serializer.save(owner=request.user)
-            folder.path = str(folder.id)
+            folder.path = build_path(folder, None)
             folder.checksum = hashlib.md5(f'{folder.id}.{folder.name}'.encode()).hexdigest()
             folder.save()
         elif parent_folder:
             folder = serializer.save(parent_folder=parent_folder,owner=request.user)
-            folder.path = f"{parent_folder.path}/{folder.id}"
+            folder.path = build_path(folder, parent_folder)
             folder.checksum = hashlib.md5(f'{folder.id}.{folder.name}'.encode()).hexdigest()
             folder.save()
         else:
@@ -2520,7 +2804,7 @@ class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
         elif 'parent_folder' in request.data:
             new_parent_folder = Folder.objects.get(id=int(request.data['parent_folder']))
-            if new_parent_folder.path.startswith(instance.path):
+            if is_in_subtree(new_parent_folder, instance):
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': 'Cannot move a folder into one of its child folders.'})
             elif new_parent_folder.type == "file":
                 return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -2533,17 +2817,14 @@ class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
         old_parent_folder = instance.parent_folder
 
-        self.perform_update(serializer)
-
-        if old_parent_folder != instance.parent_folder:
-            if instance.parent_folder:
-                instance.path = f"{instance.parent_folder.path}/{instance.id}"
-
-            else:
-                instance.path = f"{instance.id}"
-            instance.save()
+        try:
+            with transaction.atomic():
+                self.perform_update(serializer)
 
-            self.update_child_folder_paths(instance)
+                if old_parent_folder != instance.parent_folder:
+                    move_subtree(instance, instance.parent_folder)
+        except TreeMoveError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': str(e)})
 
         return Response(serializer.data)
 
@@ -2559,7 +2840,7 @@ class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
         elif 'parent_folder' in request.data :
             new_parent_folder = Folder.objects.get(id=int(request.data['parent_folder']))
-            if new_parent_folder.path.startswith(instance.path):
+            if is_in_subtree(new_parent_folder, instance):
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': 'Cannot move a folder into one of its child folders.'})
             elif new_parent_folder.type == "file":
                 return Response(status=status.HTTP_400_BAD_REQUEST)
@@ -2571,45 +2852,34 @@ class FolderViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
 
         old_parent_folder = instance.parent_folder
 
-        self.perform_update(serializer)
-
-        if old_parent_folder != instance.parent_folder:
-            if instance.parent_folder:
-                instance.path = f"{instance.parent_folder.path}/{instance.id}"
-            else:
-                instance.path = f"{instance.id}"
-            instance.save()
+        try:
+            with transaction.atomic():
+                self.perform_update(serializer)
 
-            self.update_child_folder_paths(instance)
+                if old_parent_folder != instance.parent_folder:
+                    move_subtree(instance, instance.parent_folder)
+        except TreeMoveError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': str(e)})
 
         return Response(serializer.data)
 
-    def update_child_folder_paths(self, folder):
-        child_folders = Folder.objects.filter(parent_folder=folder)
-        for child_folder in child_folders:
-            if folder.path:
-                child_folder.path = f"{folder.path}/{child_folder.id}"
-            else:
-                child_folder.path = f"{child_folder.id}"
-            child_folder.save()
-            self.update_child_folder_paths(child_folder)
-
-
-    def destroy(self, request, pk, *args, **kwargs):
-        folder = Folder.objects.get(id=pk)
-        folders = Folder.objects.filter(path__startswith=folder.path)
-        documents = Document.objects.filter(folder__in=folders)
-        documents.delete()
-        folders.delete()
-
-        return Response(status=status.HTTP_204_NO_CONTENT)
+    def destroy(self, request, *args, **kwargs):
+        return queue_subtree_deletion(request, Folder, [self.get_object().pk])
 
 
-class DossierViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
+class DossierViewSet(
+    TreeBrowseMixin,
+    ModelViewSet,
+    PermissionsAwareDocumentCountMixin,
+):
     model = Dossier
+    browse_file_types = ["FILE"]
 
-    queryset = Dossier.objects.select_related("owner").order_by(
-        Lower("name"),
+    queryset = (
+        Dossier.objects.filter(deleting=False)
+        .select_related("owner")
+        .prefetch_related("effective_fields")
+        .order_by(Lower("name"))
     )
 
     serializer_class = DossierSerializer
@@ -2635,7 +2905,7 @@ class DossierViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
         if parent_dossier == None:
             dossier = serializer.save(owner=request.user)
 
-            dossier.path = str(dossier.id)
+            dossier.path = build_path(dossier, None)
             dossier.save()
         elif parent_dossier:
             dossier = serializer.save(owner=request.user)
@@ -2646,90 +2916,40 @@ class DossierViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
             #     dossier.path = f"{parent_dossier.path}/{dossier.id}"
             # else:
             dossier = serializer.save(parent_dossier=parent_dossier,owner=request.user)
-            dossier.path = f"{parent_dossier.path}/{dossier.id}"
+            dossier.path = build_path(dossier, parent_dossier)
             dossier.save()
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         return Response(serializer.data,status=status.HTTP_201_CREATED)
 
-    def update_child_dossier_paths(self, dossier):
-        child_dossiers = Dossier.objects.filter(parent_dossier=dossier)
-        for child_dossier in child_dossiers:
-            if dossier.path:
-                child_dossier.path = f"{dossier.path}/{child_dossier.id}"
-            else:
-                child_dossier.path = f"{child_dossier.id}"
-            child_dossier.save()
-            self.update_child_dossier_paths(child_dossier)
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        old_parent_dossier = instance.parent_dossier
+        new_parent_dossier = serializer.validated_data.get('parent_dossier', old_parent_dossier)
 
-    # def update(self, request, *args, **kwargs):
-    #     partial = kwargs.pop('partial', False)
-    #     instance = self.get_object()
-    #     if request.data.get('parent_dossier') is None:
-    #         pass
-    #     elif 'parent_dossier' in request.data and int(request.data['parent_dossier']) == instance.id:
-    #         return Response(status=status.HTTP_400_BAD_REQUEST)
+        if old_parent_dossier == new_parent_dossier:
+            return super().perform_update(serializer)
 
-    #     elif 'parent_dossier' in request.data:
-    #         new_parent_dossier = Dossier.objects.get(id=int(request.data['parent_dossier']))
-    #         if new_parent_dossier.path.startswith(instance.path):
-    #             return Response(status=status.HTTP_400_BAD_REQUEST, data={'error': 'Cannot move a dossier into one of its child dossiers.'})
-    #     else:
-    #         request.data['parent_dossier'] = None
-
-    #     serializer = self.get_serializer(instance, data=request.data, partial=partial)
-    #     serializer.is_valid(raise_exception=True)
-
-    #     old_parent_dossier = instance.parent_dossier
-
-    #     self.perform_update(serializer)
-
-    #     if old_parent_dossier != instance.parent_dossier:
-    #         if instance.parent_dossier:
-    #             instance.path = f"{instance.parent_dossier.path}/{instance.id}"
-
-    #         else:
-    #             instance.path = f"{instance.id}"
-    #         instance.save()
-
-    #         self.update_child_dossier_paths(instance)
-
-    #     return Response(serializer.data)
+        try:
+            with transaction.atomic():
+                super().perform_update(serializer)
+                move_subtree(instance, new_parent_dossier)
+        except TreeMoveError as e:
+            raise ValidationError({'parent_dossier': [str(e)]})
 
     @action(methods=["get"], detail=True)
     def dossier_path(self, request, pk=None):
-        if request.method == "GET":
-            try:
-                fol = Dossier.objects.get(pk=pk)
-                dossier_path = fol.path.split('/')
-                dossiers = Dossier.objects.filter(id__in = dossier_path)
-                dossiers_dict = {}
-                for f in dossiers:
-                    dossiers_dict[f.id] = f
-                    # print(f)
-                new_dossier_path = []
-                for p in dossier_path:
-                    value = dossiers_dict.get(int(p))
-                    new_dossier_path.append(value)
-                dossiers_serialisers = DossierSerializer(new_dossier_path, many=True)
-                return Response({"results":dossiers_serialisers.data},status=status.HTTP_200_OK)
-            except Exception as e:
-                logger.warning(f"An error occurred retrieving dossiers: {e!s}")
-                return Response(
-                    {"error": "Error retrieving dossiers, check logs for more detail."},
-                )
-
-    def destroy(self, request, pk, *args, **kwargs):
-        dossier = Dossier.objects.get(id=pk)
-        dossiers = Dossier.objects.filter(path__startswith=dossier.path)
-        documents = Document.objects.filter(dossier__in=dossiers)
-        folders = Folder.objects.filter(id__in=documents.select_related('folder').all().values_list("folder", flat=True))
-        folders.delete()
-        documents.delete()
-        dossiers.delete()
+        try:
+            breadcrumbs = get_breadcrumbs(Dossier, int(pk))
+        except ValueError:
+            raise Http404
+        if breadcrumbs is None:
+            raise Http404
+        return Response({"results": breadcrumbs}, status=status.HTTP_200_OK)
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
+    def destroy(self, request, *args, **kwargs):
+        return queue_subtree_deletion(request, Dossier, [self.get_object().pk])
 
 
 class DossierFormViewSet(ModelViewSet, PermissionsAwareDocumentCountMixin):
@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import celeryd_init
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "paperless.settings")
@@ -15,3 +16,51 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
+
+
+# With the redis broker, lower numbers are consumed first
+CONSUME_PRIORITIES = {
+    "ApiUpload": 0,
+    "ConsumeFolder": 3,
+    "MailFetch": 6,
+}
+
+
+def route_consume_file(name, args, kwargs, options, task=None, **kw):
+    """
+    Routes consume_file by the source of the document: uploads by users go to
+    the interactive queue ahead of the consumption folder, mail attachments
+    to the mail queue.
+    """
+    if name != "documents.tasks.consume_file":
+        return None
+
+    from django.conf import settings
+
+    input_doc = kwargs.get("input_doc", args[0] if args else None)
+    source = getattr(getattr(input_doc, "source", None), "name", None)
+    queue = (
+        settings.TASK_QUEUE_MAIL
+        if source == "MailFetch"
+        else settings.TASK_QUEUE_INTERACTIVE
+    )
+    return {"queue": queue, "priority": CONSUME_PRIORITIES.get(source, 3)}
+
+
+@celeryd_init.connect
+def configure_queue_concurrency(sender=None, conf=None, options=None, **kwargs):
+    """
+    A worker started for a single queue (celery worker -Q bulk) uses the
+    concurrency configured for that queue, unless given on the command line
+    """
+    from django.conf import settings
+
+    queues = (options or {}).get("queues") or []
+    if isinstance(queues, str):
+        queues = queues.split(",")
+    if (
+        len(queues) == 1
+        and queues[0] in settings.TASK_QUEUE_CONCURRENCY
+        and not (options or {}).get("concurrency")
+    ):
+        conf.worker_concurrency = settings.TASK_QUEUE_CONCURRENCY[queues[0]]
@@ -5,6 +5,10 @@ from channels.exceptions import AcceptConnection
 from channels.exceptions import DenyConnection
 from channels.generic.websocket import WebsocketConsumer
 
+from documents.plugins.helpers import STATUS_UPDATES_GROUP
+from documents.plugins.helpers import STATUS_UPDATES_SUPERUSER_GROUP
+from documents.plugins.helpers import get_owner_status_group
+
 
 class StatusConsumer(WebsocketConsumer):
     def _authenticated(self):
@@ -20,21 +24,34 @@ class StatusConsumer(WebsocketConsumer):
             else True
         )
 
+    def _groups(self):
+        # owned updates are only published to the owner and superuser groups,
+        # so other users never receive them in the first place
+        groups = [STATUS_UPDATES_GROUP]
+        if "user" in self.scope and self.scope["user"].is_authenticated:
+            if self.scope["user"].is_superuser:
+                groups.append(STATUS_UPDATES_SUPERUSER_GROUP)
+            else:
+                groups.append(get_owner_status_group(self.scope["user"].id))
+        return groups
+
     def connect(self):
         if not self._authenticated():
             raise DenyConnection
         else:
-            async_to_sync(self.channel_layer.group_add)(
-                "status_updates",
-                self.channel_name,
-            )
+            for group in self._groups():
+                async_to_sync(self.channel_layer.group_add)(
+                    group,
+                    self.channel_name,
+                )
             raise AcceptConnection
 
     def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
-            "status_updates",
-            self.channel_name,
-        )
+        for group in self._groups():
+            async_to_sync(self.channel_layer.group_discard)(
+                group,
+                self.channel_name,
+            )
 
     def status_update(self, event):
         if not self._authenticated():
@@ -18,6 +18,7 @@ from concurrent_log_handler.queue import setup_logging_queues
 from django.utils.translation import gettext_lazy as _
 from dotenv import load_dotenv
 from decouple import config
+from kombu import Queue
 
 # Tap paperless.conf if it's available
 configuration_path = os.getenv("PAPERLESS_CONFIGURATION_PATH")
@@ -201,6 +202,30 @@ def _parse_beat_schedule() -> dict:
                 * 60.0,
             },
         },
+        {
+            "name": "Catch up the index",
+            "env_key": "PAPERLESS_INDEX_CATCHUP_TASK_CRON",
+            # Default every five minutes
+            "env_default": "*/5 * * * *",
+            "task": "documents.tasks.index_catch_up",
+            "options": {
+                # 1 minute before default schedule sends again
+                "expires": 4.0
+                * 60.0,
+            },
+        },
+        {
+            "name": "Remove expired exports",
+            "env_key": "PAPERLESS_EXPORT_CLEANUP_TASK_CRON",
+            # Default hourly at 15 minutes past the hour
+            "env_default": "15 */1 * * *",
+            "task": "documents.tasks.remove_expired_export_jobs",
+            "options": {
+                # 1 minute before default schedule sends again
+                "expires": 59.0
+                * 60.0,
+            },
+        },
         {
             "name": "Perform sanity check",
             "env_key": "PAPERLESS_SANITY_TASK_CRON",
@@ -262,6 +287,8 @@ TRASH_DIR = os.getenv("PAPERLESS_TRASH_DIR")
 # threads.
 MEDIA_LOCK = MEDIA_ROOT / "media.lock"
 INDEX_DIR = DATA_DIR / "index"
+# Lock file making sure only one process drains the index update queue at a time.
+INDEX_QUEUE_LOCK = DATA_DIR / "index_queue.lock"
 MODEL_FILE = DATA_DIR / "classification_model.pickle"
 
 LOGGING_DIR = __get_path("PAPERLESS_LOGGING_DIR", DATA_DIR / "log")
@@ -794,6 +821,9 @@ CELERY_WORKER_HIJACK_ROOT_LOGGER = False
 CELERY_WORKER_CONCURRENCY: Final[int] = __get_int("PAPERLESS_TASK_WORKERS", 1)
 TASK_WORKERS = CELERY_WORKER_CONCURRENCY
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 1
+# Don't let a worker reserve queued tasks, otherwise a high priority task can
+# end up waiting behind the ones already prefetched
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 CELERY_WORKER_SEND_TASK_EVENTS = True
 CELERY_TASK_SEND_SENT_EVENT = True
 CELERY_SEND_TASK_SENT_EVENT = True
@@ -815,6 +845,56 @@ CELERY_TASK_SERIALIZER = "pickle"
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#std-setting-accept_content
 CELERY_ACCEPT_CONTENT = ["application/json", "application/x-python-serialize"]
 
+# Named queues, so that interactive uploads don't wait behind bulk work.
+# Each queue can be served by its own worker, started with -Q <queue>.
+TASK_QUEUE_INTERACTIVE = "interactive"
+TASK_QUEUE_MAIL = "mail"
+TASK_QUEUE_BULK = "bulk"
+TASK_QUEUE_SCHEDULED = "scheduled"
+TASK_QUEUES = [
+    TASK_QUEUE_INTERACTIVE,
+    TASK_QUEUE_MAIL,
+    TASK_QUEUE_BULK,
+    TASK_QUEUE_SCHEDULED,
+]
+
+# Worker concurrency used when a worker only serves one of the queues
+TASK_QUEUE_CONCURRENCY: Final[dict[str, int]] = {
+    TASK_QUEUE_INTERACTIVE: __get_int(
+        "PAPERLESS_TASK_WORKERS_INTERACTIVE",
+        CELERY_WORKER_CONCURRENCY,
+    ),
+    TASK_QUEUE_MAIL: __get_int("PAPERLESS_TASK_WORKERS_MAIL", 1),
+    TASK_QUEUE_BULK: __get_int("PAPERLESS_TASK_WORKERS_BULK", 1),
+    TASK_QUEUE_SCHEDULED: __get_int("PAPERLESS_TASK_WORKERS_SCHEDULED", 1),
+}
+
+# https://docs.celeryq.dev/en/stable/userguide/routing.html
+# All queues are declared, so a worker started without -Q serves every one
+CELERY_TASK_QUEUES = [Queue(queue, routing_key=queue) for queue in TASK_QUEUES]
+CELERY_TASK_DEFAULT_QUEUE = TASK_QUEUE_BULK
+CELERY_TASK_ROUTES = (
+    "paperless.celery.route_consume_file",
+    {
+        "documents.tasks.index_flush_queue": {
+            "queue": TASK_QUEUE_INTERACTIVE,
+        },
+        "paperless_mail.tasks.*": {"queue": TASK_QUEUE_MAIL},
+        "documents.tasks.bulk_update_documents": {"queue": TASK_QUEUE_BULK},
+        "documents.tasks.update_document_archive_file": {"queue": TASK_QUEUE_BULK},
+        "documents.tasks.update_document_field": {"queue": TASK_QUEUE_BULK},
+        "documents.tasks.delete_subtree": {"queue": TASK_QUEUE_BULK},
+        "documents.tasks.run_export_job": {"queue": TASK_QUEUE_BULK},
+        "documents.tasks.remove_expired_export_jobs": {
+            "queue": TASK_QUEUE_SCHEDULED,
+        },
+        "documents.tasks.train_classifier": {"queue": TASK_QUEUE_SCHEDULED},
+        "documents.tasks.index_optimize": {"queue": TASK_QUEUE_SCHEDULED},
+        "documents.tasks.index_catch_up": {"queue": TASK_QUEUE_SCHEDULED},
+        "documents.tasks.sanity_check": {"queue": TASK_QUEUE_SCHEDULED},
+    },
+)
+
 # https://docs.celeryq.dev/en/stable/userguide/configuration.html#beat-schedule
 CELERY_BEAT_SCHEDULE = _parse_beat_schedule()
 
@@ -853,6 +933,25 @@ THREADS_PER_WORKER = os.getenv(
     default_threads_per_worker(CELERY_WORKER_CONCURRENCY),
 )
 
+# Index updates are queued and written in batches by a single task. The delay
+# gives concurrent updates the chance to land in the same batch.
+INDEX_QUEUE_DELAY: Final[int] = __get_int("PAPERLESS_INDEX_QUEUE_DELAY", 2)
+INDEX_QUEUE_BATCH_SIZE: Final[int] = __get_int("PAPERLESS_INDEX_QUEUE_BATCH_SIZE", 500)
+
+# Hours a finished export can be downloaded before it is removed
+EXPORT_JOB_EXPIRY_HOURS: Final[int] = __get_int(
+    "PAPERLESS_EXPORT_JOB_EXPIRY_HOURS",
+    24,
+)
+# Drain the queue right away in the calling process instead, mostly for tests
+INDEX_QUEUE_SYNCHRONOUS: Final[bool] = __get_boolean(
+    "PAPERLESS_INDEX_QUEUE_SYNCHRONOUS",
+)
+
+# Seconds before the last catch up that documents are indexed again from, for
+# changes committed after it which were saved before it
+INDEX_CATCHUP_OVERLAP: Final[int] = __get_int("PAPERLESS_INDEX_CATCHUP_OVERLAP", 60)
+
 APSCHEDULER_DATETIME_FORMAT = "N j, Y, f:s a"  # Default
 
 SCHEDULER_DEFAULT = True
@@ -874,6 +973,12 @@ CONSUMER_INOTIFY_DELAY: Final[float] = __get_float(
     0.5,
 )
 
+# Minimum number of seconds between two progress updates of the same file
+CONSUMER_PROGRESS_INTERVAL: Final[float] = __get_float(
+    "PAPERLESS_CONSUMER_PROGRESS_INTERVAL",
+    0.5,
+)
+
 CONSUMER_DELETE_DUPLICATES = __get_boolean("PAPERLESS_CONSUMER_DELETE_DUPLICATES")
 
 CONSUMER_RECURSIVE = __get_boolean("PAPERLESS_CONSUMER_RECURSIVE")
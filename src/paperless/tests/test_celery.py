@@ -0,0 +1,105 @@
+from pathlib import Path
+from unittest import mock
+
+from django.test import TestCase
+from django.test import override_settings
+
+from documents.data_models import ConsumableDocument
+from documents.data_models import DocumentSource
+from paperless.celery import app
+from paperless.celery import configure_queue_concurrency
+
+
+class TestTaskRouting(TestCase):
+    SAMPLE_FILE = Path(__file__).parent.parent.parent / (
+        "documents/tests/samples/simple.pdf"
+    )
+
+    def _route(self, name, args=(), kwargs=None):
+        route = app.amqp.router.route({}, name, args, kwargs or {})
+        return route["queue"].name, route.get("priority")
+
+    def test_route_consume_file(self):
+        """
+        GIVEN:
+            - Documents from an upload, the consumption folder and a mail
+        WHEN:
+            - Their consume task is routed
+        THEN:
+            - Uploads go to the interactive queue with the highest priority
+            - Consumption folder files go to the interactive queue after them
+            - Mail attachments go to the mail queue
+        """
+        for source, expected in [
+            (DocumentSource.ApiUpload, ("interactive", 0)),
+            (DocumentSource.ConsumeFolder, ("interactive", 3)),
+            (DocumentSource.MailFetch, ("mail", 6)),
+        ]:
+            input_doc = ConsumableDocument(
+                source=source,
+                original_file=self.SAMPLE_FILE,
+            )
+            self.assertEqual(
+                self._route("documents.tasks.consume_file", args=(input_doc, None)),
+                expected,
+            )
+            self.assertEqual(
+                self._route(
+                    "documents.tasks.consume_file",
+                    kwargs={"input_doc": input_doc},
+                ),
+                expected,
+            )
+
+    def test_route_tasks(self):
+        """
+        GIVEN:
+            - Mail, bulk, scheduled and unlisted tasks
+        WHEN:
+            - The tasks are routed
+        THEN:
+            - Each task goes to its queue, unlisted tasks to the bulk queue
+        """
+        for name, queue in [
+            ("paperless_mail.tasks.process_mail_accounts", "mail"),
+            ("documents.tasks.update_document_archive_file", "bulk"),
+            ("documents.tasks.train_classifier", "scheduled"),
+            ("documents.tasks.index_flush_queue", "interactive"),
+            ("documents.tasks.something_else", "bulk"),
+        ]:
+            self.assertEqual(self._route(name)[0], queue)
+
+    def test_worker_queues(self):
+        """
+        GIVEN:
+            - The configured task queues
+        WHEN:
+            - A worker is started without selecting queues
+        THEN:
+            - The worker consumes from all of them
+        """
+        self.assertCountEqual(
+            app.amqp.queues.keys(),
+            ["interactive", "mail", "bulk", "scheduled"],
+        )
+
+    @override_settings(TASK_QUEUE_CONCURRENCY={"bulk": 3})
+    def test_queue_concurrency(self):
+        """
+        GIVEN:
+            - A concurrency configured for the bulk queue
+        WHEN:
+            - Workers are started for different queues
+        THEN:
+            - Only a worker serving just the bulk queue uses it
+        """
+        for options, expected in [
+            ({"queues": ["bulk"]}, 3),
+            ({"queues": "bulk"}, 3),
+            ({"queues": ["bulk"], "concurrency": 5}, None),
+            ({"queues": ["bulk", "mail"]}, None),
+            ({}, None),
+        ]:
+            conf = mock.Mock(worker_concurrency=None)
+            configure_queue_concurrency(conf=conf, options=options)
+            self.assertEqual(conf.worker_concurrency, expected)
@@ -156,6 +156,8 @@ class TestCeleryScheduleParsing(TestCase):
     CLASSIFIER_EXPIRE_TIME = 59.0 * 60.0
     INDEX_EXPIRE_TIME = 23.0 * 60.0 * 60.0
     SANITY_EXPIRE_TIME = ((7.0 * 24.0) - 1.0) * 60.0 * 60.0
+    EXPORT_CLEANUP_EXPIRE_TIME = 59.0 * 60.0
+    INDEX_CATCHUP_EXPIRE_TIME = 4.0 * 60.0
 
     def test_schedule_configuration_default(self):
         """
@@ -185,6 +187,16 @@ class TestCeleryScheduleParsing(TestCase):
                     "schedule": crontab(minute=0, hour=0),
                     "options": {"expires": self.INDEX_EXPIRE_TIME},
                 },
+                "Catch up the index": {
+                    "task": "documents.tasks.index_catch_up",
+                    "schedule": crontab(minute="*/5"),
+                    "options": {"expires": self.INDEX_CATCHUP_EXPIRE_TIME},
+                },
+                "Remove expired exports": {
+                    "task": "documents.tasks.remove_expired_export_jobs",
+                    "schedule": crontab(minute="15", hour="*/1"),
+                    "options": {"expires": self.EXPORT_CLEANUP_EXPIRE_TIME},
+                },
                 "Perform sanity check": {
                     "task": "documents.tasks.sanity_check",
                     "schedule": crontab(minute=30, hour=0, day_of_week="sun"),
@@ -227,6 +239,16 @@ class TestCeleryScheduleParsing(TestCase):
                     "schedule": crontab(minute=0, hour=0),
                     "options": {"expires": self.INDEX_EXPIRE_TIME},
                 },
+                "Catch up the index": {
+                    "task": "documents.tasks.index_catch_up",
+                    "schedule": crontab(minute="*/5"),
+                    "options": {"expires": self.INDEX_CATCHUP_EXPIRE_TIME},
+                },
+                "Remove expired exports": {
+                    "task": "documents.tasks.remove_expired_export_jobs",
+                    "schedule": crontab(minute="15", hour="*/1"),
+                    "options": {"expires": self.EXPORT_CLEANUP_EXPIRE_TIME},
+                },
                 "Perform sanity check": {
                     "task": "documents.tasks.sanity_check",
                     "schedule": crontab(minute=30, hour=0, day_of_week="sun"),
@@ -261,6 +283,16 @@ class TestCeleryScheduleParsing(TestCase):
                     "schedule": crontab(minute="5", hour="*/1"),
                     "options": {"expires": self.CLASSIFIER_EXPIRE_TIME},
                 },
+                "Catch up the index": {
+                    "task": "documents.tasks.index_catch_up",
+                    "schedule": crontab(minute="*/5"),
+                    "options": {"expires": self.INDEX_CATCHUP_EXPIRE_TIME},
+                },
+                "Remove expired exports": {
+                    "task": "documents.tasks.remove_expired_export_jobs",
+                    "schedule": crontab(minute="15", hour="*/1"),
+                    "options": {"expires": self.EXPORT_CLEANUP_EXPIRE_TIME},
+                },
                 "Perform sanity check": {
                     "task": "documents.tasks.sanity_check",
                     "schedule": crontab(minute=30, hour=0, day_of_week="sun"),
@@ -286,6 +318,8 @@ class TestCeleryScheduleParsing(TestCase):
                 "PAPERLESS_TRAIN_TASK_CRON": "disable",
                 "PAPERLESS_SANITY_TASK_CRON": "disable",
                 "PAPERLESS_INDEX_TASK_CRON": "disable",
+                "PAPERLESS_EXPORT_CLEANUP_TASK_CRON": "disable",
+                "PAPERLESS_INDEX_CATCHUP_TASK_CRON": "disable",
             },
         ):
             schedule = _parse_beat_schedule()
@@ -5,7 +5,9 @@ from channels.testing import WebsocketCommunicator
 from django.test import TestCase
 from django.test import override_settings
 
+from documents.plugins.helpers import get_status_update_groups
 from paperless.asgi import application
+from paperless.consumers import StatusConsumer
 
 TEST_CHANNEL_LAYERS = {
     "default": {
@@ -53,3 +55,46 @@ class TestWebSockets(TestCase):
         self.assertEqual(response, message)
 
         await communicator.disconnect()
+
+    async def _connect_as(self, user):
+        communicator = WebsocketCommunicator(StatusConsumer.as_asgi(), "/ws/status/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_receive_owned_updates(self):
+        """
+        GIVEN:
+            - Connected owner, other user and superuser
+        WHEN:
+            - A status update owned by the owner is published
+        THEN:
+            - Owner and superuser receive the update
+            - The other user doesn't
+        """
+        owner = await self._connect_as(
+            mock.Mock(is_authenticated=True, is_superuser=False, id=1),
+        )
+        other = await self._connect_as(
+            mock.Mock(is_authenticated=True, is_superuser=False, id=2),
+        )
+        superuser = await self._connect_as(
+            mock.Mock(is_authenticated=True, is_superuser=True, id=3),
+        )
+
+        message = {"task_id": "test", "owner_id": 1}
+
+        channel_layer = get_channel_layer()
+        for group in get_status_update_groups(1):
+            await channel_layer.group_send(
+                group,
+                {"type": "status_update", "data": message},
+            )
+
+        self.assertEqual(await owner.receive_json_from(), message)
+        self.assertEqual(await superuser.receive_json_from(), message)
+        self.assertTrue(await other.receive_nothing())
+
+        for communicator in [owner, other, superuser]:
+            await communicator.disconnect()